@@ -7,26 +7,99 @@ import time
 import datetime
 import csv
 import random
-from selenium import webdriver
-from selenium.webdriver.common.by import By
-from selenium.webdriver.common.keys import Keys
-from selenium.webdriver.chrome.service import Service as ChromeService
-from webdriver_manager.chrome import ChromeDriverManager
-from apscheduler.schedulers.blocking import BlockingScheduler
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.common.exceptions import TimeoutException, WebDriverException, InvalidSessionIdException
+import collections
+import threading
+import queue
+import atexit
+import abc
+import contextlib
+import importlib
+from concurrent.futures import ThreadPoolExecutor
 import sqlite3
 import json
+import hashlib
+import hmac
+import base64
+import re
 import subprocess
 import traceback
-import undetected_chromedriver as uc
+import signal
+import urllib.request
 
-from PyQt5.QtCore import QSettings, QStandardPaths, QObject, pyqtSignal, QTime, pyqtSlot
-from PyQt5.QtWidgets import QMainWindow, QApplication
-from PyQt5 import uic
 from threading import Thread
 
+# 無介面模式（python main.py serve / coordinate、由介面啟動的引擎子程序 worker 或 SHOPEE_HEADLESS=1）不載入 PyQt5，
+# 以同名的替代物讓介面類別仍可定義（不會被建立）
+_SUBCOMMAND = sys.argv[1] if len(sys.argv) > 1 else None
+HEADLESS = _SUBCOMMAND in ('serve', 'worker', 'coordinate') or os.environ.get('SHOPEE_HEADLESS') == '1'
+if HEADLESS:
+    QObject = QMainWindow = object
+    QSettings = QStandardPaths = QTime = QApplication = None
+
+    def pyqtSignal(*types):
+        return None
+
+    def pyqtSlot(*types):
+        return lambda func: func
+else:
+    from PyQt5.QtCore import QSettings, QStandardPaths, QObject, pyqtSignal, QTime, pyqtSlot
+    from PyQt5.QtWidgets import QMainWindow, QApplication
+
+
+_PROCESS_START = time.perf_counter()
+
+# 較重的套件延後到第一次使用或背景預載時才匯入，讓視窗在 QApplication 建立後立即顯示。
+# 匯入後以同名全域變數提供，用法與直接匯入相同：(全域名稱, 模組, 屬性)
+_HEAVY_IMPORTS = (
+    ('webdriver', 'selenium.webdriver', None),
+    ('By', 'selenium.webdriver.common.by', 'By'),
+    ('Keys', 'selenium.webdriver.common.keys', 'Keys'),
+    ('ChromeService', 'selenium.webdriver.chrome.service', 'Service'),
+    ('WebDriverWait', 'selenium.webdriver.support.ui', 'WebDriverWait'),
+    ('EC', 'selenium.webdriver.support.expected_conditions', None),
+    ('TimeoutException', 'selenium.common.exceptions', 'TimeoutException'),
+    ('WebDriverException', 'selenium.common.exceptions', 'WebDriverException'),
+    ('InvalidSessionIdException', 'selenium.common.exceptions', 'InvalidSessionIdException'),
+    ('ChromeDriverManager', 'webdriver_manager.chrome', 'ChromeDriverManager'),
+    ('BlockingScheduler', 'apscheduler.schedulers.blocking', 'BlockingScheduler'),
+    ('uc', 'undetected_chromedriver', None),
+    ('openai', 'openai', None),
+    ('BeautifulSoup', 'bs4', 'BeautifulSoup'),
+    ('requests', 'requests', None),
+)
+webdriver = By = Keys = ChromeService = WebDriverWait = EC = None
+TimeoutException = WebDriverException = InvalidSessionIdException = None
+ChromeDriverManager = BlockingScheduler = uc = openai = BeautifulSoup = requests = None
+
+_HEAVY_IMPORT_LOCK = threading.Lock()
+_HEAVY_IMPORTS_DONE = False
+# 模組 -> 匯入耗時（秒，含該模組第一次載入的相依套件）
+IMPORT_TIMES = {}
+
+def ensure_heavy_imports():
+    """匯入延後載入的套件（已匯入時立即返回；背景預載進行中時等待其完成）"""
+    global _HEAVY_IMPORTS_DONE
+    if _HEAVY_IMPORTS_DONE:
+        return
+    with _HEAVY_IMPORT_LOCK:
+        if _HEAVY_IMPORTS_DONE:
+            return
+        for name, module_name, attr in _HEAVY_IMPORTS:
+            start = time.perf_counter()
+            module = importlib.import_module(module_name)
+            IMPORT_TIMES.setdefault(module_name, time.perf_counter() - start)
+            globals()[name] = getattr(module, attr) if attr else module
+        _HEAVY_IMPORTS_DONE = True
+    logging.info('延後載入套件完成: ' + ', '.join(f"{m} {t * 1000:.0f} ms" for m, t in IMPORT_TIMES.items()))
+
+def start_import_warmup():
+    """視窗顯示後在背景預先匯入較重的套件，按下登入時通常已載入完成"""
+    def warmup():
+        try:
+            ensure_heavy_imports()
+        except Exception:
+            logging.exception('背景預載套件失敗')
+    Thread(target=warmup, name='import-warmup', daemon=True).start()
 
 ACCOUNT_NUMBER = None
 ACCOUNT_PASSWORD = None
@@ -58,51 +131,207 @@ def log_decorator(func):
     return wrapper
 
 
+def probe_cpu_serial():
+    """
+    以 wmic / PowerShell 讀取本機實際的 CPU 序列號。
+
+    :return: CPU 序列號，兩種方法都讀不到時回傳 None
+    """
+    # 方法1: 嘗試使用 wmic (舊版 Windows)
+    try:
+        command = "wmic cpu get ProcessorId"
+        result = subprocess.check_output(command, shell=True, timeout=10).decode()
+        cpu_serial_number = result.split('\n')[1].strip()
+        if cpu_serial_number:
+            return cpu_serial_number
+    except (subprocess.CalledProcessError, subprocess.TimeoutExpired, FileNotFoundError, IndexError):
+        pass
+
+    # 方法2: 使用 PowerShell (新版 Windows)
+    try:
+        command = 'powershell "Get-WmiObject -Class Win32_Processor | Select-Object -ExpandProperty ProcessorId"'
+        result = subprocess.check_output(command, shell=True, timeout=10).decode().strip()
+        if result:
+            return result
+    except (subprocess.CalledProcessError, subprocess.TimeoutExpired, FileNotFoundError):
+        pass
+    return None
+
+
 @log_decorator
 def verify_cpu_serial(expected_serial):
     """
     驗證當前CPU序列號是否與預期的序列號匹配。
 
     :param expected_serial: 預期的CPU序列號
-    :return: 如果匹配則返回True，否則返回False
+    :return: 匹配時返回實際讀到的序列號（供寫入授權權杖，不必再讀一次），否則返回None
     """
     
     try:
-        # 方法1: 嘗試使用 wmic (舊版 Windows)
-        try:
-            command = "wmic cpu get ProcessorId"
-            result = subprocess.check_output(command, shell=True, timeout=10).decode()
-            cpu_serial_number = result.split('\n')[1].strip()
-            if cpu_serial_number:
-                return cpu_serial_number == expected_serial
-        except (subprocess.CalledProcessError, FileNotFoundError, IndexError):
-            pass
-        
-        # 方法2: 使用 PowerShell (新版 Windows)
-        try:
-            command = 'powershell "Get-WmiObject -Class Win32_Processor | Select-Object -ExpandProperty ProcessorId"'
-            result = subprocess.check_output(command, shell=True, timeout=10).decode().strip()
-            if result:
-                return result == expected_serial
-        except (subprocess.CalledProcessError, FileNotFoundError):
-            pass
+        cpu_serial_number = probe_cpu_serial()
+        if cpu_serial_number:
+            return cpu_serial_number if cpu_serial_number == expected_serial else None
         
         # 方法3: 使用 Python 的 platform 模組
         try:
             import platform
             system_info = f"{platform.processor()}_{platform.machine()}_{platform.node()}"
-            return system_info == expected_serial
+            return system_info if system_info == expected_serial else None
         except:
             pass
         
-        # 如果所有方法都失敗，返回 False
+        # 如果所有方法都失敗，返回 None
         print("警告：無法獲取 CPU 序列號，跳過硬體驗證")
-        return False
+        return None
         
     except Exception as e:
         print(f"CPU 序列號驗證時發生錯誤: {e}")
+        return None
+
+
+# 授權快取：硬體驗證通過後以 Windows DPAPI 保存綁定本機與使用者的權杖，期限內啟動只需在本機解密驗證
+try:
+    LICENSE_RECHECK_DAYS = float(os.environ.get('LICENSE_RECHECK_DAYS', '7'))
+except ValueError:
+    LICENSE_RECHECK_DAYS = 7.0
+
+def machine_fingerprint():
+    """
+    取得本機識別字串（不需啟動外部程式）：登錄檔中的 MachineGuid、主機名稱與架構。
+    MachineGuid 於安裝 Windows 時產生、重開機不變；讀不到時回傳 None（不使用權杖快取）。
+    """
+    import platform
+    try:
+        import winreg
+        with winreg.OpenKey(winreg.HKEY_LOCAL_MACHINE, r"SOFTWARE\Microsoft\Cryptography") as key:
+            machine_guid = winreg.QueryValueEx(key, "MachineGuid")[0]
+    except Exception:
+        return None
+    parts = [machine_guid, platform.node(), platform.machine()]
+    return hashlib.sha256('|'.join(parts).encode('utf-8')).hexdigest()
+
+def _dpapi(data, entropy, protect):
+    """
+    以 Windows DPAPI（CryptProtectData / CryptUnprotectData）加解密，
+    金鑰由作業系統綁定目前使用者與本機，權杖複製到其他電腦或帳號無法解開。
+
+    :return: 結果位元組；非 Windows 或失敗（含資料遭竄改）時回傳 None
+    """
+    if sys.platform != 'win32':
+        return None
+    import ctypes
+    from ctypes import wintypes
+
+    class DataBlob(ctypes.Structure):
+        _fields_ = [('cbData', wintypes.DWORD), ('pbData', ctypes.POINTER(ctypes.c_char))]
+
+    def make_blob(raw):
+        buf = ctypes.create_string_buffer(raw, len(raw))
+        return DataBlob(len(raw), ctypes.cast(buf, ctypes.POINTER(ctypes.c_char))), buf
+
+    CRYPTPROTECT_UI_FORBIDDEN = 0x1
+    try:
+        blob_in, buf_in = make_blob(data)
+        blob_entropy, buf_entropy = make_blob(entropy)
+        blob_out = DataBlob()
+        if protect:
+            ok = ctypes.windll.crypt32.CryptProtectData(
+                ctypes.byref(blob_in), 'license', ctypes.byref(blob_entropy),
+                None, None, CRYPTPROTECT_UI_FORBIDDEN, ctypes.byref(blob_out))
+        else:
+            ok = ctypes.windll.crypt32.CryptUnprotectData(
+                ctypes.byref(blob_in), None, ctypes.byref(blob_entropy),
+                None, None, CRYPTPROTECT_UI_FORBIDDEN, ctypes.byref(blob_out))
+        if not ok:
+            return None
+        try:
+            return ctypes.string_at(blob_out.pbData, blob_out.cbData)
+        finally:
+            ctypes.windll.kernel32.LocalFree(blob_out.pbData)
+    except Exception:
+        logging.exception('DPAPI 加解密失敗')
+        return None
+
+def read_license_token(path, expected_serial, max_age_days=None):
+    """
+    驗證授權權杖：以 DPAPI 解開權杖內容，確認其中記錄的實測 CPU 序列號與預期相符、
+    綁定本機且未超過重新檢查期限。
+
+    :return: 權杖有效時回傳 True
+    """
+    max_age_days = LICENSE_RECHECK_DAYS if max_age_days is None else max_age_days
+    try:
+        fingerprint = machine_fingerprint()
+        if fingerprint is None:
+            return False
+        with open(path, 'r', encoding='utf-8') as f:
+            token = json.load(f)
+        raw = _dpapi(base64.b64decode(token['blob']), fingerprint.encode('utf-8'), protect=False)
+        if raw is None:
+            return False
+        payload = json.loads(raw.decode('utf-8'))
+        if payload.get('fingerprint') != fingerprint:
+            return False
+        if not hmac.compare_digest(str(payload.get('serial', '')), str(expected_serial)):
+            return False
+        issued = float(payload['issued'])
+        return 0 <= time.time() - issued <= max_age_days * 86400
+    except (OSError, ValueError, KeyError, TypeError):
         return False
 
+def write_license_token(path, serial):
+    """
+    寫入綁定本機的授權權杖，非 Windows 或 DPAPI 不可用時不寫入。
+
+    :param serial: verify_cpu_serial 本次實際讀到且與授權相符的序列號
+    :return: 是否寫入權杖
+    """
+    fingerprint = machine_fingerprint()
+    if fingerprint is None or not serial:
+        return False
+    payload = json.dumps({
+        'serial': serial,
+        'fingerprint': fingerprint,
+        'issued': str(int(time.time())),
+    }).encode('utf-8')
+    blob = _dpapi(payload, fingerprint.encode('utf-8'), protect=True)
+    if blob is None:
+        return False
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({'blob': base64.b64encode(blob).decode('ascii')}, f)
+    os.replace(tmp_path, path)
+    return True
+
+@log_decorator
+def verify_license(expected_serial):
+    """
+    啟動時的授權驗證：優先驗證本機授權權杖，權杖不存在、不符或超過 LICENSE_RECHECK_DAYS 時
+    才執行完整的 CPU 序列號驗證（wmic / PowerShell），通過後重新簽發權杖。
+
+    :param expected_serial: 預期的CPU序列號
+    :return: 驗證是否通過
+    """
+    token_path = os.path.join(FILE_PATH, 'license.token')
+    start = time.perf_counter()
+    if read_license_token(token_path, expected_serial):
+        print(f"授權權杖驗證成功（{(time.perf_counter() - start) * 1e6:.0f} µs）")
+        return True
+
+    measured_serial = verify_cpu_serial(expected_serial)
+    verified = measured_serial is not None
+    print(f"完整硬體驗證耗時 {time.perf_counter() - start:.2f} 秒")
+    if verified:
+        try:
+            write_license_token(token_path, measured_serial)
+        except OSError:
+            logging.exception('寫入授權權杖失敗')
+    else:
+        try:
+            os.remove(token_path)
+        except OSError:
+            pass
+    return verified
 
 @log_decorator
 def read_whitelist():
@@ -137,6 +366,258 @@ def update_whitelist(customer_name):
         for name, last_reply in whitelist.items():
             writer.writerow([name, last_reply])
 
+class ReplyJournal():
+    """
+    回覆預寫日誌（append-only write-ahead journal）。
+
+    每一次回覆依序寫入三種狀態：
+    intent（回覆內容已產生、尚未輸入）→ sent（已輸入對話框）→ done（已更新回覆名單）。
+    intent 與 sent 會立即 fsync，done 則批次 fsync。程式重新啟動或瀏覽器重啟後重播日誌，
+    停在 sent 的回覆直接補寫回覆名單，停在 intent 的回覆在下次開啟該客人時、浮水印仍相同的情況下
+    沿用已記錄的內容，不需要重新擷取對話或再次詢問 LLM；浮水印已改變的 intent 記為 dropped 捨棄。
+    日誌超過 compact_bytes 時只保留未完成的紀錄重寫。
+    """
+    def __init__(self, path, fsync_batch=16, fsync_interval=2.0, compact_bytes=1024 * 1024):
+        self.path = path
+        self.fsync_batch = fsync_batch
+        self.fsync_interval = fsync_interval
+        self.compact_bytes = compact_bytes
+        self.pending = {}  # 客戶名稱 -> 尚未完成的最新紀錄
+        self._lock = threading.RLock()
+        self._file = None
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+        self.replay()
+
+    @staticmethod
+    def content_hash(text):
+        return hashlib.sha256((text or '').encode('utf-8')).hexdigest()
+
+    def _open(self):
+        if self._file is None:
+            self._file = open(self.path, 'a', encoding='utf-8')
+        return self._file
+
+    def _sync(self):
+        if self._file is not None:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def _append(self, record, durable=False):
+        line = json.dumps(record, ensure_ascii=False)
+        with self._lock:
+            f = self._open()
+            f.write(line + '\n')
+            self._unsynced += 1
+            if durable or self._unsynced >= self.fsync_batch or time.monotonic() - self._last_sync >= self.fsync_interval:
+                self._sync()
+            if record['state'] in ('done', 'dropped'):
+                self.pending.pop(record['customer'], None)
+                # 長時間執行時日誌只在完成回覆後才可能變長，此時順便檢查是否需要壓縮
+                if f.tell() >= self.compact_bytes:
+                    self._sync()
+                    self._compact_if_needed()
+            else:
+                self.pending[record['customer']] = record
+
+    def record_intent(self, customer, watermark, text):
+        """回覆內容已產生，輸入對話框前呼叫（立即落盤）"""
+        self._append({'ts': time.time(), 'customer': customer, 'watermark': watermark,
+                      'hash': self.content_hash(text), 'state': 'intent', 'text': text}, durable=True)
+
+    def record_sent(self, customer, watermark, text):
+        """回覆已輸入對話框後呼叫（立即落盤，避免重啟後重複回覆）"""
+        self._append({'ts': time.time(), 'customer': customer, 'watermark': watermark,
+                      'hash': self.content_hash(text), 'state': 'sent'}, durable=True)
+
+    def record_done(self, customer, watermark, text):
+        """回覆名單已更新後呼叫（批次落盤）"""
+        self._append({'ts': time.time(), 'customer': customer, 'watermark': watermark,
+                      'hash': self.content_hash(text), 'state': 'done'})
+
+    def pending_intent(self, customer, watermark):
+        """
+        回傳該客人尚未輸入的回覆紀錄（含內容），沒有則回傳 None。
+        紀錄的浮水印與目前不同（客人之後又傳了新訊息）時，舊內容已不適用，記為 dropped 並回傳 None。
+        """
+        with self._lock:
+            record = self.pending.get(customer)
+            if not (record and record['state'] == 'intent' and record.get('text')):
+                return None
+            if record.get('watermark') != watermark:
+                self._append({'ts': time.time(), 'customer': customer, 'watermark': record.get('watermark'),
+                              'hash': record.get('hash'), 'state': 'dropped'})
+                print(f"回覆日誌：客人 {customer} 已有新訊息，捨棄先前產生的回覆內容")
+                return None
+            return record
+
+    def has_partial(self, customer):
+        """該客人是否有內容未知的 intent（串流輸入途中中斷）"""
+        with self._lock:
+            record = self.pending.get(customer)
+            return bool(record and record['state'] == 'intent' and not record.get('text'))
+
+    def replay(self):
+        """重播日誌，重建每位客人最新的未完成狀態"""
+        pending = {}
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        # 當機時最後一行可能不完整，略過
+                        continue
+                    customer = record.get('customer')
+                    if not customer:
+                        continue
+                    if record.get('state') in ('done', 'dropped'):
+                        pending.pop(customer, None)
+                    elif record.get('state') == 'sent' and customer in pending:
+                        # 保留 intent 的內容以便比對
+                        pending[customer] = dict(pending[customer], **record)
+                    else:
+                        pending[customer] = record
+        except FileNotFoundError:
+            pass
+        with self._lock:
+            self.pending = pending
+        return pending
+
+    def recover(self):
+        """
+        續做未完成的回覆：已輸入（sent）的直接補寫回覆名單；
+        尚未輸入（intent）的保留在 pending 中，由 reply_task 沿用內容。
+        """
+        with self._lock:
+            records = list(self.pending.values())
+        for record in records:
+            if record.get('state') == 'sent':
+                try:
+                    update_whitelist(record['customer'])
+                    update_watermark(record['customer'], record.get('watermark'), record.get('text'))
+                    self._append({'ts': time.time(), 'customer': record['customer'],
+                                  'watermark': record.get('watermark'), 'hash': record.get('hash'),
+                                  'state': 'done'})
+                    print(f"回覆日誌：補記已回覆客人 {record['customer']}")
+                except Exception:
+                    logging.exception('回覆日誌續做失敗')
+        with self._lock:
+            self._sync()
+            self._compact_if_needed()
+        return [r for r in self.pending.values() if r.get('state') == 'intent']
+
+    def _compact_if_needed(self):
+        try:
+            if os.path.getsize(self.path) < self.compact_bytes:
+                return
+        except OSError:
+            return
+        # 只保留未完成的紀錄，重寫後以原子方式取代
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for record in self.pending.values():
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        os.replace(tmp_path, self.path)
+
+    def close(self):
+        with self._lock:
+            try:
+                self._sync()
+            except Exception:
+                pass
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+REPLY_JOURNAL = None
+_REPLY_JOURNAL_LOCK = threading.Lock()
+
+def get_reply_journal():
+    """取得全域回覆日誌，第一次取得時重播並續做未完成的回覆"""
+    global REPLY_JOURNAL
+    with _REPLY_JOURNAL_LOCK:
+        if REPLY_JOURNAL is None:
+            REPLY_JOURNAL = ReplyJournal(os.path.join(FILE_PATH, 'reply_journal.log'))
+            atexit.register(REPLY_JOURNAL.close)
+            REPLY_JOURNAL.recover()
+        return REPLY_JOURNAL
+
+_PREVIEW_NOISE_RE = re.compile(r'^(\d{1,2}:\d{2}|\d{1,4}[/-]\d{1,2}([/-]\d{1,4})?|昨天|今天|星期.|週.|Yesterday|Today)$')
+
+def conversation_preview(reply_element):
+    """
+    取得對話列表中客人欄位的預覽文字（客人名稱與最後訊息），去除會隨日期變動的時間標籤。
+
+    :param reply_element: 對話列表中的客人元素
+    :return: 預覽文字，取得失敗時回傳 None
+    """
+    try:
+        lines = [line.strip() for line in (reply_element.text or '').splitlines()]
+        return '\n'.join(line for line in lines if line and not _PREVIEW_NOISE_RE.match(line))
+    except Exception:
+        return None
+
+def conversation_watermark(preview_text):
+    """
+    以客人欄位的預覽文字計算訊息浮水印。
+
+    :param preview_text: conversation_preview 取得的預覽文字
+    :return: 浮水印字串，預覽文字為 None 時回傳 None
+    """
+    if preview_text is None:
+        return None
+    return hashlib.sha1(preview_text.encode('utf-8')).hexdigest()
+
+_WATERMARKS = None
+_WATERMARKS_LOCK = threading.Lock()
+
+def read_watermarks():
+    """
+    讀取每位客人的回覆浮水印（最後一次回覆時的預覽浮水印與回覆開頭）。
+
+    :return: 客戶名稱 -> 浮水印紀錄 的字典
+    """
+    global _WATERMARKS
+    with _WATERMARKS_LOCK:
+        if _WATERMARKS is None:
+            try:
+                with open(os.path.join(FILE_PATH, 'reply_watermarks.json'), 'r', encoding='utf-8') as f:
+                    _WATERMARKS = json.load(f)
+            except (FileNotFoundError, json.JSONDecodeError):
+                _WATERMARKS = {}
+        return _WATERMARKS
+
+@log_decorator
+def update_watermark(customer_name, watermark, reply_text=None):
+    """
+    更新客人的回覆浮水印。
+
+    :param customer_name: 客戶名稱
+    :param watermark: 回覆當下的預覽浮水印
+    :param reply_text: 回覆內容，保留開頭以判斷預覽是否為我方訊息
+    """
+    watermarks = read_watermarks()
+    reply_head = (reply_text or '').strip().split('\n')[0][:20]
+    with _WATERMARKS_LOCK:
+        watermarks[customer_name] = {
+            'preview': watermark,
+            'reply_head': reply_head,
+            'ts': datetime.datetime.now().strftime('%Y/%m/%d %H:%M'),
+        }
+        path = os.path.join(FILE_PATH, 'reply_watermarks.json')
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(watermarks, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
 def read_database(db_path, column):
     """
     從 SQLite 資料庫中讀取指定欄位的單個值。
@@ -171,76 +652,418 @@ def read_database(db_path, column):
     else:
         return None
 
+# 超出時間預算、延後到下一輪處理的客人
+DEFERRED_CUSTOMERS = set()
+
+# 引擎執行狀態（本輪數、上一輪耗時、累計回覆數），供狀態端點與介面查詢
+ENGINE_STATUS = {
+    'cycles': 0,
+    'replies': 0,
+    'last_cycle_seconds': None,
+    'last_cycle_started': None,
+    'last_reply_type': None,
+}
+
+# 每輪與每位客人的時間預算（秒）
+try:
+    CYCLE_BUDGET_SEC = float(os.environ.get('CYCLE_BUDGET_SEC', '55'))
+    CONVERSATION_BUDGET_SEC = float(os.environ.get('CONVERSATION_BUDGET_SEC', '25'))
+except ValueError:
+    CYCLE_BUDGET_SEC, CONVERSATION_BUDGET_SEC = 55.0, 25.0
+
+class DeadlineExceeded(BaseException):
+    """
+    時間預算用盡。繼承 BaseException，避免被流程中既有的 except Exception 吞掉，
+    需要處理的地方以 except DeadlineExceeded 明確攔截。
+    """
+
+class Deadline():
+    """以 monotonic 時鐘計算的截止時間"""
+    def __init__(self, seconds, name=''):
+        self.name = name
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self):
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self):
+        return time.monotonic() >= self.expires_at
+
+_DEADLINE_STATE = threading.local()
+# 超出預算的次數（cycle: 整輪, conversation: 單一客人）
+OVER_BUDGET_COUNTERS = collections.Counter()
+
+@contextlib.contextmanager
+def deadline_exempt():
+    """暫時不受目前執行緒的時間預算限制（用於跨輪重複使用的準備工作，例如建立分頁池）"""
+    stack = getattr(_DEADLINE_STATE, 'stack', None)
+    _DEADLINE_STATE.stack = []
+    try:
+        yield
+    finally:
+        _DEADLINE_STATE.stack = stack
+
+@contextlib.contextmanager
+def deadline_scope(seconds, name=''):
+    """
+    在目前執行緒設定時間預算，巢狀使用時以最早的截止時間為準。
+    預算內的等待、LLM 呼叫與擷取都透過 budget_timeout 取得剩餘時間。
+    """
+    stack = getattr(_DEADLINE_STATE, 'stack', None)
+    if stack is None:
+        stack = _DEADLINE_STATE.stack = []
+    deadline = Deadline(seconds, name)
+    stack.append(deadline)
+    try:
+        yield deadline
+    finally:
+        stack.remove(deadline)
+
+def current_deadline():
+    """回傳目前執行緒最早到期的 Deadline，沒有設定時回傳 None"""
+    stack = getattr(_DEADLINE_STATE, 'stack', None)
+    if not stack:
+        return None
+    return min(stack, key=lambda d: d.expires_at)
+
+def budget_timeout(timeout):
+    """
+    以剩餘預算限制等待時間。
+
+    :param timeout: 原本的等待秒數
+    :return: 不超過剩餘預算的等待秒數
+    :raises DeadlineExceeded: 預算已用盡
+    """
+    deadline = current_deadline()
+    if deadline is None:
+        return timeout
+    remaining = deadline.remaining()
+    if remaining <= 0:
+        raise DeadlineExceeded(f'{deadline.name} 時間預算已用盡')
+    return min(timeout, remaining)
+
+# 導覽紀錄擷取層級（0: 僅時間與備註, 1: 加上網址, 2: 加上標題與 referrer）
+try:
+    NAV_DEBUG_LEVEL = int(os.environ.get('NAV_DEBUG_LEVEL', '0'))
+except ValueError:
+    NAV_DEBUG_LEVEL = 0
+
+class NavJournal():
+    """
+    導覽紀錄緩衝區。
+
+    record_nav 只把紀錄放進有上限的環狀緩衝區，由背景執行緒定期或累積到一定筆數時
+    批次寫入 nav_history.log，檔案超過大小上限時依序輪替為 .1、.2 ...。
+    """
+    def __init__(self, path, maxlen=2000, batch_size=200, flush_interval=2.0,
+                 max_bytes=5 * 1024 * 1024, backup_count=3):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.buffer = collections.deque(maxlen=maxlen)
+        self.dropped = 0
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread = Thread(target=self._writer_loop, name='NavJournalWriter', daemon=True)
+        self._thread.start()
+
+    def append(self, entry):
+        """加入一筆紀錄，entry 為 (timestamp, url, title, referrer, note) 或已格式化的字串"""
+        with self._lock:
+            if len(self.buffer) == self.buffer.maxlen:
+                self.dropped += 1
+            self.buffer.append(entry)
+            pending = len(self.buffer)
+        if pending >= self.batch_size:
+            self._wakeup.set()
+
+    @staticmethod
+    def _format(entry):
+        if isinstance(entry, str):
+            return entry
+        ts, url, title, referrer, note = entry
+        ts_text = datetime.datetime.fromtimestamp(ts).strftime('%Y-%m-%d %H:%M:%S')
+        return f"[{ts_text}] url={url or ''} title={title} ref={referrer} note={note}\n"
+
+    def flush(self):
+        with self._lock:
+            entries = list(self.buffer)
+            self.buffer.clear()
+            dropped, self.dropped = self.dropped, 0
+        if not entries:
+            return
+        lines = [self._format(entry) for entry in entries]
+        if dropped:
+            lines.insert(0, f"[緩衝區已滿，捨棄 {dropped} 筆較舊的導覽紀錄]\n")
+        try:
+            self._rotate_if_needed()
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.writelines(lines)
+        except Exception:
+            pass
+
+    def _rotate_if_needed(self):
+        try:
+            if os.path.getsize(self.path) < self.max_bytes:
+                return
+        except OSError:
+            return
+        for i in range(self.backup_count - 1, 0, -1):
+            src = f"{self.path}.{i}"
+            if os.path.exists(src):
+                os.replace(src, f"{self.path}.{i + 1}")
+        os.replace(self.path, f"{self.path}.1")
+
+    def _writer_loop(self):
+        while not self._stop.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+        self.flush()
+
+    def close(self):
+        self._stop.set()
+        self._wakeup.set()
+        self._thread.join(timeout=5)
+
+_NAV_JOURNALS = {}
+_NAV_JOURNALS_LOCK = threading.Lock()
+
+def get_nav_journal(path):
+    """取得（或建立）指定路徑共用的導覽紀錄緩衝區"""
+    with _NAV_JOURNALS_LOCK:
+        journal = _NAV_JOURNALS.get(path)
+        if journal is None:
+            journal = NavJournal(path)
+            _NAV_JOURNALS[path] = journal
+        return journal
+
+@atexit.register
+def _close_nav_journals():
+    for journal in list(_NAV_JOURNALS.values()):
+        try:
+            journal.close()
+        except Exception:
+            pass
+
+# 是否保留一個已啟動、已載入 Cookie 的備用瀏覽器，瀏覽器失效時直接切換
+WARM_STANDBY = os.environ.get('WARM_STANDBY', '0') == '1'
+
+_STEALTH_JS = """
+  Object.defineProperty(navigator, 'webdriver', {get: () => undefined});
+  Object.defineProperty(navigator, 'languages', {get: () => ['zh-TW','zh','en-US']});
+  Object.defineProperty(navigator, 'plugins', {get: () => [1,2,3]});
+  Object.defineProperty(navigator, 'platform', {get: () => 'Win32'});
+  Object.defineProperty(navigator, 'vendor', {get: () => 'Google Inc.'});
+  Object.defineProperty(navigator, 'hardwareConcurrency', {get: () => 8});
+  Object.defineProperty(navigator, 'deviceMemory', {get: () => 8});
+"""
+
+# 精簡模式：不載入圖片、字型、媒體與追蹤腳本，限制 renderer 數量以降低記憶體用量
+LEAN_BROWSER = os.environ.get('LEAN_BROWSER', '0') == '1'
+# 無頭模式（Chrome 新版 headless），不顯示瀏覽器視窗
+# 引擎子程序（worker）仍由使用者在瀏覽器完成驗證，預設不使用無頭模式
+BROWSER_HEADLESS = os.environ.get('BROWSER_HEADLESS', '1' if HEADLESS and _SUBCOMMAND != 'worker' else '0') == '1'
+# 瀏覽器效能追蹤：以 chromedriver 的 performance log 持續收集 Chrome trace 事件，
+# 本輪耗時超過門檻時寫成可在 DevTools Performance 面板載入的 traces/*.json，未超過則丟棄
+BROWSER_TRACE = os.environ.get('BROWSER_TRACE', '0') == '1'
+BROWSER_TRACE_THRESHOLD_SEC = float(os.environ.get('BROWSER_TRACE_THRESHOLD_SEC', '20'))
+# traces/ 保留的檔案數
+BROWSER_TRACE_KEEP = int(os.environ.get('BROWSER_TRACE_KEEP', '20'))
+# Performance 面板需要的分類：主執行緒任務、繪製影格、載入、使用者時序與 JS 取樣堆疊
+_TRACE_CATEGORIES = ','.join([
+    'devtools.timeline',
+    'disabled-by-default-devtools.timeline',
+    'disabled-by-default-devtools.timeline.frame',
+    'toplevel',
+    'loading',
+    'latencyInfo',
+    'blink.user_timing',
+    'v8.execute',
+    'disabled-by-default-v8.cpu_profiler',
+])
+
+# 精簡模式以 CDP Network.setBlockedURLs 封鎖的網址（蝦皮圖片網址沒有副檔名，另外列出圖片網域）
+_LEAN_BLOCKED_URLS = [
+    '*.png', '*.jpg', '*.jpeg', '*.gif', '*.webp', '*.ico',
+    '*.woff', '*.woff2', '*.ttf', '*.otf',
+    '*.mp4', '*.webm', '*.mp3', '*.ogg',
+    '*cf.shopee.tw/file/*', '*susercontent.com/file/*',
+    '*google-analytics.com*', '*googletagmanager.com*', '*doubleclick.net*',
+    '*connect.facebook.net*', '*hotjar.com*',
+]
+
+_LEAN_ARGUMENTS = [
+    '--blink-settings=imagesEnabled=false',
+    '--renderer-process-limit=2',
+    '--disable-extensions',
+    '--disable-background-networking',
+    '--disable-component-update',
+    '--disable-default-apps',
+    '--disable-sync',
+    '--mute-audio',
+    '--disable-features=Translate,MediaRouter,OptimizationHints,AutofillServerCommunication',
+]
+
 #瀏覽器對象
+def chrome_trace_events(entries):
+    """
+    從 chromedriver 的 performance log 取出 trace 事件。
+
+    :param entries: driver.get_log('performance') 的結果
+    :return: (trace 事件列表, 緩衝區最高使用率 0~1；接近 1 表示有事件被丟棄)
+    """
+    events = []
+    buffer_usage = 0.0
+    for entry in entries:
+        try:
+            message = json.loads(entry['message'])['message']
+        except (KeyError, TypeError, ValueError):
+            continue
+        params = message.get('params', {})
+        if message.get('method') == 'Tracing.dataCollected':
+            # chromedriver 每筆紀錄放一個事件；直接轉送 CDP 事件時則是 value 列表
+            if isinstance(params.get('value'), list):
+                events.extend(params['value'])
+            else:
+                events.append(params)
+        elif message.get('method') == 'Tracing.bufferUsage':
+            buffer_usage = max(buffer_usage, params.get('percentFull', 0.0))
+    return events, buffer_usage
+
+def write_chrome_trace(entries, label, metadata=None):
+    """
+    將 performance log 寫成 Chrome trace 格式（{"traceEvents": [...]}），
+    可在 DevTools Performance 面板或 chrome://tracing、Perfetto 載入；只保留最新 BROWSER_TRACE_KEEP 個檔案。
+
+    :return: trace 檔路徑
+    """
+    events, buffer_usage = chrome_trace_events(entries)
+    directory = os.path.join(FILE_PATH, 'traces')
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{label}_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    metadata = dict(metadata or {}, event_count=len(events), buffer_usage=buffer_usage)
+    if buffer_usage >= 0.99:
+        print("瀏覽器 trace 緩衝區已滿，部分事件遺失")
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'traceEvents': events, 'metadata': metadata}, f)
+    traces = sorted((os.path.join(directory, name) for name in os.listdir(directory) if name.endswith('.json')),
+                    key=os.path.getmtime)
+    for old_path in traces[:-BROWSER_TRACE_KEEP]:
+        try:
+            os.remove(old_path)
+        except OSError:
+            pass
+    return path
+
 class WebDriverManager():
+    USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0.0.0 Safari/537.36'
+    # uc.Chrome 啟動時會修補 chromedriver 執行檔，同時啟動兩個瀏覽器需排隊
+    _LAUNCH_LOCK = threading.Lock()
+
     def __init__(self):
         try:
             # 可使用既有的真實 Chrome 個人資料夾 (環境變數 REAL_CHROME_PROFILE)
             profile_dir = os.environ.get('REAL_CHROME_PROFILE') or os.path.join(FILE_PATH, 'chrome_profile')
             os.makedirs(profile_dir, exist_ok=True)
             self.profile_dir = profile_dir
+            # 備用瀏覽器與使用中的瀏覽器輪流使用兩個個人資料夾（同一資料夾無法同時開啟兩個 Chrome）
+            self.profile_dirs = [profile_dir, profile_dir.rstrip('\\/') + '_standby']
 
-            # 修復可能壞掉的 Chrome 偏好檔，避免 uc 載入 JSON 失敗
-            try:
-                self._sanitize_chrome_profile()
-            except Exception:
-                pass
             # 保存 UA 並建立 options
-            self.user_agent = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0.0.0 Safari/537.36'
-            self.options = self._build_options()
-            self.driver = uc.Chrome(options=self.options)
-
-            self.driver.execute_cdp_cmd(
-                "Page.addScriptToEvaluateOnNewDocument",
-                {"source": """
-                  Object.defineProperty(navigator, 'webdriver', {get: () => undefined});
-                  Object.defineProperty(navigator, 'languages', {get: () => ['zh-TW','zh','en-US']});
-                  Object.defineProperty(navigator, 'plugins', {get: () => [1,2,3]});
-                  Object.defineProperty(navigator, 'platform', {get: () => 'Win32'});
-                  Object.defineProperty(navigator, 'vendor', {get: () => 'Google Inc.'});
-                  Object.defineProperty(navigator, 'hardwareConcurrency', {get: () => 8});
-                  Object.defineProperty(navigator, 'deviceMemory', {get: () => 8});
-                """}
-            )
-            try:
-                # 時區與在地化
-                self.driver.execute_cdp_cmd('Emulation.setTimezoneOverride', { 'timezoneId': 'Asia/Taipei' })
-            except Exception:
-                pass
-            try:
-                self.driver.execute_cdp_cmd('Emulation.setLocaleOverride', { 'locale': 'zh-TW' })
-            except Exception:
-                pass
-            try:
-                self.driver.execute_cdp_cmd('Network.setUserAgentOverride', {
-                    'userAgent': self.user_agent,
-                    'acceptLanguage': 'zh-TW,zh;q=0.9,en-US;q=0.8,en;q=0.7',
-                    'platform': 'Windows'
-                })
-            except Exception:
-                pass
+            self.user_agent = self.USER_AGENT
+            self.driver = self._launch_driver(profile_dir)
+
+            # 備用瀏覽器（WARM_STANDBY）
+            self.standby = None  # (driver, profile_dir)
+            self.standby_thread = None
+            self.last_cookies = None
+            self._standby_lock = threading.Lock()
+            atexit.register(self.close_standby)
 
-            # 導覽紀錄
+            # 導覽紀錄（記憶體環狀緩衝，由背景執行緒批次寫檔）
             self.last_url = None
             self.nav_log_path = os.path.join(FILE_PATH, 'nav_history.log')
-            try:
-                with open(self.nav_log_path, 'a', encoding='utf-8') as f:
-                    f.write(f"===== 啟動瀏覽器 {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')} =====\n")
-            except Exception:
-                pass
+            self.nav_debug_level = NAV_DEBUG_LEVEL
+            self.nav_journal = get_nav_journal(self.nav_log_path)
+            self.tab_pool = None  # 多分頁模式的分頁池（CHAT_TAB_COUNT > 1）
+            self.nav_journal.append(f"===== 啟動瀏覽器 {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')} =====\n")
         except Exception:
             logging.exception('初始化 WebDriver 失敗')
             print(traceback.format_exc())
             raise
 
-    def _sanitize_chrome_profile(self):
+    @classmethod
+    def _launch_driver(cls, profile_dir, lean=None, headless=None):
+        """
+        以指定的個人資料夾啟動瀏覽器並注入偽裝腳本、時區與語系設定。
+
+        :param profile_dir: Chrome 個人資料夾
+        :param lean: 是否使用精簡模式，預設依 LEAN_BROWSER
+        :param headless: 是否使用無頭模式，預設依 BROWSER_HEADLESS
+        :return: uc.Chrome 實例
+        """
+        ensure_heavy_imports()
+        lean = LEAN_BROWSER if lean is None else lean
+        headless = BROWSER_HEADLESS if headless is None else headless
+        os.makedirs(profile_dir, exist_ok=True)
+        # 修復可能壞掉的 Chrome 偏好檔，避免 uc 載入 JSON 失敗
+        try:
+            cls._sanitize_chrome_profile(profile_dir)
+        except Exception:
+            pass
+        # options 不可重複使用，每次啟動都重建
+        options = cls._build_options(profile_dir, lean=lean, headless=headless, trace=BROWSER_TRACE)
+        with cls._LAUNCH_LOCK:
+            driver = uc.Chrome(options=options)
+        cls.setup_target(driver, lean)
+        return driver
+
+    @classmethod
+    def setup_target(cls, driver, lean=None):
+        """
+        對目前分頁套用偽裝腳本、時區、語系、UA 與精簡模式的網址封鎖。
+        這些 CDP 設定只作用在當下的分頁，新開的分頁切換過去後必須再呼叫一次。
+        """
+        lean = LEAN_BROWSER if lean is None else lean
+        if lean:
+            try:
+                driver.execute_cdp_cmd('Network.enable', {})
+                driver.execute_cdp_cmd('Network.setBlockedURLs', {'urls': _LEAN_BLOCKED_URLS})
+            except Exception:
+                logging.exception('設定封鎖網址失敗')
+
+        driver.execute_cdp_cmd("Page.addScriptToEvaluateOnNewDocument", {"source": _STEALTH_JS})
+        try:
+            # 時區與在地化
+            driver.execute_cdp_cmd('Emulation.setTimezoneOverride', { 'timezoneId': 'Asia/Taipei' })
+        except Exception:
+            pass
+        try:
+            driver.execute_cdp_cmd('Emulation.setLocaleOverride', { 'locale': 'zh-TW' })
+        except Exception:
+            pass
+        try:
+            driver.execute_cdp_cmd('Network.setUserAgentOverride', {
+                'userAgent': cls.USER_AGENT,
+                'acceptLanguage': 'zh-TW,zh;q=0.9,en-US;q=0.8,en;q=0.7',
+                'platform': 'Windows'
+            })
+        except Exception:
+            pass
+
+    @staticmethod
+    def _sanitize_chrome_profile(profile_dir):
         try:
-            default_dir = os.path.join(self.profile_dir, 'Default')
+            default_dir = os.path.join(profile_dir, 'Default')
             os.makedirs(default_dir, exist_ok=True)
             candidates = [
                 os.path.join(default_dir, 'Preferences'),
                 os.path.join(default_dir, 'Secure Preferences'),
-                os.path.join(self.profile_dir, 'Local State'),
+                os.path.join(profile_dir, 'Local State'),
             ]
             for path in candidates:
                 if not os.path.exists(path):
@@ -263,44 +1086,231 @@ class WebDriverManager():
         except Exception:
             pass
 
-    def _build_options(self):
+    @classmethod
+    def _build_options(cls, profile_dir, lean=False, headless=False, trace=False):
         options = uc.ChromeOptions()
         prefs = {"profile.default_content_setting_values.notifications": 2}
+        if lean:
+            prefs["profile.managed_default_content_settings.images"] = 2
         options.add_experimental_option("prefs", prefs)
-        options.add_argument(f'--user-agent={self.user_agent}')
-        options.add_argument(f'--user-data-dir={self.profile_dir}')
+        options.add_argument(f'--user-agent={cls.USER_AGENT}')
+        options.add_argument(f'--user-data-dir={profile_dir}')
         options.add_argument('--profile-directory=Default')
         options.add_argument('--lang=zh-TW')
         options.add_argument('--ignore-certificate-errors')
         options.add_argument('--ignore-ssl-errors')
         options.add_argument('--disable-blink-features=AutomationControlled')
         options.add_argument('--window-size=1280,860')
+        if lean:
+            for argument in _LEAN_ARGUMENTS:
+                options.add_argument(argument)
+        if headless:
+            options.add_argument('--headless=new')
+        if trace:
+            # chromedriver 在背景執行 Tracing，每次 get_log('performance') 取出目前累積的 trace 事件
+            options.set_capability('goog:loggingPrefs', {'performance': 'ALL'})
+            options.add_experimental_option('perfLoggingPrefs', {
+                'enableNetwork': False,
+                'enablePage': False,
+                'traceCategories': _TRACE_CATEGORIES,
+                'bufferUsageReportingInterval': 1000,
+            })
         return options
-    
-    def restart_driver(self, target_after: str | None = None):
+
+    def refresh_standby(self):
+        """
+        保存目前瀏覽器的 Cookie，並確保備用瀏覽器已就緒或正在背景啟動。
+        只在回覆執行緒的空檔呼叫（WebDriver 不可跨執行緒同時操作同一個瀏覽器）。
+        """
+        if not WARM_STANDBY:
+            return
+        try:
+            self.last_cookies = self.driver.get_cookies()
+        except Exception:
+            pass
+        with self._standby_lock:
+            standby = self.standby
+        if standby is not None and self.last_cookies:
+            # 同步最新的 Cookie，避免切換後登入已過期
+            self._apply_cookies(standby[0], self.last_cookies)
+        self.start_standby()
+
+    def start_standby(self, wait_for=None):
+        """
+        在背景啟動備用瀏覽器（已有或正在啟動時不動作）。
+
+        :param wait_for: 啟動前需等待結束的執行緒（例如舊瀏覽器的關閉），以釋放個人資料夾
+        """
+        if not WARM_STANDBY:
+            return
+        with self._standby_lock:
+            if self.standby is not None or (self.standby_thread is not None and self.standby_thread.is_alive()):
+                return
+            profile_dir = next(d for d in self.profile_dirs if d != self.profile_dir)
+            cookies = self.last_cookies
+            self.standby_thread = Thread(target=self._build_standby, args=(profile_dir, cookies, wait_for),
+                                         name='standby-browser', daemon=True)
+            self.standby_thread.start()
+
+    def _build_standby(self, profile_dir, cookies, wait_for):
+        start = time.monotonic()
         try:
+            if wait_for is not None:
+                wait_for.join(timeout=30)
+            driver = self._launch_driver(profile_dir)
+            driver.get("https://seller.shopee.tw")
+            if cookies:
+                self._apply_cookies(driver, cookies)
+            driver.get("https://seller.shopee.tw/new-webchat/conversations")
+        except Exception:
+            logging.exception('備用瀏覽器啟動失敗')
+            print("備用瀏覽器啟動失敗，下次重啟時改為重新啟動瀏覽器")
+            return
+        with self._standby_lock:
+            self.standby = (driver, profile_dir)
+        print(f"備用瀏覽器已就緒（{time.monotonic() - start:.1f} 秒）")
+
+    @staticmethod
+    def _apply_cookies(driver, cookies):
+        for ck in cookies:
+            ck = dict(ck)
+            ck.pop('sameSite', None)
             try:
-                self.driver.quit()
+                driver.add_cookie(ck)
             except Exception:
-                pass
-            # 重啟時不可重用 options，需重建
-            self.options = self._build_options()
-            self.driver = uc.Chrome(options=self.options)
-            self.driver.execute_cdp_cmd(
-                "Page.addScriptToEvaluateOnNewDocument",
-                {"source": """
-                  Object.defineProperty(navigator, 'webdriver', {get: () => undefined});
-                  Object.defineProperty(navigator, 'languages', {get: () => ['zh-TW','zh','en-US']});
-                  Object.defineProperty(navigator, 'plugins', {get: () => [1,2,3]});
-                """}
-            )
+                continue
+
+    def _take_standby(self):
+        """取出可用的備用瀏覽器，沒有或已失效時回傳 None"""
+        with self._standby_lock:
+            standby, self.standby = self.standby, None
+        if standby is None:
+            return None
+        try:
+            standby[0].execute_script("return 1")
+        except Exception:
+            self._quit_quietly(standby[0])
+            return None
+        return standby
+
+    @staticmethod
+    def _quit_quietly(driver):
+        try:
+            driver.quit()
+        except Exception:
+            pass
+
+    def close_standby(self):
+        with self._standby_lock:
+            standby, self.standby = self.standby, None
+        if standby is not None:
+            self._quit_quietly(standby[0])
+
+    def restart_driver(self, target_after: str | None = None):
+        try:
+            start = time.monotonic()
+            # 舊分頁已失效
+            if self.tab_pool is not None:
+                self.tab_pool.executor.shutdown(wait=False, cancel_futures=True)
+                self.tab_pool = None
+            standby = self._take_standby()
+            quit_thread = None
+            if standby is not None:
+                # 切換到備用瀏覽器，舊瀏覽器在背景關閉（失效的瀏覽器 quit 可能卡住數秒）
+                old_driver = self.driver
+                self.driver, self.profile_dir = standby
+                quit_thread = Thread(target=self._quit_quietly, args=(old_driver,), daemon=True)
+                quit_thread.start()
+                if self.last_cookies:
+                    self._apply_cookies(self.driver, self.last_cookies)
+                print(f"已切換至備用瀏覽器（{time.monotonic() - start:.2f} 秒）")
+            else:
+                self._quit_quietly(self.driver)
+                self.driver = self._launch_driver(self.profile_dir)
+                if self.last_cookies:
+                    # 帶回重啟前保存的登入 Cookie（需先進入網域才能設定）
+                    self.driver.get("https://seller.shopee.tw")
+                    self._apply_cookies(self.driver, self.last_cookies)
+                print(f"已重新啟動瀏覽器（{time.monotonic() - start:.1f} 秒）")
             if target_after:
                 self.driver.get(target_after)
+            # 重啟後續做回覆日誌中未完成的回覆
+            try:
+                get_reply_journal().recover()
+            except Exception:
+                logging.exception('回覆日誌續做失敗')
+            # 背景補上新的備用瀏覽器
+            self.start_standby(wait_for=quit_thread)
         except Exception:
             logging.exception('重啟 WebDriver 失敗')
             print(traceback.format_exc())
             raise
 
+    def begin_cycle_trace(self):
+        """取出並丟棄之前累積的 performance log，讓本輪的 trace 只包含本輪的事件"""
+        if not BROWSER_TRACE:
+            return
+        try:
+            self.driver.get_log('performance')
+        except Exception:
+            logging.exception('清除 performance log 失敗')
+
+    def end_cycle_trace(self, elapsed, label='cycle'):
+        """
+        取出本輪的 trace 事件，耗時超過 BROWSER_TRACE_THRESHOLD_SEC 時寫入 traces/。
+
+        :param elapsed: 本輪耗時（秒）
+        :return: trace 檔路徑；未啟用、未超過門檻或失敗時回傳 None
+        """
+        if not BROWSER_TRACE:
+            return None
+        try:
+            entries = self.driver.get_log('performance')
+        except Exception:
+            logging.exception('讀取 performance log 失敗')
+            return None
+        if elapsed < BROWSER_TRACE_THRESHOLD_SEC:
+            return None
+        try:
+            url = self.driver.current_url
+        except Exception:
+            url = None
+        try:
+            path = write_chrome_trace(entries, label, {'cycle_seconds': round(elapsed, 3), 'url': url})
+        except Exception:
+            logging.exception('寫入瀏覽器 trace 失敗')
+            return None
+        print(f"本輪耗時 {elapsed:.1f} 秒超過 {BROWSER_TRACE_THRESHOLD_SEC:.0f} 秒，瀏覽器 trace 已寫入 {path}")
+        return path
+
+    def recycle_tab(self, target_after="https://seller.shopee.tw/new-webchat/conversations"):
+        """
+        開新分頁取代目前分頁並關閉舊分頁，釋放舊頁面累積的 JS heap 與 DOM（Cookie 不受影響）。
+        """
+        if self.tab_pool is not None:
+            self.tab_pool.close()
+            self.tab_pool = None
+        old_handle = self.driver.current_window_handle
+        self.driver.switch_to.new_window('tab')
+        new_handle = self.driver.current_window_handle
+        self.driver.switch_to.window(old_handle)
+        self.driver.close()
+        self.driver.switch_to.window(new_handle)
+        # 新分頁沒有啟動時的 CDP 設定（偽裝腳本、UA、時區、網址封鎖），導覽前重新套用
+        self.setup_target(self.driver)
+        self.driver.get(target_after)
+        self.record_nav("recycle_tab")
+
+    def recycle_browser(self, target_after="https://seller.shopee.tw/new-webchat/conversations"):
+        """保存 Cookie 後重啟瀏覽器（有備用瀏覽器時直接切換），重啟後帶回 Cookie"""
+        try:
+            self.last_cookies = self.driver.get_cookies()
+            self.dump_cookies(os.path.join(FILE_PATH, 'cookies.json'))
+        except Exception:
+            logging.exception('回收瀏覽器前保存 Cookie 失敗')
+        self.restart_driver(target_after)
+        self.record_nav("recycle_browser")
+
     def ensure_alive(self, target_after: str | None = None):
         try:
             _ = self.driver.current_url
@@ -311,6 +1321,7 @@ class WebDriverManager():
     @log_decorator
     def wait_for_element(self, element, by, value, timeout=10):
         """等待元素出現並返回該元素"""
+        timeout = budget_timeout(timeout)
         try:
             return WebDriverWait(element, timeout).until(lambda d: d.find_element(by, value))
         except (InvalidSessionIdException, WebDriverException):
@@ -326,6 +1337,7 @@ class WebDriverManager():
     @log_decorator
     def wait_for_elements(self, element, by, value, timeout=10):
         """等待元素出現並返回所有元素"""
+        timeout = budget_timeout(timeout)
         try:
             return WebDriverWait(element, timeout).until(lambda d: d.find_elements(by, value))
         except (InvalidSessionIdException, WebDriverException):
@@ -338,28 +1350,37 @@ class WebDriverManager():
                 pass
             raise
 
-    def record_nav(self, note=""):
+    def record_nav(self, note="", url=None):
+        """
+        記錄導覽事件。熱路徑只擷取時間與備註（以及呼叫端已取得的網址），
+        其餘需要 WebDriver 往返的欄位依 NAV_DEBUG_LEVEL 決定是否擷取：
+        0 = 不額外查詢，1 = 加上 current_url，2 = 再加上 title 與 document.referrer。
+
+        :param note: 備註文字
+        :param url: 呼叫端已知的目前網址（可省去一次查詢）
+        """
         try:
-            url = self.driver.current_url
+            level = self.nav_debug_level
+            if url is None and level >= 1:
+                try:
+                    url = self.driver.current_url
+                except Exception:
+                    url = None
             title = ""
-            try:
-                title = self.driver.title
-            except Exception:
-                pass
             referrer = ""
-            try:
-                referrer = self.driver.execute_script("return document.referrer || ''")
-            except Exception:
-                pass
-            ts = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            if url != self.last_url or note:
-                line = f"[{ts}] url={url} title={title} ref={referrer} note={note}\n"
+            if level >= 2:
+                try:
+                    title = self.driver.title
+                except Exception:
+                    pass
                 try:
-                    with open(self.nav_log_path, 'a', encoding='utf-8') as f:
-                        f.write(line)
+                    referrer = self.driver.execute_script("return document.referrer || ''")
                 except Exception:
                     pass
-                self.last_url = url
+            if note or (url is not None and url != self.last_url):
+                self.nav_journal.append((time.time(), url, title, referrer, note))
+                if url is not None:
+                    self.last_url = url
         except Exception:
             pass
 
@@ -806,19 +1827,116 @@ class WebDriverManager():
             pass
         return False
 
-#蝦皮登入
-@log_decorator
-def autologin(drivermanager, login_status, account_number, account_password):
-    global LOGIN_STATE
+# 以 HTTP 預先檢查 cookies.json 是否仍有效的網址（需登入才能存取的輕量 API），設為空字串停用
+SESSION_PROBE_URL = os.environ.get('SESSION_PROBE_URL', 'https://seller.shopee.tw/api/selleraccount/user_info/')
+
+HTTP_SESSION = None
+
+def get_http_session():
+    """共用的 requests.Session（保留連線池，重複請求不需重新握手）"""
+    global HTTP_SESSION
+    if HTTP_SESSION is None:
+        ensure_heavy_imports()
+        HTTP_SESSION = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=8)
+        HTTP_SESSION.mount('https://', adapter)
+        HTTP_SESSION.headers.update({
+            'User-Agent': WebDriverManager.USER_AGENT,
+            'Accept': 'application/json, text/plain, */*',
+            'Accept-Language': 'zh-TW,zh;q=0.9,en-US;q=0.8,en;q=0.7',
+        })
+    return HTTP_SESSION
+
+def probe_cookie_session(cookies_path, url=None, timeout=3.0):
+    """
+    以保存的 Cookie 直接向需登入的 API 發出 HTTP 請求，判斷登入狀態是否仍有效，不需啟動瀏覽器。
+
+    :param cookies_path: cookies.json 路徑
+    :param url: 檢查用的網址，預設為 SESSION_PROBE_URL
+    :param timeout: 請求逾時秒數
+    :return: True 有效、False 已失效、None 無法判斷（沒有 Cookie、網路錯誤或無法辨識的回應）
+    """
+    url = SESSION_PROBE_URL if url is None else url
+    if not url or not os.path.exists(cookies_path):
+        return None
+    ensure_heavy_imports()
+    try:
+        with open(cookies_path, 'r', encoding='utf-8') as f:
+            cookies = json.load(f)
+    except Exception:
+        return None
+    now = time.time()
+    jar = requests.cookies.RequestsCookieJar()
+    for ck in cookies:
+        if ck.get('expiry') and ck['expiry'] < now:
+            continue
+        jar.set(ck['name'], ck['value'], domain=ck.get('domain', '.shopee.tw'), path=ck.get('path', '/'))
+    if not jar:
+        return False
+    try:
+        resp = get_http_session().get(url, cookies=jar, timeout=timeout, allow_redirects=False)
+    except requests.RequestException:
+        return None
+    if resp.status_code in (401, 403):
+        return False
+    if 300 <= resp.status_code < 400:
+        return False if 'login' in resp.headers.get('Location', '') else None
+    if resp.status_code != 200:
+        return None
+    try:
+        data = resp.json()
+    except ValueError:
+        return None
+    if not isinstance(data, dict):
+        return None
+    error = str(data.get('error') or data.get('message') or data.get('msg') or '').lower()
+    if 'login' in error or 'auth' in error or 'token' in error:
+        return False
+    if data.get('code') in (0, None) and not data.get('error'):
+        return True
+    return None
+
+def start_session_probe():
+    """
+    在背景執行 Cookie 預先檢查，與啟動瀏覽器同時進行。
+
+    :return: Future，結果為 (是否有效, 耗時毫秒)
+    """
+    def run():
+        start = time.perf_counter()
+        valid = probe_cookie_session(os.path.join(FILE_PATH, 'cookies.json'))
+        return valid, (time.perf_counter() - start) * 1000
+    executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='session-probe')
+    future = executor.submit(run)
+    executor.shutdown(wait=False)
+    return future
+
+#蝦皮登入
+@log_decorator
+def autologin(drivermanager, login_status, account_number, account_password, session_probe=None):
+    global LOGIN_STATE
     try:
+        login_started = time.monotonic()
         targets = [
             "https://seller.shopee.tw/new-webchat/conversations",
         ]
         target = targets[0]
         login_url = "https://accounts.shopee.tw/seller/login?next=" + target
-        drivermanager.driver.get(login_url)
+
+        # HTTP 預先檢查的結果：True 直接以 Cookie 進入聊聊頁，False 直接進入登入流程，None 照舊以頁面判斷
+        session_valid = None
+        if session_probe is not None:
+            try:
+                session_valid, probe_ms = session_probe.result(timeout=5)
+                state = {True: '有效', False: '已失效', None: '無法判斷'}[session_valid]
+                print(f"Cookie 預先檢查: {state}（{probe_ms:.0f} ms）")
+            except Exception:
+                session_valid = None
+
+        if session_valid is not True:
+            drivermanager.driver.get(login_url)
+            drivermanager.record_nav("open login")
         drivermanager.driver.maximize_window()
-        drivermanager.record_nav("open login")
 
         def human_sleep(a, b):
             time.sleep(random.uniform(a, b))
@@ -939,14 +2057,22 @@ def autologin(drivermanager, login_status, account_number, account_password):
         # 啟動即嘗試以 Cookie 直接登入（若已有 cookies.json）
         try:
             cookies_path = os.path.join(FILE_PATH, 'cookies.json')
-            if os.path.exists(cookies_path):
+            if session_valid is False:
+                # 已確認失效，略過載入 Cookie 與逐一等待頁面元素
+                print("Cookie 已失效，略過 Cookie 登入，直接進入登入流程")
+            elif os.path.exists(cookies_path):
                 drivermanager.record_nav("try load cookies")
                 drivermanager.load_cookies(cookies_path)
                 if is_chat_ready(timeout=8):
                     drivermanager.record_nav("cookie login success")
                     LOGIN_STATE = 1
                     login_status("登入成功（Cookie）")
+                    print(f"Cookie 登入完成，耗時 {time.monotonic() - login_started:.1f} 秒")
                     return
+                if session_valid is True:
+                    # 預先檢查有效但頁面未就緒，改走登入流程
+                    drivermanager.driver.get(login_url)
+                    drivermanager.record_nav("open login")
         except Exception:
             pass
 
@@ -993,7 +2119,7 @@ def autologin(drivermanager, login_status, account_number, account_password):
 
         while True:
             url = drivermanager.driver.current_url
-            drivermanager.record_nav()
+            drivermanager.record_nav(url=url)
 
             # 驗證鎖定期間，若被切到新分頁或非驗證頁，嘗試切回或導向驗證入口
             if verify_lock:
@@ -1161,34 +2287,97 @@ def autologin(drivermanager, login_status, account_number, account_password):
         print(traceback.format_exc())
         raise
 
-import re
-import openai
+# 是否以串流方式產生回覆，邊產生邊輸入對話框
+LLM_STREAM = os.environ.get('LLM_STREAM', '0') == '1'
 
-#ChatGPT機器人
-@log_decorator
-def ChatGPT_Robot(api_key, assistant_id, previous_conversations):
-    try:
-        # 設置您的API密鑰
-        client = openai.OpenAI(api_key=api_key)
+_SOURCE_TAG_RE = re.compile(r"【[^【】]*?†(來源|source)】")
+
+def clean_llm_output(text):
+    """移除 Assistants 檔案檢索產生的來源標註"""
+    return _SOURCE_TAG_RE.sub("", text or "")
+
+# LLM 後端：assistants（Threads/Assistants API）或 chat（單次 Chat Completions 請求）
+LLM_BACKEND = os.environ.get('LLM_BACKEND', 'assistants')
+SELLER_INSTRUCTIONS = "你現在是賣家，請協助客人解決問題"
+
+class LLMBackend(abc.ABC):
+    """
+    LLM 後端介面。
+
+    reply() 回傳完整回覆；reply_stream() 每收到一段文字就呼叫 on_delta，結束時回傳完整回覆。
+    不支援串流的後端預設在完成後一次回呼整段內容。
+    """
+    name = 'base'
+
+    def __init__(self, api_key, assistant_id):
+        self.api_key = api_key
+        self.assistant_id = assistant_id
+        self._client = None
+
+    @property
+    def client(self):
+        # 重複使用同一個 client，保留 HTTP 連線池
+        if self._client is None:
+            ensure_heavy_imports()
+            self._client = openai.OpenAI(api_key=self.api_key)
+        # 有時間預算時，請求逾時不超過剩餘預算
+        if current_deadline() is not None:
+            return self._client.with_options(timeout=budget_timeout(120))
+        return self._client
+
+    @abc.abstractmethod
+    def reply(self, previous_conversations):
+        """回傳完整回覆"""
+
+    def reply_stream(self, previous_conversations, on_delta):
+        output = self.reply(previous_conversations)
+        if output:
+            on_delta(output)
+        return output
+
+    def summarize(self, previous_summary, conversations):
+        """以單次 Chat Completions 請求產生（滾動）對話摘要"""
+        lines = [f"{'客人' if m['role'] == 'user' else '賣家'}：{m['content']}" for m in conversations]
+        prompt = "請用繁體中文將以下買賣雙方的對話濃縮成重點摘要（客人需求、已提供的資訊、尚未解決的問題），不超過 200 字。\n"
+        if previous_summary:
+            prompt += f"先前的摘要：{previous_summary}\n"
+        prompt += "新增的對話：\n" + "\n".join(lines)
+        completion = self.client.chat.completions.create(
+            model=os.environ.get('LLM_SUMMARY_MODEL', 'gpt-4o-mini'),
+            messages=[{"role": "user", "content": prompt}]
+        )
+        return (completion.choices[0].message.content or '').strip()
 
-        thread = client.beta.threads.create()
+class AssistantsBackend(LLMBackend):
+    """Threads/Assistants API：建立 thread、逐則加入訊息、執行 run 後讀取訊息列表"""
+    name = 'assistants'
+
+    def _create_thread(self, previous_conversations):
+        thread = self.client.beta.threads.create()
 
         # 將之前的對話紀錄和新的用戶輸入加入到對話線程中
         for message in previous_conversations:
-            client.beta.threads.messages.create(
+            self.client.beta.threads.messages.create(
                 thread_id=thread.id,
                 role=message["role"],
                 content=message["content"]
             )
+        return thread
 
-        run = client.beta.threads.runs.create_and_poll(
-            thread_id=thread.id,
-            assistant_id=assistant_id,
-            instructions="你現在是賣家，請協助客人解決問題"
-        )
+    def reply(self, previous_conversations):
+        thread = self._create_thread(previous_conversations)
+
+        if current_deadline() is None:
+            run = self.client.beta.threads.runs.create_and_poll(
+                thread_id=thread.id,
+                assistant_id=self.assistant_id,
+                instructions=SELLER_INSTRUCTIONS
+            )
+        else:
+            run = self._poll_within_budget(thread)
 
         if run.status == 'completed':
-            messages = client.beta.threads.messages.list(
+            messages = self.client.beta.threads.messages.list(
                 thread_id=thread.id
             )
 
@@ -1200,35 +2389,471 @@ def ChatGPT_Robot(api_key, assistant_id, previous_conversations):
                         # 檢查 content_block 是否有 'text' 屬性
                         if hasattr(content_block, 'text'):
                             output = content_block.text.value
-                            clean_output = re.sub(r"【.*?†來源】", "", output)
-                            clean_output = re.sub(r"【.*?†source】", "", clean_output)
-                            return clean_output
+                            return clean_llm_output(output)
         else:
             print("LLM處理狀態:" + run.status)
         return None
+
+    def _poll_within_budget(self, thread):
+        """在時間預算內輪詢 run，預算用盡時取消 run 並拋出 DeadlineExceeded"""
+        run = self.client.beta.threads.runs.create(
+            thread_id=thread.id,
+            assistant_id=self.assistant_id,
+            instructions=SELLER_INSTRUCTIONS
+        )
+        while run.status in ('queued', 'in_progress', 'cancelling'):
+            try:
+                time.sleep(budget_timeout(0.5))
+            except DeadlineExceeded:
+                try:
+                    self._client.beta.threads.runs.cancel(thread_id=thread.id, run_id=run.id)
+                except Exception:
+                    pass
+                raise
+            run = self.client.beta.threads.runs.retrieve(thread_id=thread.id, run_id=run.id)
+        return run
+
+    def reply_stream(self, previous_conversations, on_delta):
+        thread = self._create_thread(previous_conversations)
+
+        parts = []
+        with self.client.beta.threads.runs.stream(
+            thread_id=thread.id,
+            assistant_id=self.assistant_id,
+            instructions=SELLER_INSTRUCTIONS
+        ) as stream:
+            for delta in stream.text_deltas:
+                parts.append(delta)
+                on_delta(delta)
+            run = stream.get_final_run()
+        if run.status != 'completed':
+            print("LLM處理狀態:" + run.status)
+            return None
+        return clean_llm_output(''.join(parts)) or None
+
+class ChatCompletionBackend(LLMBackend):
+    """
+    Chat Completions：系統指示與整段對話在單一請求中送出。
+    模型與指示沿用 Assistant 的設定（只在第一次使用時讀取一次），可用 LLM_MODEL 覆寫模型。
+    Assistant 掛載的檔案檢索在此後端不可用。
+    """
+    name = 'chat'
+
+    def __init__(self, api_key, assistant_id):
+        super().__init__(api_key, assistant_id)
+        self._model = os.environ.get('LLM_MODEL')
+        self._instructions = None
+
+    def _load_assistant(self):
+        if self._instructions is not None:
+            return
+        instructions = ''
+        try:
+            assistant = self.client.beta.assistants.retrieve(self.assistant_id)
+            instructions = assistant.instructions or ''
+            if not self._model:
+                self._model = assistant.model
+        except Exception:
+            logging.exception('讀取 Assistant 設定失敗，使用預設模型與指示')
+        if not self._model:
+            self._model = 'gpt-4o-mini'
+        self._instructions = (instructions + '\n' + SELLER_INSTRUCTIONS).strip()
+
+    def _messages(self, previous_conversations):
+        self._load_assistant()
+        return [{"role": "system", "content": self._instructions}] + [
+            {"role": message["role"], "content": message["content"]} for message in previous_conversations
+        ]
+
+    def reply(self, previous_conversations):
+        messages = self._messages(previous_conversations)
+        completion = self.client.chat.completions.create(
+            model=self._model,
+            messages=messages
+        )
+        choice = completion.choices[0]
+        if choice.finish_reason not in ('stop', 'length'):
+            print("LLM處理狀態:" + str(choice.finish_reason))
+        return clean_llm_output(choice.message.content) or None
+
+    def reply_stream(self, previous_conversations, on_delta):
+        parts = []
+        messages = self._messages(previous_conversations)
+        stream = self.client.chat.completions.create(
+            model=self._model,
+            messages=messages,
+            stream=True
+        )
+        for chunk in stream:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                parts.append(delta)
+                on_delta(delta)
+        return clean_llm_output(''.join(parts)) or None
+
+LLM_BACKENDS = {
+    AssistantsBackend.name: AssistantsBackend,
+    ChatCompletionBackend.name: ChatCompletionBackend,
+}
+
+_LLM_BACKEND_CACHE = {}
+_LLM_BACKEND_LOCK = threading.Lock()
+
+def get_llm_backend(api_key, assistant_id, name=None):
+    """
+    取得（並快取）指定的 LLM 後端實例。
+
+    :param name: 後端名稱，None 時使用 LLM_BACKEND
+    """
+    name = name or LLM_BACKEND
+    if name not in LLM_BACKENDS:
+        print(f"未知的 LLM 後端: {name}，改用 assistants")
+        name = AssistantsBackend.name
+    key = (name, api_key, assistant_id)
+    with _LLM_BACKEND_LOCK:
+        backend = _LLM_BACKEND_CACHE.get(key)
+        if backend is None:
+            backend = LLM_BACKENDS[name](api_key, assistant_id)
+            _LLM_BACKEND_CACHE[key] = backend
+        return backend
+
+# 各後端最近的回覆耗時（秒）
+LLM_LATENCY = collections.defaultdict(lambda: collections.deque(maxlen=200))
+
+def record_llm_latency(backend_name, seconds):
+    LLM_LATENCY[backend_name].append(seconds)
+    print(f"LLM 後端 {backend_name} 回覆耗時 {seconds:.2f} 秒")
+
+def llm_latency_report():
+    """
+    彙整各 LLM 後端的回覆耗時。
+
+    :return: 後端名稱 -> {'count', 'avg', 'p50', 'p95'} 的字典
+    """
+    report = {}
+    for name, samples in list(LLM_LATENCY.items()):
+        if not samples:
+            continue
+        ordered = sorted(samples)
+        report[name] = {
+            'count': len(ordered),
+            'avg': sum(ordered) / len(ordered),
+            'p50': ordered[len(ordered) // 2],
+            'p95': ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+        }
+    return report
+
+def print_llm_latency_report():
+    for name, stats in llm_latency_report().items():
+        print(f"LLM 後端 {name}: {stats['count']} 次，平均 {stats['avg']:.2f} 秒，p50 {stats['p50']:.2f} 秒，p95 {stats['p95']:.2f} 秒")
+
+class TokenBucket():
+    """權杖桶速率限制器，rate_per_minute 為每分鐘補充量，容量預設等於每分鐘補充量"""
+    def __init__(self, rate_per_minute, capacity=None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity or rate_per_minute
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, amount=1, timeout=None):
+        """
+        取得 amount 個權杖，不足時等待。
+
+        :return: 是否在 timeout 內取得
+        """
+        amount = min(amount, self.capacity)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return True
+                wait = (amount - self.tokens) / self.rate
+            if deadline is not None and time.monotonic() + wait > deadline:
+                return False
+            time.sleep(min(wait, 1.0))
+
+class CircuitOpenError(Exception):
+    """LLM 斷路器開啟中，暫停呼叫"""
+
+class EmptyReplyError(Exception):
+    """LLM 未回傳內容（run 未完成等），視為暫時性錯誤"""
+
+class LLMGovernor():
+    """
+    LLM 呼叫管控。
+
+    - 速率限制：依每分鐘請求數與 token 數的權杖桶排隊。
+    - 重試：暫時性錯誤（限流、逾時、連線、5xx、空回覆）以指數退避加隨機抖動重試。
+    - 斷路器：連續失敗達門檻即開啟，冷卻期間直接拒絕呼叫（由呼叫端改用標準回覆），
+      冷卻後放行一次試探呼叫，成功即關閉。
+    """
+    TRANSIENT_ERRORS = {'RateLimitError', 'APITimeoutError', 'APIConnectionError',
+                        'InternalServerError', 'ServiceUnavailableError', 'EmptyReplyError'}
+
+    def __init__(self, rpm=60, tpm=90000, max_retries=3, base_delay=1.0, max_delay=20.0,
+                 failure_threshold=3, cooldown=120):
+        self.request_bucket = TokenBucket(rpm)
+        self.token_bucket = TokenBucket(tpm)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.state = 'closed'
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.counters = collections.Counter()
+        self.latencies = collections.deque(maxlen=200)
+        self._lock = threading.Lock()
+
+    def is_transient(self, error):
+        if type(error).__name__ in self.TRANSIENT_ERRORS:
+            return True
+        return getattr(error, 'status_code', None) in (408, 409, 429, 500, 502, 503, 504)
+
+    def count(self, name, n=1):
+        """在鎖內更新計數器（呼叫可能來自多個執行緒）"""
+        with self._lock:
+            self.counters[name] += n
+
+    def _allow(self):
+        with self._lock:
+            if self.state == 'open':
+                if time.monotonic() - self.opened_at < self.cooldown:
+                    return False
+                self.state = 'half_open'
+                print("LLM 斷路器進入試探狀態")
+            return True
+
+    def _on_success(self, seconds):
+        with self._lock:
+            self.counters['successes'] += 1
+            self.latencies.append(seconds)
+            self.consecutive_failures = 0
+            if self.state != 'closed':
+                print("LLM 服務恢復，斷路器關閉")
+            self.state = 'closed'
+
+    def _on_failure(self):
+        with self._lock:
+            self.counters['failures'] += 1
+            self.consecutive_failures += 1
+            if self.state == 'half_open' or self.consecutive_failures >= self.failure_threshold:
+                if self.state != 'open':
+                    self.counters['circuit_opened'] += 1
+                    print(f"LLM 連續失敗 {self.consecutive_failures} 次，斷路器開啟 {self.cooldown} 秒")
+                self.state = 'open'
+                self.opened_at = time.monotonic()
+
+    def call(self, fn, estimated_tokens=0, max_retries=None, speculative=False):
+        """
+        在速率限制、重試與斷路器保護下執行 fn。fn 回傳空值視為暫時性錯誤。
+
+        :param fn: 實際呼叫 LLM 的函數
+        :param estimated_tokens: 預估使用的 token 數
+        :param max_retries: 重試次數，None 時使用預設值（串流呼叫應設為 0）
+        :param speculative: 預先產生的呼叫：斷路器未關閉時不送出（不佔用試探呼叫），失敗不計入斷路器
+        :raises CircuitOpenError: 斷路器開啟中
+        """
+        if speculative and self.state != 'closed':
+            self.count('short_circuited')
+            raise CircuitOpenError('LLM 斷路器未關閉，不預先產生回覆')
+        if not self._allow():
+            self.count('short_circuited')
+            raise CircuitOpenError('LLM 斷路器開啟中')
+        retries = self.max_retries if max_retries is None else max_retries
+        for attempt in range(retries + 1):
+            wait_start = time.monotonic()
+            deadline = current_deadline()
+            timeout = deadline.remaining() if deadline else None
+            if not self.request_bucket.acquire(1, timeout) or not self.token_bucket.acquire(estimated_tokens, timeout):
+                raise DeadlineExceeded('等待 LLM 速率限制時時間預算用盡')
+            if time.monotonic() - wait_start > 0.05:
+                self.count('throttled')
+            self.count('calls')
+            start = time.perf_counter()
+            try:
+                result = fn()
+                if not result:
+                    raise EmptyReplyError('LLM 未回傳內容')
+                self._on_success(time.perf_counter() - start)
+                return result
+            except DeadlineExceeded:
+                # 時間預算用盡不代表服務異常，不計入斷路器
+                raise
+            except Exception as e:
+                if not self.is_transient(e) or attempt >= retries:
+                    if speculative:
+                        self.count('speculative_failures')
+                    else:
+                        self._on_failure()
+                    raise
+                self.count('retries')
+                # 指數退避加隨機抖動，避免同時重試
+                delay = min(self.max_delay, self.base_delay * (2 ** attempt)) * random.uniform(0.5, 1.5)
+                if deadline is not None and delay >= deadline.remaining():
+                    raise DeadlineExceeded('LLM 重試等待超出時間預算')
+                print(f"LLM 暫時性錯誤（{type(e).__name__}），{delay:.1f} 秒後重試")
+                time.sleep(delay)
+
+    def snapshot(self):
+        """回傳目前狀態、計數器與延遲統計"""
+        with self._lock:
+            ordered = sorted(self.latencies)
+            return {
+                'state': self.state,
+                'counters': dict(self.counters),
+                'latency_avg': sum(ordered) / len(ordered) if ordered else None,
+                'latency_p95': ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] if ordered else None,
+            }
+
+    def print_report(self):
+        snap = self.snapshot()
+        counters = snap['counters']
+        line = (f"LLM 管控：狀態 {snap['state']}，呼叫 {counters.get('calls', 0)}，成功 {counters.get('successes', 0)}，"
+                f"失敗 {counters.get('failures', 0)}，重試 {counters.get('retries', 0)}，限流等待 {counters.get('throttled', 0)}，"
+                f"斷路拒絕 {counters.get('short_circuited', 0)}，改用標準回覆 {counters.get('fallbacks', 0)}")
+        if snap['latency_avg'] is not None:
+            line += f"，平均延遲 {snap['latency_avg']:.2f} 秒，p95 {snap['latency_p95']:.2f} 秒"
+        print(line)
+
+LLM_GOVERNOR = None
+
+def get_llm_governor():
+    global LLM_GOVERNOR
+    if LLM_GOVERNOR is None:
+        try:
+            LLM_GOVERNOR = LLMGovernor(
+                rpm=int(os.environ.get('LLM_RPM', '60')),
+                tpm=int(os.environ.get('LLM_TPM', '90000')),
+                max_retries=int(os.environ.get('LLM_MAX_RETRIES', '3')),
+                failure_threshold=int(os.environ.get('LLM_BREAKER_THRESHOLD', '3')),
+                cooldown=int(os.environ.get('LLM_BREAKER_COOLDOWN', '120')),
+            )
+        except ValueError:
+            LLM_GOVERNOR = LLMGovernor()
+    return LLM_GOVERNOR
+
+#ChatGPT機器人
+@log_decorator
+def ChatGPT_Robot(api_key, assistant_id, previous_conversations, backend=None):
+    try:
+        llm = get_llm_backend(api_key, assistant_id, backend)
+        start = time.perf_counter()
+        output = llm.reply(previous_conversations)
+        record_llm_latency(llm.name, time.perf_counter() - start)
+        return output
     except Exception:
         logging.exception('ChatGPT_Robot 執行失敗')
         print(traceback.format_exc())
         raise
 
-from bs4 import BeautifulSoup
+@log_decorator
+def ChatGPT_Robot_stream(api_key, assistant_id, previous_conversations, on_delta, backend=None):
+    """
+    以串流方式產生回覆，每收到一段文字就呼叫 on_delta。
+
+    :param api_key: OpenAI API Key
+    :param assistant_id: Assistant ID
+    :param previous_conversations: 對話紀錄
+    :param on_delta: 收到文字片段時的回呼函數
+    :param backend: LLM 後端名稱，None 時使用 LLM_BACKEND
+    :return: 完整回覆內容（已移除來源標註），沒有內容時回傳 None
+    """
+    try:
+        llm = get_llm_backend(api_key, assistant_id, backend)
+        start = time.perf_counter()
+        output = llm.reply_stream(previous_conversations, on_delta)
+        record_llm_latency(llm.name, time.perf_counter() - start)
+        return output
+    except Exception:
+        logging.exception('ChatGPT_Robot_stream 執行失敗')
+        print(traceback.format_exc())
+        raise
+
+def message_key(role, time_text, content, occurrence=0):
+    """
+    以角色、時間與內容計算訊息鍵值，作為逐字稿的去重依據。
+    時間只有 HH:MM，不同天同一時間的相同訊息（例如「謝謝」）以 occurrence 區分，
+    occurrence 必須以該客人的完整對話計算（見 rekey_messages）。
+    """
+    raw = f"{role}|{time_text}|{content}|{occurrence}"
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+# 以保存的最後幾則訊息對齊新擷取的內容
+TRANSCRIPT_ALIGN_TURNS = 5
+
+def message_ident(message):
+    return (message['role'], message.get('time'), message['content'])
+
+def align_new_messages(messages, stored_tail):
+    """
+    在新擷取的訊息（由舊到新）中尋找本機保存的最後幾則訊息，回傳其後第一則新訊息的位置。
+
+    :param messages: extract_messages 的結果
+    :param stored_tail: TranscriptStore.tail() 的結果
+    :return: 新訊息的起始位置；找不到重疊時回傳 None
+    """
+    if not stored_tail:
+        return None
+    tail = list(stored_tail)
+    idents = [message_ident(m) for m in messages]
+    # 從最新的位置往回找，取最後一次完整出現的位置
+    for end in range(len(idents), len(tail) - 1, -1):
+        if idents[end - len(tail):end] == tail:
+            return end
+    return None
+
+def rekey_messages(messages, prior_counts):
+    """
+    依該客人完整對話中的出現次數重新計算鍵值。
+
+    :param messages: 接在已保存訊息之後的新訊息（由舊到新）
+    :param prior_counts: 已保存訊息的 (角色, 時間, 內容) 出現次數
+    """
+    counts = collections.Counter(prior_counts)
+    for message in messages:
+        ident = message_ident(message)
+        message['key'] = message_key(*ident, counts[ident])
+        counts[ident] += 1
+    return messages
 
 @log_decorator
-def chatgpt_extract_conversations(html_content):
+def extract_messages(html_content):
+    """
+    解析對話 HTML，回傳含時間與鍵值的訊息列表。
+
+    :param html_content: 對話訊息元素的 HTML
+    :return: [{"role", "content", "time", "key"}, ...]
+    """
     try:
+        ensure_heavy_imports()
         # 使用BeautifulSoup解析HTML
         soup = BeautifulSoup(html_content, 'html.parser')
 
         # 創建一個空列表來存儲提取的對話
         conversations = []
+        occurrences = collections.Counter()
 
         # 提取所有對話消息
         messages = soup.find_all('div', class_='DEwekPN7v2')
         for message in messages:
             # 判斷對話類型
-            if message.find(attrs={"data-cy": True}).get('data-cy') == 'webchat-message-receive':
+            data_cy_tag = message.find(attrs={"data-cy": True})
+            data_cy = data_cy_tag.get('data-cy') if data_cy_tag else None
+            if data_cy == 'webchat-message-receive':
                 convo_type = 'user'
-            elif message.find(attrs={"data-cy": True}).get('data-cy') == 'webchat-message-send':
+            elif data_cy == 'webchat-message-send':
                 convo_type = 'assistant'
             elif message.find(class_='RtO616EACf'):
                 convo_type = 'system'
@@ -1251,8 +2876,13 @@ def chatgpt_extract_conversations(html_content):
             if time_tag:
                 text = text.replace(time_tag.get_text(strip=True), '').strip()
 
+            # 同一時間的相同訊息以出現次序區分
+            ident = (convo_type, time_text, text)
+            key = message_key(convo_type, time_text, text, occurrences[ident])
+            occurrences[ident] += 1
+
             # 將對話添加到列表
-            conversations.append({"role": convo_type, "content": text})
+            conversations.append({"role": convo_type, "content": text, "time": time_text, "key": key})
 
         return conversations
     except Exception:
@@ -1261,13 +2891,199 @@ def chatgpt_extract_conversations(html_content):
         raise
 
 @log_decorator
-def view_custormer_chat(drivermanager):
+def chatgpt_extract_conversations(html_content):
+    """
+    解析對話 HTML 為 ChatGPT 訊息格式。
+
+    :param html_content: 對話訊息元素的 HTML
+    :return: [{"role", "content"}, ...]
+    """
+    return [{"role": m["role"], "content": m["content"]} for m in extract_messages(html_content)]
+
+class TranscriptStore():
+    """
+    本機逐字稿資料庫（transcripts.db）。
+
+    每位客人的訊息以 (customer, msg_key) 去重並依 seq 排序保存；
+    若 SQLite 支援 FTS5，另建全文索引（trigram 分詞，可搜尋中文片段）供查詢過往對話。
+    """
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=10, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL;')
+        self.conn.execute('PRAGMA synchronous=NORMAL;')
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS messages (
+                id INTEGER PRIMARY KEY,
+                customer TEXT NOT NULL,
+                msg_key TEXT NOT NULL,
+                seq INTEGER NOT NULL,
+                role TEXT NOT NULL,
+                time_text TEXT,
+                content TEXT NOT NULL,
+                harvested_at REAL,
+                UNIQUE(customer, msg_key)
+            );
+            CREATE INDEX IF NOT EXISTS idx_messages_customer_seq ON messages(customer, seq);
+        """)
+        self.fts_enabled = self._create_fts()
+        self.conn.commit()
+
+    def _create_fts(self):
+        for tokenizer in ('trigram', 'unicode61'):
+            try:
+                self.conn.executescript(f"""
+                    CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+                        content, customer UNINDEXED, content='messages', content_rowid='id', tokenize='{tokenizer}'
+                    );
+                    CREATE TRIGGER IF NOT EXISTS messages_ai AFTER INSERT ON messages BEGIN
+                        INSERT INTO messages_fts(rowid, content, customer) VALUES (new.id, new.content, new.customer);
+                    END;
+                    CREATE TRIGGER IF NOT EXISTS messages_ad AFTER DELETE ON messages BEGIN
+                        INSERT INTO messages_fts(messages_fts, rowid, content, customer) VALUES ('delete', old.id, old.content, old.customer);
+                    END;
+                """)
+                return True
+            except sqlite3.OperationalError:
+                continue
+        print("SQLite 不支援 FTS5，逐字稿搜尋改用 LIKE")
+        return False
+
+    def tail(self, customer, count=None):
+        """回傳該客人最後 count 則訊息的 (角色, 時間, 內容)，由舊到新"""
+        count = count or TRANSCRIPT_ALIGN_TURNS
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT role, time_text, content FROM messages WHERE customer = ? ORDER BY seq DESC LIMIT ?",
+                (customer, count)
+            ).fetchall()
+        return [tuple(row) for row in reversed(rows)]
+
+    def ident_counts(self, customer):
+        """回傳該客人所有已保存訊息的 (角色, 時間, 內容) 出現次數"""
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT role, time_text, content, COUNT(*) FROM messages WHERE customer = ? GROUP BY role, time_text, content",
+                (customer,)
+            ).fetchall()
+        return collections.Counter({(role, time_text, content): n for role, time_text, content, n in rows})
+
+    def add_messages(self, customer, messages):
+        """
+        依序保存尚未出現過的訊息。
+
+        :param customer: 客戶名稱
+        :param messages: extract_messages 的結果（由舊到新）
+        :return: 新增的訊息列表
+        """
+        now = time.time()
+        added = []
+        with self._lock:
+            row = self.conn.execute("SELECT COALESCE(MAX(seq), 0) FROM messages WHERE customer = ?", (customer,)).fetchone()
+            seq = row[0]
+            for message in messages:
+                seq += 1
+                cur = self.conn.execute(
+                    "INSERT OR IGNORE INTO messages (customer, msg_key, seq, role, time_text, content, harvested_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (customer, message['key'], seq, message['role'], message.get('time'), message['content'], now)
+                )
+                if cur.rowcount:
+                    added.append(message)
+                else:
+                    seq -= 1
+            self.conn.commit()
+        return added
+
+    def history(self, customer, limit=None):
+        """回傳該客人保存的對話（由舊到新），格式同 chatgpt_extract_conversations"""
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT role, content FROM messages WHERE customer = ? ORDER BY seq",
+                (customer,)
+            ).fetchall()
+        if limit:
+            rows = rows[-limit:]
+        return [{"role": role, "content": content} for role, content in rows]
+
+    def search(self, query, customer=None, limit=20):
+        """
+        全文搜尋過往對話。
+
+        :return: [(customer, role, time_text, content), ...]
+        """
+        with self._lock:
+            if self.fts_enabled and len(query) >= 3:
+                sql = ("SELECT m.customer, m.role, m.time_text, m.content FROM messages_fts f "
+                       "JOIN messages m ON m.id = f.rowid WHERE messages_fts MATCH ?")
+                params = ['"' + query.replace('"', '""') + '"']
+            else:
+                sql = "SELECT m.customer, m.role, m.time_text, m.content FROM messages m WHERE m.content LIKE ?"
+                params = [f"%{query}%"]
+            if customer:
+                sql += " AND m.customer = ?"
+                params.append(customer)
+            sql += " ORDER BY m.harvested_at DESC LIMIT ?"
+            params.append(limit)
+            return self.conn.execute(sql, params).fetchall()
+
+TRANSCRIPT_STORE = None
+_TRANSCRIPT_STORE_LOCK = threading.Lock()
+
+def get_transcript_store():
+    global TRANSCRIPT_STORE
+    with _TRANSCRIPT_STORE_LOCK:
+        if TRANSCRIPT_STORE is None:
+            TRANSCRIPT_STORE = TranscriptStore(os.path.join(FILE_PATH, 'transcripts.db'))
+        return TRANSCRIPT_STORE
+
+# 擷取對話時為產生與輸入回覆保留的時間（單一客人預算的比例），剩餘時間低於此值即停止捲動
+HARVEST_RESERVE_RATIO = 0.4
+
+@log_decorator
+def view_custormer_chat(drivermanager, stored_tail=None):
+    """
+    向上捲動對話視窗並擷取訊息元素的 HTML（由舊到新）。
+
+    :param drivermanager: 瀏覽器對象
+    :param stored_tail: 本機保存的最後幾則訊息；擷取內容中出現這段連續訊息即停止，只擷取新訊息
+    :return: 訊息元素 HTML
+    """
+    html_content, complete = collect_chat_html(drivermanager, stored_tail)
+    if not complete:
+        raise DeadlineExceeded('擷取對話時時間預算用盡')
+    return html_content
+
+def collect_chat_html(drivermanager, stored_tail=None):
+    """
+    view_custormer_chat 的實作。時間預算不足時停止捲動並回傳目前已擷取的部分（較新的訊息），
+    讓對話很長的客人也能在預算內回覆，未擷取的較舊訊息留待之後。
+
+    :return: (訊息元素 HTML, 是否完整擷取)
+    """
+    html_list = []  # 由舊到新累積的訊息 HTML
     try:
         # 新增的滾動和內容檢查邏輯
         countdown_timer = 10  # 設定倒計時時間（秒）
         found_content = set()  # 儲存已經找到的內容
         start_time = time.time()  # 開始倒計時
 
+        def add_visible():
+            elements = drivermanager.wait_for_elements(drivermanager.driver, By.CLASS_NAME, 'DEwekPN7v2.undefined')
+            visible = [element.get_attribute('outerHTML') for element in elements]
+            unseen = [html for html in visible if html not in found_content]
+            if not unseen:
+                return False
+            found_content.update(unseen)
+            if not html_list:
+                html_list.extend(unseen)
+            else:
+                # 向上捲動後新出現的是較舊的訊息，放在前面
+                html_list[:0] = unseen
+            if stored_tail and align_new_messages(extract_messages('\n'.join(html_list)), stored_tail) is not None:
+                return None  # 已到達保存的訊息
+            return True
+
         while True:
             current_time = time.time()
             elapsed_time = current_time - start_time
@@ -1277,46 +3093,65 @@ def view_custormer_chat(drivermanager):
             if remaining_time <= 0:
                 print("倒計時結束，結束程式。")
                 break
-
-            # 將元素的HTML存儲在一個列表中
-            elements = drivermanager.wait_for_elements(drivermanager.driver, By.CLASS_NAME, 'DEwekPN7v2.undefined')
+            budget_timeout(remaining_time)  # 預算用盡時拋出 DeadlineExceeded
+            deadline = current_deadline()
+            if html_list and deadline is not None and deadline.remaining() < CONVERSATION_BUDGET_SEC * HARVEST_RESERVE_RATIO:
+                print("擷取對話的時間預算不足，先以已擷取的訊息回覆")
+                return '\n'.join(html_list), False
+
+            # 擷取目前可見的訊息
+            if add_visible() is None:
+                print("已擷取到上次保存的訊息，停止捲動")
+                break
             time.sleep(1)
 
-            html_list = []
-            for element in elements:
-                html_list.append(element.get_attribute('outerHTML'))
-
             scroll_element = drivermanager.wait_for_element(drivermanager.driver, By.ID, '\\#message-virtualized-list') #取得對話視窗滾動元素
             # 對指定元素進行向上滾動
             drivermanager.driver.execute_script('arguments[0].scrollTop = arguments[0].scrollTop - 100;', scroll_element)
 
             # 檢查新內容
-            new_elements = drivermanager.wait_for_elements(drivermanager.driver, By.CLASS_NAME, 'DEwekPN7v2.undefined')
-            new_html_list = [element.get_attribute('outerHTML') for element in new_elements]
-
-            # 比對並更新HTML列表
-            for html in new_html_list:
-                if html not in html_list:
-                    html_list.insert(0, html)
-                    start_time = time.time()  # 開始重新倒計時
+            result = add_visible()
+            if result is None:
+                print("已擷取到上次保存的訊息，停止捲動")
+                break
+            if result:
+                start_time = time.time()  # 開始重新倒計時
 
-        return '\n'.join(html_list)
+        return '\n'.join(html_list), True
+    except DeadlineExceeded:
+        if html_list:
+            return '\n'.join(html_list), False
+        raise
     except Exception:
         logging.exception('擷取客服對話視窗失敗')
         print(traceback.format_exc())
         raise
 
 @log_decorator
-def answer_buyer_check(customer_name):
-    whitelist_path = 'reply_whitelist.csv' # 回覆名單的檔案路徑
+def answer_buyer_check(customer_name, preview_text=None):
+    """
+    判斷是否需要回覆客人。
+
+    有預覽文字且有該客人的回覆浮水印時，以內容判斷：預覽與上次回覆時相同，
+    或預覽顯示的是我方的回覆，代表沒有新訊息；否則代表客人有新訊息，立即回覆。
+    沒有浮水印時沿用 2 小時冷卻規則。
+
+    :param customer_name: 客戶名稱
+    :param preview_text: 對話列表中的預覽文字
+    :return: 是否需要回覆
+    """
+    if preview_text is not None:
+        mark = read_watermarks().get(customer_name)
+        if mark:
+            if mark.get('preview') == conversation_watermark(preview_text):
+                return False
+            reply_head = mark.get('reply_head')
+            if reply_head and reply_head in preview_text:
+                return False
+            return True
+
     # 讀取回覆名單
-    whitelist = {}
-    try:
-        with open(whitelist_path, mode='r', encoding='utf-8') as file:
-            reader = csv.reader(file)
-            whitelist = {rows[0]: rows[1] for rows in reader if rows}
-    except FileNotFoundError:
-        pass
+    whitelist = read_whitelist()
 
     # 確認是否回覆客戶
     now = datetime.datetime.now()
@@ -1333,135 +3168,1460 @@ def answer_buyer_check(customer_name):
     else:
         return True
     return False
-                
-@log_decorator
-def ChatGPT_reply_content(drivermanager):
-    try:
-        # 輸出對話格式
-        html_content = view_custormer_chat(drivermanager) # 生成html格式內容
-        chatgpt_content = chatgpt_extract_conversations(html_content) # html轉換chatgpt格式內容
-        
-        # 調用ChatGPT回覆
-        chatgpt_api_key = read_database('database.db', 'chatgpt_api_key')
-        chatgpt_assistant_id = read_database('database.db', 'chatgpt_assistant_id')
-        
-        ChatGPT_Robot_reply = ChatGPT_Robot(chatgpt_api_key, chatgpt_assistant_id, chatgpt_content) # 接入chatgpt回覆
-        print(ChatGPT_Robot_reply)
-        return ChatGPT_Robot_reply
-    except Exception:
-        logging.exception('產生 ChatGPT 回覆失敗')
-        print(traceback.format_exc())
-        raise
 
-@log_decorator
-def reply_task(drivermanager, reply_type):
-    try:
-        global UI_STATUS_DATA
-        # 進入至特定頁面、狀態
-        now = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+# 送給 LLM 的對話上下文：token 預算與保留原文的最近訊息數
+try:
+    LLM_TOKEN_BUDGET = int(os.environ.get('LLM_TOKEN_BUDGET', '1500'))
+    # 至少保留 1 則（0 會讓 conversations[-0:] 變成保留全部）
+    LLM_KEEP_TURNS = max(1, int(os.environ.get('LLM_KEEP_TURNS', '8')))
+except ValueError:
+    LLM_TOKEN_BUDGET, LLM_KEEP_TURNS = 1500, 8
 
-        print("已刷新頁面，更新時間:" + now)
-        drivermanager.driver.get("https://seller.shopee.tw/new-webchat/conversations")
+_TOKEN_ENCODER = None
 
-        # 進入頁面後，優先切到『全部聊聊』，每次刷新都執行一次以確保在正確分頁
+def count_tokens(text):
+    """
+    在本機估算 token 數。有安裝 tiktoken 時精確計算，
+    否則以中日韓字元每字 1 token、其他字元每 4 字 1 token 估算。
+    """
+    global _TOKEN_ENCODER
+    text = text or ''
+    if _TOKEN_ENCODER is None:
         try:
-            if drivermanager.click_all_conversations(timeout=8):
-                drivermanager.record_nav("reply_task: clicked all conversations")
+            import tiktoken
+            _TOKEN_ENCODER = tiktoken.get_encoding('cl100k_base')
         except Exception:
-            pass
+            _TOKEN_ENCODER = False
+    if _TOKEN_ENCODER:
+        return len(_TOKEN_ENCODER.encode(text))
+    cjk = sum(1 for ch in text if '\u2e80' <= ch <= '\u9fff' or '\uac00' <= ch <= '\ud7af' or '\uff00' <= ch <= '\uffef')
+    return cjk + (len(text) - cjk + 3) // 4
+
+def dedupe_conversations(conversations):
+    """移除連續重複的訊息（例如客人重複送出同一句話）"""
+    result = []
+    for message in conversations:
+        if result and result[-1]['role'] == message['role'] and result[-1]['content'] == message['content']:
+            continue
+        result.append(message)
+    return result
+
+def _conversations_hash(conversations):
+    payload = json.dumps(conversations, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+class ConversationSummaryCache():
+    """
+    每位客人的滾動摘要快取（conversation_summaries.json）。
 
-        # 伺服器錯誤/頁面未就緒 → 重試與重新加載
-        def ensure_chat_ready(max_retry=4):
-            for i in range(max_retry):
-                try:
-                    # 檢查是否出現伺服器錯誤提示
-                    error_hint = None
-                    try:
-                        error_hint = drivermanager.wait_for_element(
-                            drivermanager.driver,
-                            By.XPATH,
-                            "//*[contains(text(),'伺服器錯誤') or contains(text(),'服务器错误') or contains(text(),'Server Error')]",
-                            timeout=2
-                        )
-                    except Exception:
-                        pass
+    記錄摘要涵蓋的較舊訊息數與其雜湊；下次只需把新增的較舊訊息併入既有摘要，
+    對話開頭有變動（雜湊不符）時才重新摘要。
+    """
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                self.entries = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.entries = {}
+
+    def summarize(self, customer_name, older, summarize_fn, min_new=4):
+        """
+        取得涵蓋 older 的摘要。新增的較舊訊息少於 min_new 則時沿用既有摘要，
+        不額外呼叫 LLM，未涵蓋的訊息由呼叫端以原文送出。
+
+        :param customer_name: 客戶名稱
+        :param older: 要摘要的較舊訊息
+        :param summarize_fn: 產生摘要的函數 (先前摘要, 新增訊息) -> 摘要
+        :param min_new: 觸發更新摘要的最少新增訊息數
+        :return: (摘要文字, 摘要涵蓋的訊息數)
+        """
+        with self._lock:
+            entry = self.entries.get(customer_name)
+        covered = 0
+        previous_summary = ''
+        if entry and entry.get('covered', 0) <= len(older) and \
+                _conversations_hash(older[:entry['covered']]) == entry.get('hash'):
+            covered = entry['covered']
+            previous_summary = entry.get('summary', '')
+        if len(older) - covered < min_new:
+            return previous_summary, covered
+        summary = summarize_fn(previous_summary, older[covered:])
+        with self._lock:
+            self.entries[customer_name] = {
+                'covered': len(older),
+                'hash': _conversations_hash(older),
+                'summary': summary,
+            }
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self.entries, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        return summary, len(older)
+
+SUMMARY_CACHE = None
+
+def get_summary_cache():
+    global SUMMARY_CACHE
+    if SUMMARY_CACHE is None:
+        SUMMARY_CACHE = ConversationSummaryCache(os.path.join(FILE_PATH, 'conversation_summaries.json'))
+    return SUMMARY_CACHE
 
-                    if error_hint:
-                        # 嘗試按下重新加載按鈕
-                        try:
-                            reload_btn = drivermanager.wait_for_element(
-                                drivermanager.driver,
-                                By.XPATH,
-                                "//button[contains(.,'重新加載') or contains(.,'重新加载') or contains(.,'Refresh')]",
-                                timeout=2
-                            )
-                            reload_btn.click()
-                            time.sleep(2)
-                        except Exception:
-                            drivermanager.driver.refresh()
-                            time.sleep(2)
+@log_decorator
+def build_llm_context(customer_name, conversations, api_key, assistant_id,
+                      token_budget=None, keep_turns=None, speculative=False):
+    """
+    建立送給 LLM 的對話上下文：去除重複訊息、保留最近 keep_turns 則原文，
+    較舊的訊息以每位客人快取的滾動摘要取代，並確保總 token 數不超過預算。
 
-                    # 有任一聊天篩選器就算就緒
-                    try:
-                        filt_any = drivermanager.wait_for_element(
-                            drivermanager.driver,
-                            By.CSS_SELECTOR,
-                            "[data-cy^='webchat-conversation-filter-filter-']",
-                            timeout=5
-                        )
-                        if filt_any:
-                            return True
-                    except Exception:
-                        pass
+    :param customer_name: 客戶名稱（None 時不使用摘要）
+    :param conversations: 擷取到的完整對話
+    :param speculative: 預先產生草稿時為真，摘要呼叫同樣不影響斷路器
+    :return: 對話訊息列表
+    """
+    token_budget = token_budget or LLM_TOKEN_BUDGET
+    keep_turns = max(1, keep_turns or LLM_KEEP_TURNS)
+    conversations = dedupe_conversations(conversations)
+    older, recent = conversations[:-keep_turns], conversations[-keep_turns:]
 
-                    # 不就緒則刷新再試
-                    drivermanager.driver.refresh()
-                    time.sleep(2)
-                except Exception:
-                    time.sleep(1)
-            return False
+    summary_message = None
+    if older and customer_name:
+        try:
+            backend = get_llm_backend(api_key, assistant_id)
+            governor = get_llm_governor()
+
+            def summarize_fn(previous_summary, messages):
+                estimated = sum(count_tokens(m['content']) for m in messages) + 300
+                return governor.call(lambda: backend.summarize(previous_summary, messages), estimated,
+                                     speculative=speculative)
+
+            summary, covered = get_summary_cache().summarize(customer_name, older, summarize_fn)
+            if summary:
+                summary_message = {"role": "user", "content": f"【先前對話摘要】{summary}"}
+            # 摘要尚未涵蓋的較舊訊息以原文送出
+            recent = conversations[covered:]
+        except Exception:
+            logging.exception('產生對話摘要失敗，僅保留最近訊息')
+
+    # 超出預算時先捨棄最舊的原文訊息（至少保留最後一則），仍超出則截短摘要
+    def total(messages):
+        return sum(count_tokens(m['content']) + 4 for m in messages)
+    while len(recent) > 1 and total(([summary_message] if summary_message else []) + recent) > token_budget:
+        recent = recent[1:]
+    if summary_message:
+        remaining = token_budget - total(recent)
+        if remaining <= 8:
+            summary_message = None
+        else:
+            while count_tokens(summary_message['content']) > remaining - 4:
+                summary_message['content'] = summary_message['content'][:int(len(summary_message['content']) * 0.8)]
 
-        if not ensure_chat_ready():
-            print("聊天頁面載入失敗，稍後重試")
-            return
+    context = ([summary_message] if summary_message else []) + recent
+    print(f"LLM 上下文：原始 {len(conversations)} 則，送出 {len(context)} 則，約 {total(context)} tokens")
+    return context
+
+# 是否在進入對話前，依保存的逐字稿與列表預覽預先產生回覆
+LLM_SPECULATIVE = os.environ.get('LLM_SPECULATIVE', '1') == '1'
+
+class DraftSpeculator():
+    """
+    預先產生回覆草稿。
 
-        # 點擊篩選器：優先未回覆，否則全部，再否則以文字定位
+    對話列表出現新訊息且本機已有該客人的逐字稿時，以「逐字稿 + 預覽中的最新訊息」
+    推測完整對話並在背景呼叫 LLM；進入對話擷取新訊息後，實際對話與推測一致才採用草稿，
+    不一致則捨棄，改走一般流程。
+    """
+    def __init__(self, max_workers=2):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='draft')
+        self.drafts = {}  # customer -> (對話雜湊, future)
+        self.counters = collections.Counter()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def predict(customer_name, history, preview_text):
+        """
+        由逐字稿與預覽文字推測目前的完整對話。
+
+        :return: 推測的對話，無法推測（沒有預覽訊息或預覽已在逐字稿中）時回傳 None
+        """
+        lines = [line for line in (preview_text or '').splitlines()
+                 if line != customer_name and not line.isdigit()]  # 去除客人名稱與未讀數
+        if not lines:
+            return None
+        message = lines[-1]
+        if history and history[-1]['content'] == message:
+            return None
+        return history + [{"role": "user", "content": message}]
+
+    def start(self, customer_name, preview_text):
+        """對話列表出現新訊息時呼叫，已有草稿、沒有逐字稿或本輪預算已用盡時不動作"""
+        deadline = current_deadline()
+        if deadline is not None and deadline.remaining() <= 0:
+            return
+        with self._lock:
+            if customer_name in self.drafts:
+                return
         try:
-            filt = drivermanager.wait_for_element(
-                drivermanager.driver,
-                By.CSS_SELECTOR,
-                "[data-cy='webchat-conversation-filter-filter-new']",
-                timeout=6
-            )
+            history = get_transcript_store().history(customer_name)
+            if not history:
+                return
+            predicted = self.predict(customer_name, history, preview_text)
+            if predicted is None:
+                return
+            api_key = read_database('database.db', 'chatgpt_api_key')
+            assistant_id = read_database('database.db', 'chatgpt_assistant_id')
+            future = self.executor.submit(self._generate, customer_name, predicted, api_key, assistant_id)
         except Exception:
-            try:
-                filt = drivermanager.wait_for_element(
-                    drivermanager.driver,
-                    By.CSS_SELECTOR,
-                    "[data-cy='webchat-conversation-filter-filter-all']",
-                    timeout=6
-                )
-            except Exception:
-                filt = drivermanager.wait_for_element(
-                    drivermanager.driver,
-                    By.XPATH,
-                    "//div[contains(text(),'未回覆') or contains(text(),'未回复') or contains(text(),'全部') or contains(text(),'All')]",
-                    timeout=8
-                )
-        filt.click()
+            logging.exception(f'預先產生客人 {customer_name} 的回覆失敗')
+            return
+        with self._lock:
+            self.drafts[customer_name] = (_conversations_hash(predicted), future)
+        self.counters['started'] += 1
+        print(f"預先產生回覆: {customer_name}")
+
+    def _generate(self, customer_name, conversations, api_key, assistant_id):
+        # 背景執行緒沒有呼叫端的時間預算，自行設定單一客人的預算
+        with deadline_scope(CONVERSATION_BUDGET_SEC, f'預先產生 {customer_name}'):
+            context = build_llm_context(customer_name, conversations, api_key, assistant_id, speculative=True)
+            estimated_tokens = sum(count_tokens(m['content']) + 4 for m in context) + 500
+            return get_llm_governor().call(
+                lambda: ChatGPT_Robot(api_key, assistant_id, context), estimated_tokens, max_retries=0,
+                speculative=True)
+
+    def take(self, customer_name, conversations):
+        """
+        取出草稿並與實際對話比對。
+
+        :param conversations: 擷取新訊息後的完整對話
+        :return: 對話與推測一致時回傳草稿內容，否則回傳 None
+        """
+        with self._lock:
+            entry = self.drafts.pop(customer_name, None)
+        if entry is None:
+            return None
+        fingerprint, future = entry
+        if fingerprint != _conversations_hash(conversations):
+            future.cancel()
+            self.counters['discarded'] += 1
+            print(f"預先產生的回覆與實際對話不符，捨棄: {customer_name}")
+            return None
         try:
-            container = drivermanager.wait_for_element(drivermanager.driver, By.CLASS_NAME, "ReactVirtualized__List")
-        except Exception as e:
-            print("無待回覆對話,結束回覆任務")
-            return  # 退出函數
+            draft = future.result(timeout=budget_timeout(CONVERSATION_BUDGET_SEC))
+        except DeadlineExceeded:
+            raise
+        except Exception:
+            # 逾時或 LLM 失敗都改走一般流程
+            future.cancel()
+            self.counters['failed'] += 1
+            return None
+        if not draft:
+            self.counters['failed'] += 1
+            return None
+        self.counters['hits'] += 1
+        print(f"採用預先產生的回覆: {customer_name}")
+        return draft
+
+    def discard_all(self):
+        """本輪結束時捨棄未使用的草稿"""
+        with self._lock:
+            drafts, self.drafts = self.drafts, {}
+        for _, future in drafts.values():
+            future.cancel()
+        self.counters['unused'] += len(drafts)
+
+    def print_report(self):
+        if self.counters['started']:
+            print("預先產生回覆: " + ", ".join(f"{k} {v}" for k, v in sorted(self.counters.items())))
+
+DRAFT_SPECULATOR = None
+
+def get_draft_speculator():
+    global DRAFT_SPECULATOR
+    if DRAFT_SPECULATOR is None:
+        DRAFT_SPECULATOR = DraftSpeculator()
+    return DRAFT_SPECULATOR
 
-        # 初始數據
-        whitelist = read_whitelist()
-        old_chat_list = []
-        new_chat_list = []
-        is_scrolled_to_bottom = False
+@log_decorator
+def harvest_conversation(drivermanager, customer_name=None):
+    """
+    擷取目前開啟的對話。
 
-        # 開始載入對話
+    :param drivermanager: 瀏覽器對象
+    :param customer_name: 客戶名稱；提供時只擷取上次保存之後的新訊息，完整對話由本機逐字稿提供
+    :return: ChatGPT 格式的對話
+    """
+    if customer_name:
+        store = get_transcript_store()
+        stored_tail = store.tail(customer_name)
+        html_content, complete = collect_chat_html(drivermanager, stored_tail)
+        messages = extract_messages(html_content)
+        start = align_new_messages(messages, stored_tail)
+        if start is not None:
+            # 只保存重疊之後的新訊息，鍵值依完整對話的出現次數計算
+            messages = rekey_messages(messages[start:], store.ident_counts(customer_name))
+        elif not complete:
+            # 預算不足只擷取到最新的部分：接在已保存的訊息之後，下次即可從這裡對齊
+            messages = rekey_messages(messages, store.ident_counts(customer_name))
+            print(f"客人 {customer_name} 的較舊訊息未擷取完整，本次以最新 {len(messages)} 則訊息回覆")
+        # 找不到重疊且已完整擷取時（首次擷取或已捲到最舊），extract_messages 的鍵值即以完整對話計算
+        added = store.add_messages(customer_name, messages)
+        print(f"新擷取 {len(added)} 則訊息")
+        return store.history(customer_name)
+    html_content = view_custormer_chat(drivermanager) # 生成html格式內容
+    return chatgpt_extract_conversations(html_content) # html轉換chatgpt格式內容
+
+@log_decorator
+def generate_reply(customer_name, chatgpt_content, typer_factory=None, fallback_text=None):
+    """
+    依對話內容產生 ChatGPT 回覆，不操作瀏覽器（串流輸入除外）。
+
+    :param customer_name: 客戶名稱，用於比對預先產生的草稿與讀取對話摘要快取
+    :param chatgpt_content: harvest_conversation 擷取的對話
+    :param typer_factory: 建立 ProgressiveTyper 的函數，提供時以串流方式邊產生邊輸入（採用預先產生的回覆時不會呼叫）；
+        串流失敗會清除已輸入內容並改用一般模式
+    :param fallback_text: LLM 無法使用時改送的標準回覆
+    :return: 回覆內容，LLM 失敗且沒有標準回覆時回傳 None
+    """
+    if customer_name and LLM_SPECULATIVE:
+        draft = get_draft_speculator().take(customer_name, chatgpt_content)
+        if draft:
+            print(draft)
+            return draft
+    # 沒有可用的草稿才建立串流輸入器，避免閒置的輸入執行緒
+    typer = typer_factory() if typer_factory is not None else None
+
+    # 調用ChatGPT回覆
+    chatgpt_api_key = read_database('database.db', 'chatgpt_api_key')
+    chatgpt_assistant_id = read_database('database.db', 'chatgpt_assistant_id')
+    chatgpt_content = build_llm_context(customer_name, chatgpt_content, chatgpt_api_key, chatgpt_assistant_id)
+
+    governor = get_llm_governor()
+    estimated_tokens = sum(count_tokens(m['content']) + 4 for m in chatgpt_content) + 500
+
+    if typer is not None:
+        def on_delta(delta):
+            # 輸入對話框的錯誤屬於瀏覽器問題，不拋進 governor.call 以免計入斷路器；
+            # typer.error 已記錄錯誤，finish() 會清除後以完整內容重新輸入
+            try:
+                typer.feed(delta)
+            except Exception:
+                pass
+
+        try:
+            # 串流已輸入部分內容，不在此重試，失敗時改用一般模式
+            ChatGPT_Robot_reply = governor.call(
+                lambda: ChatGPT_Robot_stream(chatgpt_api_key, chatgpt_assistant_id, chatgpt_content, on_delta),
+                estimated_tokens, max_retries=0)
+            if typer.finish(ChatGPT_Robot_reply):
+                print(ChatGPT_Robot_reply)
+                return ChatGPT_Robot_reply
+        except CircuitOpenError:
+            pass
+        except DeadlineExceeded:
+            typer.reset()
+            raise
+        except Exception:
+            logging.exception('串流回覆失敗，改用一般模式')
+            print("串流回覆失敗，改用一般模式")
+        typer.reset()
+
+    try:
+        ChatGPT_Robot_reply = governor.call(
+            lambda: ChatGPT_Robot(chatgpt_api_key, chatgpt_assistant_id, chatgpt_content),
+            estimated_tokens) # 接入chatgpt回覆
+    except DeadlineExceeded:
+        raise
+    except Exception as e:
+        if isinstance(e, CircuitOpenError):
+            print("LLM 服務異常（斷路器開啟中），改用標準回覆")
+        else:
+            logging.exception('LLM 呼叫失敗，改用標準回覆')
+            print("LLM 呼叫失敗，改用標準回覆")
+        if fallback_text:
+            governor.count('fallbacks')
+        return fallback_text or None
+    print(ChatGPT_Robot_reply)
+    return ChatGPT_Robot_reply
+
+@log_decorator
+def ChatGPT_reply_content(drivermanager, typer_factory=None, customer_name=None, fallback_text=None):
+    """
+    擷取目前對話並產生 ChatGPT 回覆。
+
+    :param drivermanager: 瀏覽器對象
+    :param typer_factory: 建立 ProgressiveTyper 的函數，提供時以串流方式邊產生邊輸入（採用預先產生的回覆時不會呼叫）；
+        串流失敗會清除已輸入內容並改用一般模式
+    :param customer_name: 客戶名稱，用於讀取該客人的對話摘要快取
+    :param fallback_text: LLM 無法使用時改送的標準回覆
+    :return: 回覆內容，LLM 失敗且沒有標準回覆時回傳 None
+    """
+    try:
+        chatgpt_content = harvest_conversation(drivermanager, customer_name)
+        return generate_reply(customer_name, chatgpt_content, typer_factory=typer_factory, fallback_text=fallback_text)
+    except Exception:
+        logging.exception('產生 ChatGPT 回覆失敗')
+        print(traceback.format_exc())
+        raise
+
+@log_decorator
+def open_unreplied_list(drivermanager):
+    """
+    進入聊聊頁面並切換到『未回覆』篩選器。
+
+    :param drivermanager: 瀏覽器對象
+    :return: 對話列表容器元素，頁面未就緒或沒有待回覆對話時回傳 None
+    """
+    # 進入至特定頁面、狀態
+    now = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+    print("已刷新頁面，更新時間:" + now)
+    drivermanager.driver.get("https://seller.shopee.tw/new-webchat/conversations")
+
+    # 進入頁面後，優先切到『全部聊聊』，每次刷新都執行一次以確保在正確分頁
+    try:
+        if drivermanager.click_all_conversations(timeout=8):
+            drivermanager.record_nav("reply_task: clicked all conversations")
+    except Exception:
+        pass
+
+    # 伺服器錯誤/頁面未就緒 → 重試與重新加載
+    def ensure_chat_ready(max_retry=4):
+        for i in range(max_retry):
+            try:
+                # 檢查是否出現伺服器錯誤提示
+                error_hint = None
+                try:
+                    error_hint = drivermanager.wait_for_element(
+                        drivermanager.driver,
+                        By.XPATH,
+                        "//*[contains(text(),'伺服器錯誤') or contains(text(),'服务器错误') or contains(text(),'Server Error')]",
+                        timeout=2
+                    )
+                except Exception:
+                    pass
+
+                if error_hint:
+                    # 嘗試按下重新加載按鈕
+                    try:
+                        reload_btn = drivermanager.wait_for_element(
+                            drivermanager.driver,
+                            By.XPATH,
+                            "//button[contains(.,'重新加載') or contains(.,'重新加载') or contains(.,'Refresh')]",
+                            timeout=2
+                        )
+                        reload_btn.click()
+                        time.sleep(2)
+                    except Exception:
+                        drivermanager.driver.refresh()
+                        time.sleep(2)
+
+                # 有任一聊天篩選器就算就緒
+                try:
+                    filt_any = drivermanager.wait_for_element(
+                        drivermanager.driver,
+                        By.CSS_SELECTOR,
+                        "[data-cy^='webchat-conversation-filter-filter-']",
+                        timeout=5
+                    )
+                    if filt_any:
+                        return True
+                except Exception:
+                    pass
+
+                # 不就緒則刷新再試
+                drivermanager.driver.refresh()
+                time.sleep(2)
+            except Exception:
+                time.sleep(1)
+        return False
+
+    if not ensure_chat_ready():
+        print("聊天頁面載入失敗，稍後重試")
+        return None
+
+    # 點擊篩選器：優先未回覆，否則全部，再否則以文字定位
+    try:
+        filt = drivermanager.wait_for_element(
+            drivermanager.driver,
+            By.CSS_SELECTOR,
+            "[data-cy='webchat-conversation-filter-filter-new']",
+            timeout=6
+        )
+    except Exception:
+        try:
+            filt = drivermanager.wait_for_element(
+                drivermanager.driver,
+                By.CSS_SELECTOR,
+                "[data-cy='webchat-conversation-filter-filter-all']",
+                timeout=6
+            )
+        except Exception:
+            filt = drivermanager.wait_for_element(
+                drivermanager.driver,
+                By.XPATH,
+                "//div[contains(text(),'未回覆') or contains(text(),'未回复') or contains(text(),'全部') or contains(text(),'All')]",
+                timeout=8
+            )
+    filt.click()
+    try:
+        container = drivermanager.wait_for_element(drivermanager.driver, By.CLASS_NAME, "ReactVirtualized__List")
+    except Exception as e:
+        print("無待回覆對話,結束回覆任務")
+        return None  # 退出函數
+    return container
+
+# 回覆輸入方式：bulk 為一次插入整段文字（CDP Input.insertText），keys 為逐行 send_keys
+REPLY_INPUT_MODE = os.environ.get('REPLY_INPUT_MODE', 'bulk')
+
+_FOCUS_END_JS = """
+const el = arguments[0];
+el.focus();
+if (typeof el.selectionStart === 'number') {
+  el.selectionStart = el.selectionEnd = el.value.length;
+} else {
+  const range = document.createRange();
+  range.selectNodeContents(el);
+  range.collapse(false);
+  const sel = window.getSelection();
+  sel.removeAllRanges();
+  sel.addRange(range);
+}
+"""
+
+# 不含 el 宣告，可直接接在 _FOCUS_END_JS 之後（同一段腳本重複宣告 const el 會是語法錯誤）
+_READ_VALUE_JS = "return (typeof el.value === 'string') ? el.value : (el.innerText || '');"
+_READ_INPUT_JS = "const el = arguments[0]; " + _READ_VALUE_JS
+
+_EXEC_INSERT_JS = """
+const el = arguments[0];
+el.focus();
+if (!document.execCommand('insertText', false, arguments[1])) {
+  const setter = Object.getOwnPropertyDescriptor(Object.getPrototypeOf(el), 'value');
+  if (setter && setter.set) { setter.set.call(el, el.value + arguments[1]); }
+  el.dispatchEvent(new InputEvent('input', {bubbles: true, inputType: 'insertText', data: arguments[1]}));
+}
+"""
+
+def _normalize_input_text(text):
+    return (text or '').replace('\r\n', '\n').replace('\xa0', ' ').strip()
+
+def insert_text_bulk(textarea_element, text):
+    """
+    以一次 CDP Input.insertText 插入整段多行文字。
+    Input.insertText 等同輸入法提交，瀏覽器會觸發 beforeinput/input 事件，送出按鈕能正常偵測到內容。
+    插入後讀回內容比對，失敗時改用 execCommand('insertText')。
+
+    :param textarea_element: 對話輸入框元素
+    :param text: 回覆內容
+    :return: 是否成功插入
+    """
+    driver = textarea_element.parent
+    try:
+        before = driver.execute_script(_FOCUS_END_JS + _READ_VALUE_JS, textarea_element) or ''
+    except Exception:
+        logging.exception('讀取輸入框內容失敗')
+        return False
+    expected = _normalize_input_text(before + text)
+    try:
+        driver.execute_cdp_cmd('Input.insertText', {'text': text})
+        if _normalize_input_text(driver.execute_script(_READ_INPUT_JS, textarea_element)) == expected:
+            return True
+    except Exception:
+        logging.exception('Input.insertText 失敗，改用 execCommand')
+    # 還原內容後以 execCommand 重試
+    try:
+        driver.execute_script(_FOCUS_END_JS + "document.execCommand('selectAll'); document.execCommand('delete');", textarea_element)
+        driver.execute_script(_EXEC_INSERT_JS, textarea_element, before + text)
+        return _normalize_input_text(driver.execute_script(_READ_INPUT_JS, textarea_element)) == expected
+    except Exception:
+        logging.exception('execCommand insertText 失敗')
+        return False
+
+@log_decorator
+def send_text_with_shift_enter(textarea_element, text, mode=None):
+    """
+    將多行文字輸入對話框。
+
+    預設（REPLY_INPUT_MODE=bulk）以一次 CDP 呼叫插入整段文字；失敗或設定為 keys 時，
+    改以按鍵序列輸入，行與行之間以 SHIFT+ENTER 換行，整段序列在一次 send_keys 中送出。
+
+    :param textarea_element: 對話輸入框元素
+    :param text: 回覆內容
+    :param mode: 輸入方式，None 時使用 REPLY_INPUT_MODE
+    """
+    if (mode or REPLY_INPUT_MODE) == 'bulk':
+        try:
+            if insert_text_bulk(textarea_element, text):
+                return
+        except Exception:
+            logging.exception('整段插入失敗，改用按鍵輸入')
+        # 清掉可能殘留的部分內容，改用按鍵輸入
+        try:
+            clear_input(textarea_element)
+        except Exception:
+            pass
+    _send_keys_lines(textarea_element, text)
+
+def _send_keys_lines(textarea_element, text):
+    """以一次 send_keys 送出整段按鍵序列，行與行之間以 SHIFT+ENTER 換行"""
+    keys = []
+    for i, part in enumerate(text.split('\n')):
+        if i > 0:
+            keys.append(Keys.SHIFT + Keys.ENTER + Keys.NULL)
+        keys.append(part)
+    textarea_element.send_keys(*keys)
+
+def clear_input(textarea_element):
+    """清除對話框內容（同樣會觸發 input 事件）"""
+    textarea_element.parent.execute_script(_FOCUS_END_JS + "document.execCommand('selectAll'); document.execCommand('delete');", textarea_element)
+
+class ProgressiveTyper():
+    """
+    串流回覆的逐段輸入器。
+
+    feed() 只把文字片段放進佇列，由背景執行緒合併目前累積的片段後一次插入對話框，
+    讓輸入與 LLM 產生同時進行。來源標註【...†來源】可能被切在兩個片段之間，
+    遇到未閉合的【會先暫存，等完整後過濾再輸入。
+    """
+    def __init__(self, textarea_element, mode=None):
+        self.textarea_element = textarea_element
+        self.mode = mode or REPLY_INPUT_MODE
+        self.typed = ''
+        self.error = None
+        self._held = ''
+        self._queue = queue.Queue()
+        self._stop = threading.Event()
+        self._thread = Thread(target=self._typing_loop, name='ProgressiveTyper', daemon=True)
+        self._thread.start()
+
+    def feed(self, delta):
+        if self.error is not None:
+            raise self.error
+        self._queue.put(delta)
+
+    def _type(self, text):
+        if not text:
+            return
+        if self.mode == 'bulk':
+            driver = self.textarea_element.parent
+            driver.execute_script(_FOCUS_END_JS, self.textarea_element)
+            driver.execute_cdp_cmd('Input.insertText', {'text': text})
+        else:
+            _send_keys_lines(self.textarea_element, text)
+        self.typed += text
+
+    def _take_ready(self, final=False):
+        text = self._held
+        cut = text.rfind('【')
+        if not final and cut != -1 and '】' not in text[cut:]:
+            self._held = text[cut:]
+            text = text[:cut]
+        else:
+            self._held = ''
+        return clean_llm_output(text)
+
+    def _typing_loop(self):
+        while True:
+            item = self._queue.get()
+            chunks = [item]
+            # 合併目前已到達的所有片段，減少 WebDriver 往返
+            while True:
+                try:
+                    chunks.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            final = None in chunks
+            self._held += ''.join(c for c in chunks if c)
+            try:
+                if self.error is None and not self._stop.is_set():
+                    self._type(self._take_ready(final))
+            except Exception as e:
+                self.error = e
+            if final:
+                return
+
+    def finish(self, final_text, timeout=30):
+        """
+        等待所有片段輸入完成，並確認對話框內容與完整回覆一致；
+        不一致時清除後以完整內容重新輸入。
+
+        :return: 是否已完成輸入
+        """
+        self._queue.put(None)
+        if not self._halt(timeout):
+            # 背景執行緒仍卡在輸入中，此時重新輸入會與它交錯，放棄本次輸入
+            logging.error('串流回覆輸入逾時，背景輸入尚未停止')
+            return False
+        if self.error is None and _normalize_input_text(self.typed) == _normalize_input_text(final_text):
+            return True
+        try:
+            clear_input(self.textarea_element)
+            send_text_with_shift_enter(self.textarea_element, final_text, mode=self.mode)
+            self.typed = final_text
+            return True
+        except Exception:
+            logging.exception('串流回覆補正輸入失敗')
+            return False
+
+    def _halt(self, timeout):
+        """
+        等待背景執行緒結束；逾時則要求它停止輸入後再等一次。
+
+        :return: 背景執行緒是否已結束
+        """
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            self._stop.set()
+            self._thread.join(10)
+        return not self._thread.is_alive()
+
+    def reset(self):
+        """串流失敗時停止輸入並清除已輸入的內容"""
+        self._stop.set()
+        self._queue.put(None)
+        self._halt(5)
+        if self.typed:
+            try:
+                clear_input(self.textarea_element)
+            except Exception:
+                pass
+        self.typed = ''
+
+_BENCHMARK_PAGE = """data:text/html;charset=utf-8,
+<textarea id='composer' style='width:600px;height:300px'></textarea>
+<button id='send' disabled>send</button>
+<script>
+const ta = document.getElementById('composer');
+const btn = document.getElementById('send');
+ta.addEventListener('input', () => { btn.disabled = ta.value.trim().length === 0; });
+</script>
+"""
+
+def benchmark_reply_input(drivermanager, text=None, rounds=3):
+    """
+    在本機基準頁面量測兩種輸入方式的送出前時間（time-to-send）：
+    從開始輸入到內容完整且送出按鈕因 input 事件啟用為止。
+
+    :param drivermanager: 瀏覽器對象
+    :param text: 測試文字，預設為約 600 字的多行回覆
+    :param rounds: 每種方式量測次數
+    :return: 輸入方式 -> 平均秒數 的字典
+    """
+    if text is None:
+        line = '您好，感謝您的詢問！商品目前有現貨，下單後約 1-2 個工作天出貨，若有其他問題歡迎隨時詢問。'
+        text = '\n'.join([line] * 12)
+    results = {}
+    for mode in ('keys', 'bulk'):
+        durations = []
+        for _ in range(rounds):
+            drivermanager.driver.get(_BENCHMARK_PAGE)
+            textarea_element = drivermanager.wait_for_element(drivermanager.driver, By.ID, 'composer')
+            start = time.perf_counter()
+            send_text_with_shift_enter(textarea_element, text, mode=mode)
+            WebDriverWait(drivermanager.driver, 30).until(
+                lambda d: d.execute_script("return !document.getElementById('send').disabled && document.getElementById('composer').value.length >= arguments[0];", len(text.strip()))
+            )
+            durations.append(time.perf_counter() - start)
+        results[mode] = sum(durations) / len(durations)
+        print(f"輸入方式 {mode}: 平均 {results[mode] * 1000:.0f} ms（{len(text)} 字，{rounds} 次）")
+    return results
+
+_NAV_TIMING_JS = """
+const nav = performance.getEntriesByType('navigation')[0];
+return nav ? [nav.domContentLoadedEventEnd, nav.loadEventEnd] : null;
+"""
+
+def browser_rss_mb(driver):
+    """
+    計算瀏覽器主行程與所有子行程（renderer、GPU 等）的常駐記憶體。
+
+    :param driver: uc.Chrome 實例
+    :return: MB，未安裝 psutil 或取不到行程時回傳 None
+    """
+    try:
+        import psutil
+    except ImportError:
+        return None
+    pid = getattr(driver, 'browser_pid', None)
+    if not pid:
+        return None
+    try:
+        browser = psutil.Process(pid)
+        processes = [browser] + browser.children(recursive=True)
+    except psutil.Error:
+        return None
+    total = 0
+    for process in processes:
+        try:
+            total += process.memory_info().rss
+        except psutil.Error:
+            pass
+    return total / 1024 / 1024
+
+def benchmark_browser_profiles(profile_dir, url, rounds=3, settle=5):
+    """
+    以同一個個人資料夾依序啟動預設與精簡模式的瀏覽器，量測頁面載入時間與記憶體用量。
+
+    :param profile_dir: Chrome 個人資料夾（已登入時可量測實際的聊聊頁面）
+    :param url: 量測的網址
+    :param rounds: 每種模式載入次數
+    :param settle: 量測記憶體前等待頁面穩定的秒數
+    :return: 模式 -> (平均載入毫秒, 記憶體 MB) 的字典
+    """
+    results = {}
+    for label, lean in (('預設', False), ('精簡', True)):
+        driver = WebDriverManager._launch_driver(profile_dir, lean=lean)
+        try:
+            loads = []
+            for _ in range(rounds):
+                driver.get(url)
+                WebDriverWait(driver, 60).until(lambda d: d.execute_script("return document.readyState") == 'complete')
+                timing = driver.execute_script(_NAV_TIMING_JS)
+                if timing:
+                    loads.append(timing[1] or timing[0])
+            time.sleep(settle)
+            rss = browser_rss_mb(driver)
+        finally:
+            driver.quit()
+        load_ms = sum(loads) / len(loads) if loads else None
+        results[label] = (load_ms, rss)
+        print(f"{label}模式: 載入 {f'{load_ms:.0f} ms' if load_ms is not None else '無資料'}，"
+              f"記憶體 {f'{rss:.0f} MB' if rss is not None else '無資料（需安裝 psutil）'}")
+
+    (base_load, base_rss), (lean_load, lean_rss) = results['預設'], results['精簡']
+    if base_load and lean_load:
+        print(f"精簡模式載入時間為預設的 {lean_load / base_load:.0%}")
+    if base_rss and lean_rss:
+        print(f"精簡模式記憶體為預設的 {lean_rss / base_rss:.0%}")
+    return results
+
+# 瀏覽器記憶體監控：每輪結束後取樣，超過門檻時在空檔回收分頁或瀏覽器
+MEMORY_WATCHDOG = os.environ.get('MEMORY_WATCHDOG', '1') == '1'
+try:
+    BROWSER_HEAP_LIMIT_MB = float(os.environ.get('BROWSER_HEAP_LIMIT_MB', '768'))
+    BROWSER_NODES_LIMIT = int(os.environ.get('BROWSER_NODES_LIMIT', '150000'))
+    BROWSER_RSS_LIMIT_MB = float(os.environ.get('BROWSER_RSS_LIMIT_MB', '3072'))
+except ValueError:
+    BROWSER_HEAP_LIMIT_MB, BROWSER_NODES_LIMIT, BROWSER_RSS_LIMIT_MB = 768.0, 150000, 3072.0
+
+class MemoryWatchdog():
+    """
+    瀏覽器記憶體監控。
+
+    每輪結束後以 CDP Performance.getMetrics 取樣目前分頁的 JS heap、DOM 節點數與文件數
+    （有安裝 psutil 時另計整個瀏覽器的常駐記憶體），寫入 browser_memory.csv 以觀察趨勢。
+    分頁超過門檻時先開新分頁取代；回收分頁後整個瀏覽器仍超過門檻時，保存 Cookie 並重啟瀏覽器。
+    """
+    FIELDS = ['time', 'heap_mb', 'nodes', 'documents', 'rss_mb', 'action']
+
+    def __init__(self, path, heap_limit_mb=None, nodes_limit=None, rss_limit_mb=None, history=120):
+        self.path = path
+        self.heap_limit_mb = heap_limit_mb or BROWSER_HEAP_LIMIT_MB
+        self.nodes_limit = nodes_limit or BROWSER_NODES_LIMIT
+        self.rss_limit_mb = rss_limit_mb or BROWSER_RSS_LIMIT_MB
+        self.samples = collections.deque(maxlen=history)
+        self.counters = collections.Counter()
+        self._enabled_target = None
+
+    def sample(self, driver):
+        """
+        取樣目前分頁的記憶體指標。
+
+        :return: 指標字典，取樣失敗時回傳 None
+        """
+        try:
+            # Performance.enable 只作用在目前分頁，瀏覽器或分頁更換（recycle_tab）後都要重新啟用
+            target = (id(driver), driver.current_window_handle)
+            if self._enabled_target != target:
+                driver.execute_cdp_cmd('Performance.enable', {})
+                self._enabled_target = target
+            metrics = {m['name']: m['value'] for m in driver.execute_cdp_cmd('Performance.getMetrics', {})['metrics']}
+        except Exception:
+            logging.exception('取樣瀏覽器記憶體失敗')
+            return None
+        return {
+            'time': time.time(),
+            'heap_mb': metrics.get('JSHeapUsedSize', 0) / 1024 / 1024,
+            'nodes': int(metrics.get('Nodes', 0)),
+            'documents': int(metrics.get('Documents', 0)),
+            'rss_mb': browser_rss_mb(driver),
+        }
+
+    def trend_mb_per_hour(self):
+        """以上次回收後最早與最新的取樣估計 JS heap 每小時增加量，取樣不足 10 分鐘時回傳 None"""
+        if len(self.samples) < 2:
+            return None
+        first, last = self.samples[0], self.samples[-1]
+        hours = (last['time'] - first['time']) / 3600
+        if hours < 1 / 6:
+            return None
+        return (last['heap_mb'] - first['heap_mb']) / hours
+
+    def _over_tab_limit(self, sample):
+        return sample['heap_mb'] > self.heap_limit_mb or sample['nodes'] > self.nodes_limit
+
+    def _over_browser_limit(self, sample):
+        return sample['rss_mb'] is not None and sample['rss_mb'] > self.rss_limit_mb
+
+    def _write(self, sample):
+        try:
+            is_new = not os.path.exists(self.path)
+            with open(self.path, 'a', newline='', encoding='utf-8') as f:
+                writer = csv.DictWriter(f, fieldnames=self.FIELDS)
+                if is_new:
+                    writer.writeheader()
+                row = dict(sample)
+                row['time'] = datetime.datetime.fromtimestamp(sample['time']).strftime('%Y-%m-%d %H:%M:%S')
+                row['heap_mb'] = f"{sample['heap_mb']:.1f}"
+                row['rss_mb'] = '' if sample['rss_mb'] is None else f"{sample['rss_mb']:.0f}"
+                writer.writerow(row)
+        except Exception:
+            logging.exception('寫入 browser_memory.csv 失敗')
+
+    def check(self, drivermanager):
+        """
+        在兩輪之間呼叫：取樣並視需要回收分頁或瀏覽器。
+
+        :return: 執行的動作（'tab'、'browser'），未回收時回傳 None
+        """
+        sample = self.sample(drivermanager.driver)
+        if sample is None:
+            return None
+        action = None
+        try:
+            if self._over_tab_limit(sample) or self._over_browser_limit(sample):
+                print(f"瀏覽器記憶體過高（JS heap {sample['heap_mb']:.0f} MB，DOM 節點 {sample['nodes']}），回收分頁")
+                drivermanager.recycle_tab()
+                action = 'tab'
+                after = self.sample(drivermanager.driver)
+                if after is not None and (self._over_tab_limit(after) or self._over_browser_limit(after)):
+                    print("回收分頁後記憶體仍過高，保存 Cookie 並重啟瀏覽器")
+                    drivermanager.recycle_browser()
+                    action = 'browser'
+                self.counters[action] += 1
+        except Exception:
+            logging.exception('回收瀏覽器資源失敗')
+            print("回收瀏覽器資源失敗，下一輪再試")
+        sample['action'] = action or ''
+        self._write(sample)
+        if action:
+            # 回收後重新累積趨勢
+            self.samples.clear()
+            fresh = self.sample(drivermanager.driver)
+            if fresh is not None:
+                self.samples.append(fresh)
+        else:
+            self.samples.append(sample)
+        trend = self.trend_mb_per_hour()
+        rss_text = f"，瀏覽器 {sample['rss_mb']:.0f} MB" if sample['rss_mb'] is not None else ''
+        trend_text = f"，趨勢 {trend:+.0f} MB/小時" if trend is not None else ''
+        print(f"瀏覽器記憶體：JS heap {sample['heap_mb']:.0f} MB，DOM 節點 {sample['nodes']}，文件 {sample['documents']}{rss_text}{trend_text}")
+        return action
+
+MEMORY_WATCHDOG_INSTANCE = None
+
+def get_memory_watchdog():
+    global MEMORY_WATCHDOG_INSTANCE
+    if MEMORY_WATCHDOG_INSTANCE is None:
+        MEMORY_WATCHDOG_INSTANCE = MemoryWatchdog(os.path.join(FILE_PATH, 'browser_memory.csv'))
+    return MEMORY_WATCHDOG_INSTANCE
+
+@log_decorator
+def template_reply_task(drivermanager, container, template_text):
+    """
+    標準回覆快速模式：逐一走訪未回覆列表，直接輸入標準回覆範本。
+    不擷取對話紀錄、不解析 HTML，也不呼叫 LLM，結束時回報每分鐘回覆數。
+
+    :param drivermanager: 瀏覽器對象
+    :param container: 對話列表容器元素
+    :param template_text: 標準回覆內容
+    """
+    journal = get_reply_journal()
+    start_time = time.time()
+    replied = 0
+    visited = set()
+    while True:
+        cells = drivermanager.wait_for_elements(container, By.CSS_SELECTOR, "[data-cy='webchat-conversation-cell-root']")
+        for cell in cells:
+            try:
+                customer_name = cell.find_element(By.CSS_SELECTOR, "[data-cy='webchat-conversation-cell-name']").get_attribute('title')
+            except Exception:
+                continue
+            if not customer_name or customer_name in visited:
+                continue
+            visited.add(customer_name)
+
+            preview_text = conversation_preview(cell)
+            watermark = conversation_watermark(preview_text)
+            if not answer_buyer_check(customer_name, preview_text):
+                continue
+            try:
+                cell.click()
+                textarea_element = drivermanager.wait_for_element(drivermanager.driver, By.CLASS_NAME, "E2MWg3w8y6", timeout=3)
+            except Exception:
+                continue
+
+            journal.record_intent(customer_name, watermark, template_text)
+            send_text_with_shift_enter(textarea_element, template_text)
+            journal.record_sent(customer_name, watermark, template_text)
+            print(f'已回覆客人: {customer_name}')
+            update_whitelist(customer_name)
+            update_watermark(customer_name, watermark, template_text)
+            journal.record_done(customer_name, watermark, template_text)
+            replied += 1
+            ENGINE_STATUS['replies'] += 1
+
+        # 一次捲動一個可視高度，並在同一次呼叫中判斷是否到底
+        is_scrolled_to_bottom = drivermanager.driver.execute_script(
+            """
+            const el = arguments[0];
+            el.scrollTop = el.scrollTop + el.clientHeight;
+            return el.scrollTop + el.clientHeight >= el.scrollHeight;
+            """,
+            container
+        )
+        if is_scrolled_to_bottom:
+            break
+        time.sleep(0.5)  # 等待虛擬列表渲染
+
+    elapsed = max(time.time() - start_time, 1e-6)
+    print(f"標準回覆快速模式：已回覆 {replied} 位客人，耗時 {elapsed:.1f} 秒，約 {replied * 60 / elapsed:.1f} 則/分鐘")
+    return replied
+
+@log_decorator
+def handle_conversation(drivermanager, reply, customer_name, watermark, reply_type, journal):
+    """
+    開啟單一客人的對話並回覆。
+
+    :param drivermanager: 瀏覽器對象
+    :param reply: 對話列表中的客人元素
+    :param customer_name: 客戶名稱
+    :param watermark: 客人欄位的預覽浮水印
+    :param reply_type: 回覆類型（0 人工、1 午休、2 下班）
+    :param journal: 回覆預寫日誌
+    :return: 是否已處理（回覆或記錄）
+    """
+    print(f"載入客人: {customer_name} 的對話視窗")
+    reply.click()
+
+    # 回覆客人
+    try:
+        textarea_element = drivermanager.wait_for_element(drivermanager.driver, By.CLASS_NAME, "E2MWg3w8y6")
+    except DeadlineExceeded:
+        raise
+    except:
+        return False
+
+    if reply_type not in (1, 2):
+        # 人工客服時段：不自動回覆，僅更新回覆名單
+        print(f'已回覆客人: {customer_name}')
+        update_whitelist(customer_name)
+        update_watermark(customer_name, watermark)
+        return False
+
+    # 日誌中若有尚未輸入的回覆，直接沿用內容，不再詢問 LLM
+    pending = journal.pending_intent(customer_name, watermark)
+    if journal.has_partial(customer_name):
+        # 上次串流輸入中斷，先清掉對話框殘留的部分內容
+        try:
+            clear_input(textarea_element)
+        except Exception:
+            pass
+    typers = []
+    if pending:
+        reply_text = pending['text']
+        print(f"回覆日誌：沿用先前產生的回覆內容 {customer_name}")
+    else:
+        fallback_text = UI_STATUS_DATA['lunchbreak_text'] if reply_type == 1 else UI_STATUS_DATA['getoff_text']
+
+        def make_typer():
+            # 串流模式：確定要呼叫 LLM（沒有可用的預先產生回覆）時才建立，
+            # 內容尚未產生，先記錄無內容的 intent，再邊產生邊輸入
+            journal.record_intent(customer_name, watermark, None)
+            typers.append(ProgressiveTyper(textarea_element))
+            return typers[-1]
+        try:
+            reply_text = ChatGPT_reply_content(drivermanager, typer_factory=make_typer if LLM_STREAM else None,
+                                               customer_name=customer_name, fallback_text=fallback_text)
+        except DeadlineExceeded:
+            raise
+        except Exception:
+            # 單一客人失敗不影響其他客人
+            logging.exception(f'產生客人 {customer_name} 的回覆失敗')
+            print(f"產生客人 {customer_name} 的回覆失敗，繼續處理下一位")
+            return False
+    return commit_reply(textarea_element, customer_name, watermark, reply_text, journal,
+                        pending=pending, typer=typers[-1] if typers else None)
+
+def commit_reply(textarea_element, customer_name, watermark, reply_text, journal, pending=None, typer=None):
+    """
+    輸入回覆並更新回覆日誌、回覆名單與浮水印。
+
+    :param textarea_element: 對話輸入框
+    :param reply_text: 回覆內容
+    :param pending: 日誌中沿用的 intent 紀錄，已記錄過 intent 時不再重複記錄
+    :param typer: 串流輸入用的 ProgressiveTyper，已輸入完成時不再重新輸入
+    :return: 是否已回覆
+    """
+    if not reply_text:
+        print(f"未取得回覆內容，略過客人: {customer_name}")
+        return False
+
+    if typer is None or not typer.typed:
+        if not pending:
+            journal.record_intent(customer_name, watermark, reply_text)
+        send_text_with_shift_enter(textarea_element, reply_text)
+    journal.record_sent(customer_name, watermark, reply_text)
+    #drivermanager.wait_for_element(drivermanager.driver, By.CSS_SELECTOR, "i.GHUxSkxNuJ.yHRqJXUiCY > svg.chat-icon > path").click()
+    print(f'已回覆客人: {customer_name}')
+    update_whitelist(customer_name) # 更新回覆名單
+    update_watermark(customer_name, watermark, reply_text)
+    journal.record_done(customer_name, watermark, reply_text)
+    ENGINE_STATUS['replies'] += 1
+    return True
+
+# 同時處理的聊天分頁數；1 為單一分頁依序處理
+try:
+    CHAT_TAB_COUNT = max(1, int(os.environ.get('CHAT_TAB_COUNT', '1')))
+except ValueError:
+    CHAT_TAB_COUNT = 1
+
+_FIND_CELL_JS = """
+const name = arguments[0];
+for (const cell of document.querySelectorAll("[data-cy='webchat-conversation-cell-root']")) {
+  const el = cell.querySelector("[data-cy='webchat-conversation-cell-name']");
+  if (el && el.getAttribute('title') === name) { return cell; }
+}
+return null;
+"""
+
+class ChatTab():
+    """分頁池中的單一聊天分頁"""
+    def __init__(self, handle, container):
+        self.handle = handle
+        self.container = container  # 該分頁的對話列表容器
+        self.lock = threading.Lock()  # 同一分頁同時只處理一位客人
+        self.job = None
+
+class ChatJob():
+    """分頁中處理中的客人：瀏覽器步驟完成後，等待 LLM 回覆再回到分頁輸入"""
+    def __init__(self, customer_name, watermark):
+        self.customer_name = customer_name
+        self.watermark = watermark
+        self.deadline = Deadline(CONVERSATION_BUDGET_SEC, f'客人 {customer_name}')
+        self.textarea_element = None
+        self.pending = None
+        self.future = None
+
+class TabPool():
+    """
+    同一瀏覽器內的多個聊天分頁。
+
+    WebDriver 同一時間只有一個作用中的分頁，所有瀏覽器指令都在 driver_lock 內切換到
+    目標分頁後執行；LLM 呼叫在背景執行緒進行，期間可切到其他分頁擷取對話或輸入回覆。
+    """
+    def __init__(self, drivermanager, count, container):
+        self.drivermanager = drivermanager
+        self.driver_lock = threading.RLock()
+        self.executor = ThreadPoolExecutor(max_workers=count, thread_name_prefix='tab-llm')
+        driver = drivermanager.driver
+        self.tabs = []
+        first_handle = driver.current_window_handle
+        self.tabs.append(ChatTab(first_handle, container))
+        for _ in range(count - 1):
+            driver.switch_to.new_window('tab')
+            handle = driver.current_window_handle
+            WebDriverManager.setup_target(driver)
+            tab_container = open_unreplied_list(drivermanager)
+            if tab_container is None:
+                # 列表載入失敗的分頁不納入分頁池
+                print("新分頁的對話列表載入失敗，關閉該分頁")
+                try:
+                    driver.close()
+                except Exception:
+                    pass
+                continue
+            self.tabs.append(ChatTab(handle, tab_container))
+        driver.switch_to.window(first_handle)
+        print(f"已開啟 {len(self.tabs)} 個聊天分頁")
+
+    @contextlib.contextmanager
+    def use(self, tab):
+        """取得瀏覽器控制權並切換到指定分頁"""
+        with self.driver_lock:
+            driver = self.drivermanager.driver
+            if driver.current_window_handle != tab.handle:
+                driver.switch_to.window(tab.handle)
+            yield tab
+
+    def alive(self):
+        try:
+            handles = set(self.drivermanager.driver.window_handles)
+        except Exception:
+            return False
+        return all(tab.handle in handles for tab in self.tabs)
+
+    def free_tabs(self):
+        return [tab for tab in self.tabs if tab.job is None]
+
+    def busy_tabs(self):
+        return [tab for tab in self.tabs if tab.job is not None]
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        driver = self.drivermanager.driver
+        try:
+            for tab in self.tabs[1:]:
+                driver.switch_to.window(tab.handle)
+                driver.close()
+            driver.switch_to.window(self.tabs[0].handle)
+        except Exception:
+            pass
+
+def get_tab_pool(drivermanager, container):
+    """
+    取得瀏覽器的分頁池，瀏覽器重啟或分頁被關閉時重新建立。
+
+    :param container: 第一個分頁（目前分頁）剛載入的對話列表容器
+    """
+    pool = drivermanager.tab_pool
+    if pool is None or not pool.alive():
+        if pool is not None:
+            pool.close()
+        # 分頁池跨輪重複使用，開啟分頁不計入本輪的時間預算
+        with deadline_exempt():
+            pool = drivermanager.tab_pool = TabPool(drivermanager, CHAT_TAB_COUNT, container)
+    else:
+        pool.tabs[0].container = container
+    return pool
+
+def find_conversation_cell(drivermanager, container, customer_name, max_scrolls=30):
+    """
+    在目前分頁的對話列表中找出客人欄位，列表為虛擬捲動，找不到時由上往下捲動尋找。
+
+    :return: 客人元素，找不到時回傳 None
+    """
+    driver = drivermanager.driver
+    driver.execute_script('arguments[0].scrollTop = 0;', container)
+    for _ in range(max_scrolls):
+        cell = driver.execute_script(_FIND_CELL_JS, customer_name)
+        if cell is not None:
+            return cell
+        at_bottom = driver.execute_script(
+            'const c = arguments[0]; const top = c.scrollTop; c.scrollTop = top + c.clientHeight;'
+            'return c.scrollTop === top;', container)
+        if at_bottom:
+            break
+        time.sleep(0.3)
+    return None
+
+@log_decorator
+def collect_pending_customers(drivermanager, container):
+    """
+    瀏覽整個未回覆列表，找出需要回覆的客人（上一輪延後的客人排在前面）。
+
+    :return: [(客戶名稱, 浮水印), ...]
+    """
+    pending = []
+    seen = set()
+    while True:
+        replies = drivermanager.wait_for_elements(container, By.CSS_SELECTOR, "[data-cy='webchat-conversation-cell-root']")
+        for reply in replies:
+            try:
+                customer_name = drivermanager.wait_for_element(reply, By.CSS_SELECTOR, "[data-cy='webchat-conversation-cell-name']").get_attribute('title')
+            except DeadlineExceeded:
+                raise
+            except Exception:
+                continue
+            if customer_name in seen:
+                continue
+            seen.add(customer_name)
+            preview_text = conversation_preview(reply)
+            if not answer_buyer_check(customer_name, preview_text):
+                print(f"客人: {customer_name} 沒有新訊息，略過")
+                continue
+            pending.append((customer_name, conversation_watermark(preview_text)))
+            if LLM_SPECULATIVE:
+                get_draft_speculator().start(customer_name, preview_text)
+        at_bottom = drivermanager.driver.execute_script(
+            'const c = arguments[0]; const top = c.scrollTop; c.scrollTop = top + c.clientHeight;'
+            'return c.scrollTop === top;', container)
+        if at_bottom:
+            break
+        time.sleep(0.5)
+    pending.sort(key=lambda item: item[0] not in DEFERRED_CUSTOMERS)
+    return pending
+
+def _start_pooled_job(drivermanager, pool, tab, job, journal, fallback_text):
+    """在分頁中開啟客人對話並擷取新訊息，LLM 呼叫交給背景執行緒"""
+    with pool.use(tab), deadline_scope(job.deadline.remaining(), job.deadline.name):
+        cell = find_conversation_cell(drivermanager, tab.container, job.customer_name)
+        if cell is None and tab is not pool.tabs[0]:
+            # 分頁的列表可能已過期，重新載入後再找一次
+            tab.container = open_unreplied_list(drivermanager)
+            if tab.container is not None:
+                cell = find_conversation_cell(drivermanager, tab.container, job.customer_name)
+        if cell is None:
+            print(f"分頁中找不到客人: {job.customer_name}，延後至下一輪")
+            return False
+        print(f"載入客人: {job.customer_name} 的對話視窗（分頁 {pool.tabs.index(tab) + 1}）")
+        cell.click()
+        job.textarea_element = drivermanager.wait_for_element(drivermanager.driver, By.CLASS_NAME, "E2MWg3w8y6")
+
+        job.pending = journal.pending_intent(job.customer_name, job.watermark)
+        if journal.has_partial(job.customer_name):
+            try:
+                clear_input(job.textarea_element)
+            except Exception:
+                pass
+        if job.pending:
+            print(f"回覆日誌：沿用先前產生的回覆內容 {job.customer_name}")
+            return True
+        chatgpt_content = harvest_conversation(drivermanager, job.customer_name)
+
+    def generate():
+        with deadline_scope(job.deadline.remaining(), job.deadline.name):
+            return generate_reply(job.customer_name, chatgpt_content, fallback_text=fallback_text)
+    job.future = pool.executor.submit(generate)
+    return True
+
+def _finish_pooled_job(drivermanager, pool, tab, job, journal):
+    """LLM 回覆完成後回到分頁輸入回覆"""
+    if job.pending:
+        reply_text = job.pending['text']
+    else:
+        reply_text = job.future.result()
+    with pool.use(tab), deadline_scope(job.deadline.remaining(), job.deadline.name):
+        return commit_reply(job.textarea_element, job.customer_name, job.watermark, reply_text, journal,
+                            pending=job.pending)
+
+@log_decorator
+def pooled_reply_task(drivermanager, container, reply_type, journal):
+    """
+    分頁池模式：先從列表取得需要回覆的客人，再分派到各分頁輪流處理。
+    每個分頁在瀏覽器步驟（開啟對話、擷取、輸入）之間等待 LLM，等待期間處理其他分頁。
+
+    :param container: 目前分頁的對話列表容器（只用來收集待回覆客人）
+    """
+    fallback_text = UI_STATUS_DATA['lunchbreak_text'] if reply_type == 1 else UI_STATUS_DATA['getoff_text']
+    cycle_deadline = current_deadline()
+    pool = get_tab_pool(drivermanager, container)
+    waiting = collections.deque(collect_pending_customers(drivermanager, container))
+    print(f"待回覆客人 {len(waiting)} 位")
+    replied = 0
+    start = time.monotonic()
+
+    def defer(customer_name, reason):
+        DEFERRED_CUSTOMERS.add(customer_name)
+        print(f"客人 {customer_name} {reason}，延後至下一輪")
+
+    try:
+        while waiting or pool.busy_tabs():
+            progressed = False
+            # 空閒分頁：開啟下一位客人並送出 LLM 請求
+            for tab in pool.free_tabs():
+                if not waiting:
+                    break
+                if cycle_deadline is not None and cycle_deadline.expired():
+                    raise DeadlineExceeded('本輪時間預算已用盡')
+                customer_name, watermark = waiting.popleft()
+                job = ChatJob(customer_name, watermark)
+                with tab.lock:
+                    try:
+                        if _start_pooled_job(drivermanager, pool, tab, job, journal, fallback_text):
+                            tab.job = job
+                        else:
+                            DEFERRED_CUSTOMERS.add(customer_name)
+                    except DeadlineExceeded:
+                        if cycle_deadline is not None and cycle_deadline.expired():
+                            DEFERRED_CUSTOMERS.add(customer_name)
+                            raise
+                        OVER_BUDGET_COUNTERS['conversation'] += 1
+                        defer(customer_name, f"超出時間預算（{CONVERSATION_BUDGET_SEC:.0f} 秒）")
+                    except Exception:
+                        logging.exception(f'開啟客人 {customer_name} 的對話失敗')
+                        print(f"開啟客人 {customer_name} 的對話失敗，繼續處理下一位")
+                progressed = True
+
+            # LLM 已回覆的分頁：切回分頁輸入回覆
+            for tab in pool.busy_tabs():
+                job = tab.job
+                if job.future is not None and not job.future.done():
+                    if job.deadline.expired():
+                        job.future.cancel()
+                        tab.job = None
+                        OVER_BUDGET_COUNTERS['conversation'] += 1
+                        defer(job.customer_name, f"超出時間預算（{CONVERSATION_BUDGET_SEC:.0f} 秒）")
+                    continue
+                with tab.lock:
+                    tab.job = None
+                    try:
+                        if _finish_pooled_job(drivermanager, pool, tab, job, journal):
+                            DEFERRED_CUSTOMERS.discard(job.customer_name)
+                            replied += 1
+                    except DeadlineExceeded:
+                        if cycle_deadline is not None and cycle_deadline.expired():
+                            DEFERRED_CUSTOMERS.add(job.customer_name)
+                            raise
+                        OVER_BUDGET_COUNTERS['conversation'] += 1
+                        defer(job.customer_name, f"超出時間預算（{CONVERSATION_BUDGET_SEC:.0f} 秒）")
+                    except Exception:
+                        logging.exception(f'回覆客人 {job.customer_name} 失敗')
+                        print(f"回覆客人 {job.customer_name} 失敗，繼續處理下一位")
+                progressed = True
+
+            if not progressed:
+                time.sleep(0.2)
+    except DeadlineExceeded:
+        for customer_name, _ in waiting:
+            DEFERRED_CUSTOMERS.add(customer_name)
+        for tab in pool.busy_tabs():
+            if tab.job.future is not None:
+                tab.job.future.cancel()
+            DEFERRED_CUSTOMERS.add(tab.job.customer_name)
+            tab.job = None
+        raise
+    finally:
+        # 下一輪由第一個分頁重新載入列表
+        try:
+            drivermanager.driver.switch_to.window(pool.tabs[0].handle)
+        except Exception:
+            pass
+        elapsed = time.monotonic() - start
+        if replied:
+            print(f"分頁池回覆 {replied} 位客人，耗時 {elapsed:.1f} 秒（{replied / max(elapsed, 1e-6) * 60:.1f} 位/分鐘）")
+
+@log_decorator
+def reply_task(drivermanager, reply_type):
+    try:
+        global UI_STATUS_DATA
+        container = open_unreplied_list(drivermanager)
+        if container is None:
+            return
+
+        # 標準回覆：使用快速模式，不擷取對話紀錄
+        if reply_type in (1, 2) and UI_STATUS_DATA['standard_reply_status']:
+            template_text = UI_STATUS_DATA['lunchbreak_text'] if reply_type == 1 else UI_STATUS_DATA['getoff_text']
+            template_reply_task(drivermanager, container, template_text)
+            return
+
+        # 多分頁模式：各分頁輪流擷取與輸入，LLM 呼叫同時進行
+        if reply_type in (1, 2) and CHAT_TAB_COUNT > 1:
+            pooled_reply_task(drivermanager, container, reply_type, get_reply_journal())
+            return
+
+        # 初始數據
+        whitelist = read_whitelist()
+        journal = get_reply_journal()
+        cycle_deadline = current_deadline()
+        if DEFERRED_CUSTOMERS:
+            print(f"上一輪延後的客人: {', '.join(sorted(DEFERRED_CUSTOMERS))}")
+        old_chat_list = []
+        new_chat_list = []
+        is_scrolled_to_bottom = False
+
+        # 開始載入對話
         while True:
             time.sleep(3)  # 等待頁面加載
             replies = drivermanager.wait_for_elements(container, By.CSS_SELECTOR, "[data-cy='webchat-conversation-cell-root']") # 找到所有客人元素
@@ -1484,38 +4644,29 @@ def reply_task(drivermanager, reply_type):
                             if len(old_chat_list) >= 50:
                                 old_chat_list.pop(0)
                         
-                            reply_need = answer_buyer_check(customer_name) #是否需要回覆
-                            print(f"載入客人: {customer_name} 的對話視窗")
-                            reply.click()
+                            preview_text = conversation_preview(reply)
+                            watermark = conversation_watermark(preview_text)
+                            reply_need = answer_buyer_check(customer_name, preview_text) #是否需要回覆
+                            if not reply_need:
+                                print(f"客人: {customer_name} 沒有新訊息，略過")
+                            elif LLM_SPECULATIVE and reply_type in (1, 2):
+                                # 先在背景產生回覆，點擊與擷取對話的同時 LLM 已在處理
+                                get_draft_speculator().start(customer_name, preview_text)
                             # 如果需要回覆
                             if reply_need:
-                                
-                                # 回覆客人
-                                def send_text_with_shift_enter(textarea_element, text):
-                                    parts = text.split('\n')
-                                    for i, part in enumerate(parts):
-                                        textarea_element.send_keys(part)
-                                        if i < len(parts) - 1:
-                                            textarea_element.send_keys(Keys.SHIFT, Keys.ENTER)
-                                            
+                                if cycle_deadline is not None and cycle_deadline.expired():
+                                    DEFERRED_CUSTOMERS.add(customer_name)
+                                    raise DeadlineExceeded('本輪時間預算已用盡')
                                 try:
-                                    textarea_element = drivermanager.wait_for_element(drivermanager.driver, By.CLASS_NAME, "E2MWg3w8y6")
-                                except:
-                                    continue
-
-                                if reply_type == 1:
-                                    if UI_STATUS_DATA['standard_reply_status']:
-                                        send_text_with_shift_enter(textarea_element, UI_STATUS_DATA['lunchbreak_text'])
-                                    else:
-                                        send_text_with_shift_enter(textarea_element, ChatGPT_reply_content(drivermanager))
-                                if reply_type ==2:
-                                    if UI_STATUS_DATA['standard_reply_status']:
-                                        send_text_with_shift_enter(textarea_element, UI_STATUS_DATA['getoff_text'])
-                                    else:
-                                        send_text_with_shift_enter(textarea_element, ChatGPT_reply_content(drivermanager))
-                                #drivermanager.wait_for_element(drivermanager.driver, By.CSS_SELECTOR, "i.GHUxSkxNuJ.yHRqJXUiCY > svg.chat-icon > path").click()
-                                print(f'已回覆客人: {customer_name}')
-                                update_whitelist(customer_name) # 更新回覆名單
+                                    with deadline_scope(CONVERSATION_BUDGET_SEC, f'客人 {customer_name}'):
+                                        if handle_conversation(drivermanager, reply, customer_name, watermark, reply_type, journal):
+                                            DEFERRED_CUSTOMERS.discard(customer_name)
+                                except DeadlineExceeded:
+                                    DEFERRED_CUSTOMERS.add(customer_name)
+                                    if cycle_deadline is not None and cycle_deadline.expired():
+                                        raise
+                                    OVER_BUDGET_COUNTERS['conversation'] += 1
+                                    print(f"客人 {customer_name} 超出時間預算（{CONVERSATION_BUDGET_SEC:.0f} 秒），延後至下一輪")
 
                 # 滾動處理（無論哪個過濾器都需要滾動）
                 # 對指定元素進行向下滾動
@@ -1533,12 +4684,162 @@ def reply_task(drivermanager, reply_type):
             if is_scrolled_to_bottom:
                 print("瀏覽完畢")
                 break
+    except DeadlineExceeded:
+        raise
     except Exception:
         logging.exception('回覆任務執行失敗')
         print(traceback.format_exc())
         raise
 
 
+# 啟動後分析前 N 輪的效能（0 為不分析）；也可由介面 Ctrl+Shift+P 或 SIGUSR1 開啟
+PROFILE_CYCLES = int(os.environ.get('PROFILE_CYCLES', '0'))
+# 以介面或訊號開啟時分析的輪數
+PROFILE_TRIGGER_CYCLES = int(os.environ.get('PROFILE_TRIGGER_CYCLES', '3'))
+
+class CycleProfiler():
+    """
+    每輪效能分析。開啟後接下來的 N 輪同時以 cProfile（執行本輪的執行緒）與取樣（每 5 ms 擷取所有執行緒的
+    呼叫堆疊，可看到背景產生回覆、分頁池等其他執行緒）記錄，結束時在 profiles/ 寫入：
+    - cycle_<時間>.pstats：可用 python -m pstats 或 snakeviz 開啟
+    - cycle_<時間>.collapsed：collapsed stack 格式，可用 flamegraph.pl 或 speedscope 產生火焰圖
+    - cycle_<時間>.txt：依累計時間排序的前 40 個函數
+    未開啟時每輪只多兩次屬性判斷。
+    """
+    def __init__(self, cycles=0, sample_interval=0.005):
+        self.remaining = cycles
+        self.sample_interval = sample_interval
+        self._requested = None
+        self._lock = threading.Lock()
+
+    def request(self, cycles=None):
+        """
+        接下來的 cycles 輪進行分析（可由任何執行緒或訊號處理函數呼叫）。
+        訊號處理函數在主執行緒（無介面模式下即執行本輪的執行緒）執行，可能打斷持有鎖或正在寫日誌的程式，
+        因此這裡只設定一個屬性，不取鎖也不輸出，由下一輪開始時套用。
+        """
+        self._requested = PROFILE_TRIGGER_CYCLES if cycles is None else cycles
+
+    def _apply_request(self):
+        with self._lock:
+            cycles, self._requested = self._requested, None
+            if cycles is None:
+                return
+            self.remaining = cycles
+        print(f"將分析接下來 {cycles} 輪的效能")
+
+    def _take(self):
+        with self._lock:
+            if self.remaining <= 0:
+                return False
+            self.remaining -= 1
+            return True
+
+    @contextlib.contextmanager
+    def profile(self, label='cycle'):
+        if self._requested is not None:
+            self._apply_request()
+        if not self.remaining or not self._take():
+            yield
+            return
+        import cProfile
+        stacks = collections.Counter()
+        stop = threading.Event()
+        sampler = Thread(target=self._sample, args=(stacks, stop), name='cycle-sampler', daemon=True)
+        profiler = cProfile.Profile()
+        sampler.start()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            stop.set()
+            sampler.join()
+            try:
+                self._write_reports(label, profiler, stacks)
+            except Exception:
+                logging.exception('寫入效能分析報告失敗')
+
+    def _sample(self, stacks, stop):
+        own_id = threading.get_ident()
+        names = {}
+        while not stop.wait(self.sample_interval):
+            for thread in threading.enumerate():
+                names[thread.ident] = thread.name
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                frames = []
+                while frame is not None:
+                    code = frame.f_code
+                    frames.append(f"{os.path.basename(code.co_filename)}:{code.co_name}".replace(';', ','))
+                    frame = frame.f_back
+                frames.append(names.get(thread_id, str(thread_id)).replace(';', ','))
+                stacks[';'.join(reversed(frames))] += 1
+
+    def _write_reports(self, label, profiler, stacks):
+        import io
+        import pstats
+        directory = os.path.join(FILE_PATH, 'profiles')
+        os.makedirs(directory, exist_ok=True)
+        base = os.path.join(directory, f"{label}_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}")
+        profiler.dump_stats(base + '.pstats')
+        with open(base + '.collapsed', 'w', encoding='utf-8') as f:
+            for stack, count in stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        buffer = io.StringIO()
+        pstats.Stats(profiler, stream=buffer).sort_stats('cumulative').print_stats(40)
+        with open(base + '.txt', 'w', encoding='utf-8') as f:
+            f.write(buffer.getvalue())
+        print(f"效能分析報告已寫入 {base}.pstats / .collapsed / .txt（取樣 {sum(stacks.values())} 筆）")
+
+CYCLE_PROFILER = None
+
+def get_cycle_profiler():
+    global CYCLE_PROFILER
+    if CYCLE_PROFILER is None:
+        CYCLE_PROFILER = CycleProfiler(PROFILE_CYCLES)
+    return CYCLE_PROFILER
+
+def install_profile_signal():
+    """SIGUSR1 開啟接下來幾輪的效能分析（僅支援的平台；必須在主執行緒呼叫）"""
+    if hasattr(signal, 'SIGUSR1'):
+        profiler = get_cycle_profiler()  # 先建立，處理函數內只設定屬性
+        signal.signal(signal.SIGUSR1, lambda signum, frame: profiler.request())
+
+def run_reply_cycle(drivermanager, reply_type):
+    """
+    在本輪時間預算內執行 reply_task，預算用盡時結束本輪，未處理的客人留待下一輪。
+
+    :param drivermanager: 瀏覽器對象
+    :param reply_type: 回覆類型
+    """
+    start = time.monotonic()
+    ENGINE_STATUS['last_cycle_started'] = time.time()
+    ENGINE_STATUS['last_reply_type'] = reply_type
+    drivermanager.begin_cycle_trace()
+    try:
+        with get_cycle_profiler().profile(f'cycle_type{reply_type}'), deadline_scope(CYCLE_BUDGET_SEC, '本輪'):
+            reply_task(drivermanager, reply_type)
+    except DeadlineExceeded:
+        OVER_BUDGET_COUNTERS['cycle'] += 1
+        print(f"本輪超出時間預算（{CYCLE_BUDGET_SEC:.0f} 秒），剩餘客人延後至下一輪")
+    finally:
+        if DRAFT_SPECULATOR is not None:
+            DRAFT_SPECULATOR.discard_all()
+            DRAFT_SPECULATOR.print_report()
+        elapsed = time.monotonic() - start
+        ENGINE_STATUS['cycles'] += 1
+        ENGINE_STATUS['last_cycle_seconds'] = elapsed
+        print(f"本輪耗時 {elapsed:.1f} 秒")
+        drivermanager.end_cycle_trace(elapsed, f'cycle_type{reply_type}')
+
+def current_clock(now):
+    """回傳可與設定時段比較的目前時間：介面模式為 QTime，無介面模式為 datetime.time"""
+    if HEADLESS:
+        return datetime.time(now.hour, now.minute, now.second)
+    return QTime(now.hour, now.minute, now.second)
+
 @log_decorator
 def Customer_Serivce(drivermanager, ui_status_signals):
     ui_status_signals.request_status.emit()
@@ -1549,7 +4850,7 @@ def Customer_Serivce(drivermanager, ui_status_signals):
     
     if LOGIN_STATE == 1:
         now = datetime.datetime.now()
-        current_time = QTime(now.hour, now.minute, now.second)
+        current_time = current_clock(now)
         weekday = now.weekday()  # 0 是星期一, 6 是星期日
     
         # 自訂休息日列表，格式為 '年/月/日'
@@ -1569,36 +4870,52 @@ def Customer_Serivce(drivermanager, ui_status_signals):
             if lunchbreak_start <= current_time < lunchbreak_end:
                 # 午休時間
                 print("午休時間，智能客服接入處理")
-                reply_task(drivermanager, 1)
+                run_reply_cycle(drivermanager, 1)
                 
             elif current_time < lunchbreak_start or (current_time >= lunchbreak_end and current_time < getoff_start):
                 # 工作時間
                 print("人工客服接入處理")
-                reply_task(drivermanager, 0)
+                run_reply_cycle(drivermanager, 0)
             else:
                 # 非工作時間或下班後
                 print("非工作時間/下班後，智能客服接入處理")
-                reply_task(drivermanager, 2)
+                run_reply_cycle(drivermanager, 2)
         else:
             # 週末或自訂休息日
             print("周末或自訂休息日，智能客服接入處理")
-            reply_task(drivermanager, 2)
+            run_reply_cycle(drivermanager, 2)
+        
+        print_llm_latency_report()
+        get_llm_governor().print_report()
+        if OVER_BUDGET_COUNTERS:
+            print(f"超出時間預算：整輪 {OVER_BUDGET_COUNTERS['cycle']} 次，單一客人 {OVER_BUDGET_COUNTERS['conversation']} 次")
+        if MEMORY_WATCHDOG:
+            get_memory_watchdog().check(drivermanager)
+        drivermanager.refresh_standby()
         
     UI_STATUS_DATA = None
 
 # 主執行緒類
 class MainThread(Thread):
-    def __init__(self, drivermanager, login_status, ui_status_signals):
+    def __init__(self, drivermanager, login_status, ui_status_signals, session_probe=None):
         super().__init__()
         self.drivermanager = drivermanager
         self.login_status = login_status
         self.ui_status_signals = ui_status_signals
+        self.session_probe = session_probe
         
     def run(self):
         # 主程式入口
         try:
             global ACCOUNT_NUMBER, ACCOUNT_PASSWORD
-            autologin(self.drivermanager, self.login_status, ACCOUNT_NUMBER, ACCOUNT_PASSWORD) #開始登入
+            ensure_heavy_imports()
+            # 啟動時先重播回覆日誌，續做上次中斷的回覆
+            try:
+                get_reply_journal()
+            except Exception:
+                logging.exception('回覆日誌載入失敗')
+            autologin(self.drivermanager, self.login_status, ACCOUNT_NUMBER, ACCOUNT_PASSWORD,
+                      session_probe=self.session_probe) #開始登入
             Customer_Serivce(self.drivermanager, self.ui_status_signals) #開始服務
             scheduler = BlockingScheduler()
             scheduler.add_job(Customer_Serivce, 'interval', minutes=1,args=[self.drivermanager, self.ui_status_signals])
@@ -1652,17 +4969,195 @@ class EmittingStream(QObject):
         except:
             pass
 
+# 預設將登入與客服流程放在子程序（python main.py worker）執行，介面程序只負責顯示；
+# 設為 0 時沿用同一程序的 MainThread
+ENGINE_PROCESS = os.environ.get('ENGINE_PROCESS', '1') == '1'
+
+def engine_command(subcommand):
+    """啟動本程式子指令的命令列（封裝後直接執行同一個 exe）"""
+    if getattr(sys, 'frozen', False):
+        return [sys.executable, subcommand]
+    return [sys.executable, os.path.abspath(__file__), subcommand]
+
+def engine_popen_kwargs():
+    """
+    啟動引擎子程序的共用參數：Windows 不開主控台視窗；其他平台另開 session，
+    子程序與它衍生的 chromedriver、Chrome 同屬一個程序群組，可由 kill_process_tree 一起結束。
+    """
+    if sys.platform == 'win32':
+        return {'creationflags': getattr(subprocess, 'CREATE_NO_WINDOW', 0)}
+    return {'start_new_session': True}
+
+def kill_process_tree(process, timeout=10):
+    """強制結束以 engine_popen_kwargs 啟動的子程序及其衍生程序，避免留下孤立的 chromedriver / Chrome"""
+    try:
+        if sys.platform == 'win32':
+            subprocess.run(['taskkill', '/PID', str(process.pid), '/T', '/F'],
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                           creationflags=getattr(subprocess, 'CREATE_NO_WINDOW', 0))
+        else:
+            os.killpg(process.pid, signal.SIGKILL)
+    except OSError:
+        logging.exception('結束程序樹失敗')
+    try:
+        process.wait(timeout)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+class EngineProcess(QObject):
+    """
+    介面端的引擎子程序：啟動 worker、在背景執行緒讀取訊息並轉為 Qt 信號（在主執行緒處理），
+    送出設定與停止指令。子程序結束（包含崩潰）時發出 exited，可直接重新啟動。
+    """
+    log_received = pyqtSignal(str)
+    login_status_received = pyqtSignal(str, int)
+    status_requested = pyqtSignal()
+    exited = pyqtSignal(int, int)  # PID、結束代碼
+
+    def __init__(self):
+        super().__init__()
+        self.process = None
+        self.channel = None
+
+    @property
+    def running(self):
+        return self.process is not None and self.process.poll() is None
+
+    def start(self, account, password):
+        self.stop()
+        # 子程序的原生錯誤輸出（例如直譯器崩潰）寫入 engine_stderr.log 以便排查
+        stderr_log = open(os.path.join(FILE_PATH, 'engine_stderr.log'), 'ab')
+        self.process = subprocess.Popen(engine_command('worker'), stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                        stderr=stderr_log, **engine_popen_kwargs())
+        stderr_log.close()
+        self.channel = EngineChannel(self.process.stdout, self.process.stdin)
+        self.channel.send('start', {'account': account, 'password': password})
+        Thread(target=self._read_loop, args=(self.process, self.channel), name='engine-reader', daemon=True).start()
+        print(f"引擎程序已啟動（PID {self.process.pid}）")
+
+    def _read_loop(self, process, channel):
+        while True:
+            try:
+                kind, data = channel.recv()
+            except (EOFError, OSError, ValueError):
+                break
+            if kind == 'log':
+                self.log_received.emit(data)
+            elif kind == 'login_status':
+                self.login_status_received.emit(data['status'], data['login_state'])
+            elif kind == 'request_status':
+                self.status_requested.emit()
+        self.exited.emit(process.pid, process.wait())
+
+    def send(self, kind, data=None):
+        if not self.running:
+            return
+        try:
+            self.channel.send(kind, data)
+        except OSError:
+            logging.exception('無法送出訊息到引擎程序')
+
+    def stop(self, timeout=15):
+        """要求子程序關閉瀏覽器並結束，逾時則連同瀏覽器整棵強制終止"""
+        if not self.running:
+            return
+        process = self.process
+        self.send('stop')
+        try:
+            process.wait(timeout)
+        except subprocess.TimeoutExpired:
+            kill_process_tree(process)
+
 #主視窗
+# 程式資源所在目錄（封裝後為 PyInstaller 解壓目錄），不依賴目前工作目錄
+RESOURCE_DIR = getattr(sys, '_MEIPASS', os.path.dirname(os.path.abspath(__file__)))
+UI_FILE = os.path.join(RESOURCE_DIR, 'Shopee_Customer_Service.ui')
+# python main.py compile-ui 產生的介面模組
+UI_MODULE_FILE = os.path.join(RESOURCE_DIR, 'Shopee_Customer_Service_ui.py')
+_UI_HASH_PREFIX = '# ui-sha1: '
+
+def _ui_file_hash():
+    with open(UI_FILE, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+def compile_ui():
+    """將 .ui 編譯為 Python 模組，第一行記錄 .ui 的雜湊以判斷是否過期"""
+    from PyQt5 import uic
+    import io
+    buffer = io.StringIO()
+    uic.compileUi(UI_FILE, buffer)
+    with open(UI_MODULE_FILE, 'w', encoding='utf-8') as f:
+        f.write(f"{_UI_HASH_PREFIX}{_ui_file_hash()}\n")
+        f.write(buffer.getvalue())
+    print(f"已產生介面模組: {UI_MODULE_FILE}")
+
+def load_compiled_ui():
+    """
+    載入預先編譯的介面類別。
+
+    :return: Ui_MainWindow 類別；模組不存在、比 .ui 舊或載入失敗時回傳 None（改用 loadUi）
+    """
+    if not os.path.exists(UI_MODULE_FILE):
+        return None
+    try:
+        if os.path.exists(UI_FILE):
+            with open(UI_MODULE_FILE, 'r', encoding='utf-8') as f:
+                first_line = f.readline().strip()
+            if first_line != _UI_HASH_PREFIX + _ui_file_hash():
+                print("介面模組已過期，改用 .ui 檔（請重新執行 python main.py compile-ui）")
+                return None
+        import importlib.util
+        spec = importlib.util.spec_from_file_location('Shopee_Customer_Service_ui', UI_MODULE_FILE)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        return module.Ui_MainWindow
+    except Exception:
+        logging.exception('載入介面模組失敗，改用 .ui 檔')
+        return None
+
+def setup_main_window_ui(window):
+    """
+    建立主視窗的元件，有可用的預先編譯模組時使用它，否則以 uic.loadUi 解析 .ui。
+
+    :return: 使用的方式（'compiled' 或 'loadUi'）
+    """
+    ui_class = load_compiled_ui()
+    if ui_class is not None:
+        ui = ui_class()
+        ui.setupUi(window)
+        # 與 loadUi 相同，讓元件可直接以 window.<名稱> 存取
+        for name, value in vars(ui).items():
+            setattr(window, name, value)
+        return 'compiled'
+    from PyQt5 import uic
+    uic.loadUi(UI_FILE, window)
+    return 'loadUi'
+
 class MyMainWindow(QMainWindow):
     def __init__(self):
         super(MyMainWindow, self).__init__()
-        uic.loadUi('Shopee_Customer_Service.ui', self)
+        start = time.perf_counter()
+        self.ui_source = setup_main_window_ui(self)
+        self.ui_build_seconds = time.perf_counter() - start
+        logging.info(f'介面建立耗時 {self.ui_build_seconds * 1000:.0f} ms（{self.ui_source}）')
         # 將按鈕的點擊事件連接到自定義的槽函數
         self.Shoppe_Login_Button.clicked.connect(self.Shoppe_Login_Button_on_click)
 
         self.ui_status_signals = UISignals() #初始一個訊號實例
         self.ui_status_signals.request_status.connect(self.get_status) #連接訊號觸發函數
 
+        self.engine = EngineProcess()
+        self.engine.log_received.connect(self.append_text)
+        self.engine.login_status_received.connect(self.engine_login_status)
+        self.engine.status_requested.connect(self.send_engine_settings)
+        self.engine.exited.connect(self.engine_exited)
+
+        # Ctrl+Shift+P：分析接下來幾輪的效能（報告寫入使用者資料目錄的 profiles/）
+        from PyQt5.QtWidgets import QShortcut
+        from PyQt5.QtGui import QKeySequence
+        self.profile_shortcut = QShortcut(QKeySequence('Ctrl+Shift+P'), self)
+        self.profile_shortcut.activated.connect(self.request_profile)
+
         # 預設輸出到 GUI；若需要顯示在 CMD，請將環境變數 STD_TO_GUI 設為 0
         redirect_to_gui = os.environ.get("STD_TO_GUI", "1") == "1"
         if redirect_to_gui:
@@ -1675,15 +5170,22 @@ class MyMainWindow(QMainWindow):
         self.read_settings()  #恢復 UI 狀態
 
     def Shoppe_Login_Button_on_click(self):
-        self.drivermanager = WebDriverManager() #實例一個瀏覽器
         global LOGIN_STATE
+        if ENGINE_PROCESS:
+            LOGIN_STATE = 0
+            self.login_status("登入中")
+            # 引擎在子程序登入並執行客服流程（已在執行時會先停止再重新啟動）
+            self.engine.start(self.Shoppe_account_Input.text(), self.Shoppe_Password_Input.text())
+            return
+        session_probe = start_session_probe() # 啟動瀏覽器的同時以 HTTP 檢查 Cookie 是否有效
+        self.drivermanager = WebDriverManager() #實例一個瀏覽器
         LOGIN_STATE = 0
         self.login_status("登入中") # 更新標籤的文本為'登入中'
         # 從控件獲取帳號和密碼
         global ACCOUNT_NUMBER,ACCOUNT_PASSWORD
         ACCOUNT_NUMBER = self.Shoppe_account_Input.text()
         ACCOUNT_PASSWORD = self.Shoppe_Password_Input.text()
-        mainthread = MainThread(self.drivermanager, self.login_status, self.ui_status_signals) # 創建執行緒對象，並傳遞帳號、密碼和更新狀態的函數
+        mainthread = MainThread(self.drivermanager, self.login_status, self.ui_status_signals, session_probe) # 創建執行緒對象，並傳遞帳號、密碼和更新狀態的函數
         mainthread.start() # 啟動執行緒
         
 
@@ -1695,6 +5197,34 @@ class MyMainWindow(QMainWindow):
         else:
             self.ReplySetting_Frame.setEnabled(False)
             
+    def request_profile(self):
+        if ENGINE_PROCESS and self.engine.running:
+            self.engine.send('profile', PROFILE_TRIGGER_CYCLES)
+            print(f"已要求引擎程序分析接下來 {PROFILE_TRIGGER_CYCLES} 輪的效能")
+        else:
+            get_cycle_profiler().request()
+            print(f"已要求分析接下來 {PROFILE_TRIGGER_CYCLES} 輪的效能")
+
+    def engine_login_status(self, status, login_state):
+        # 引擎程序回報的登入狀態
+        global LOGIN_STATE
+        LOGIN_STATE = login_state
+        self.login_status(status)
+
+    def send_engine_settings(self):
+        # 引擎程序每輪開始時索取目前設定
+        self.get_status()
+        self.engine.send('settings', settings_to_json(UI_STATUS_DATA))
+
+    def engine_exited(self, pid, returncode):
+        global LOGIN_STATE
+        if self.engine.process is None or self.engine.process.pid != pid:
+            return  # 重新啟動前的舊程序
+        LOGIN_STATE = 0
+        if returncode != 0:
+            print(f"引擎程序異常結束（代碼 {returncode}），詳情見 engine_stderr.log；按登入可重新啟動")
+        self.login_status("引擎已停止")
+
     def get_status(self):
         # 在這裡讀取 UI 元件的狀態
         global UI_STATUS_DATA
@@ -1742,6 +5272,11 @@ class MyMainWindow(QMainWindow):
         
         settings.setValue("UI_STATUS_DATA", json.dumps(ui_status_data))
         settings.endGroup()
+        # 同步輸出 settings.json 供無介面模式（python main.py serve）使用，不含密碼
+        try:
+            export_settings_file(UI_STATUS_DATA)
+        except Exception:
+            logging.exception('輸出 settings.json 失敗')
 
 
     def read_settings(self):
@@ -1801,8 +5336,707 @@ class MyMainWindow(QMainWindow):
         sys.stderr = sys.__stderr__
         self.get_status()
         self.write_settings()  #保存 UI 狀態
+        self.engine.stop()
         event.accept()
         
+# 無介面模式的設定檔（由介面自動輸出，也可手動編輯），時間欄位為 "HH:mm"
+SETTINGS_FILE_NAME = 'settings.json'
+_SETTINGS_TIME_KEYS = ('lunchbreak_starttime', 'lunchbreak_endtime', 'getoff_starttime', 'getoff_endtime')
+
+def settings_to_json(ui_status_data):
+    """將介面狀態轉為可序列化的字典（時間轉為 "HH:mm"，不含密碼）"""
+    data = {k: v for k, v in ui_status_data.items() if k != 'shoppe_password'}
+    for key in _SETTINGS_TIME_KEYS:
+        if key in data and not isinstance(data[key], str):
+            data[key] = data[key].toString('HH:mm')
+    return data
+
+def settings_from_json(data):
+    """settings_to_json 的反向轉換，時間欄位轉為 datetime.time 以便與 current_clock() 比較"""
+    data = dict(data)
+    for key in _SETTINGS_TIME_KEYS:
+        hour, minute = (int(part) for part in data.get(key, '00:00').split(':')[:2])
+        data[key] = datetime.time(hour, minute)
+    data.setdefault('workday_checkboxes', [True] * 5 + [False] * 2)
+    return data
+
+def export_settings_file(ui_status_data, path=None):
+    """將介面狀態寫成 settings.json（時間轉為 "HH:mm"，不寫入密碼）"""
+    path = path or os.path.join(FILE_PATH, SETTINGS_FILE_NAME)
+    data = settings_to_json(ui_status_data)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+def load_settings_file(path=None):
+    """
+    讀取 settings.json，時間欄位轉為 datetime.time 以便與 current_clock() 比較。
+
+    :return: 與介面 get_status() 相同鍵值的字典
+    """
+    path = path or os.path.join(FILE_PATH, SETTINGS_FILE_NAME)
+    with open(path, 'r', encoding='utf-8') as f:
+        data = settings_from_json(json.load(f))
+    # 密碼只從環境變數或設定檔取得
+    data['shoppe_password'] = os.environ.get('SHOPEE_PASSWORD', data.get('shoppe_password', ''))
+    return data
+
+class _FileSettingsRequest():
+    def __init__(self, path):
+        self.path = path
+        self.last = None
+
+    def emit(self):
+        # 每輪重新讀取，修改 settings.json 後不必重啟服務；讀取失敗時沿用上一次的設定
+        global UI_STATUS_DATA
+        try:
+            self.last = load_settings_file(self.path)
+        except Exception:
+            logging.exception('讀取 settings.json 失敗')
+        if self.last is not None:
+            UI_STATUS_DATA = self.last
+
+class FileSettingsSignals():
+    """無介面模式下取代 UISignals：request_status.emit() 改為從 settings.json 載入設定"""
+    def __init__(self, path=None):
+        self.request_status = _FileSettingsRequest(path)
+
+class EngineChannel():
+    """
+    介面與引擎子程序之間的訊息通道：子程序的 stdin/stdout 管線，每行一筆 JSON {"type", "data"}。
+    send 可由多個執行緒呼叫；對方結束時 recv 會拋出 EOFError。
+    """
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self._lock = threading.Lock()
+
+    def send(self, kind, data=None):
+        line = json.dumps({'type': kind, 'data': data}, default=str) + '\n'
+        with self._lock:
+            self.writer.write(line.encode('ascii'))
+            self.writer.flush()
+
+    def recv(self):
+        line = self.reader.readline()
+        if not line:
+            raise EOFError
+        message = json.loads(line)
+        return message['type'], message.get('data')
+
+class ChannelLogStream():
+    """
+    引擎子程序的 sys.stdout / sys.stderr：累積 print 的輸出，每 0.1 秒批次送到介面，
+    避免大量輸出逐筆觸發介面重繪。
+    """
+    def __init__(self, channel, interval=0.1):
+        self.channel = channel
+        self.interval = interval
+        self._buffer = []
+        self._lock = threading.Lock()
+        Thread(target=self._flush_loop, name='log-forwarder', daemon=True).start()
+
+    def write(self, text):
+        with self._lock:
+            self._buffer.append(text)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        with self._lock:
+            if not self._buffer:
+                return
+            text = ''.join(self._buffer)
+            self._buffer.clear()
+        try:
+            self.channel.send('log', text)
+        except (OSError, ValueError):
+            pass  # 介面已關閉
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.interval)
+            self.drain()
+
+class _ChannelSettingsRequest():
+    def __init__(self, channel):
+        self.channel = channel
+
+    def emit(self):
+        # 介面收到後回傳 settings 訊息，由 engine_command_loop 寫入 UI_STATUS_DATA
+        self.channel.send('request_status')
+
+class ChannelSettingsSignals():
+    """引擎子程序中取代 UISignals：request_status.emit() 改為向介面索取目前設定"""
+    def __init__(self, channel):
+        self.request_status = _ChannelSettingsRequest(channel)
+
+class JsonLogFormatter(logging.Formatter):
+    """每筆紀錄輸出為一行 JSON，方便以 jq 或日誌收集器處理"""
+    def format(self, record):
+        entry = {
+            'ts': datetime.datetime.fromtimestamp(record.created).strftime('%Y-%m-%d %H:%M:%S'),
+            'level': record.levelname,
+            'thread': record.threadName,
+            'message': record.getMessage(),
+        }
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+class LogStream():
+    """取代無介面模式的 sys.stdout / sys.stderr，將 print 的輸出逐行寫入日誌"""
+    def __init__(self, level):
+        self.level = level
+        self._buffer = ''
+        self._lock = threading.Lock()
+
+    def write(self, text):
+        # 多個執行緒同時 print，緩衝區需加鎖；寫入日誌在鎖外進行
+        with self._lock:
+            self._buffer += text
+            lines = []
+            while '\n' in self._buffer:
+                line, self._buffer = self._buffer.split('\n', 1)
+                lines.append(line)
+        for line in lines:
+            if line.strip():
+                logging.log(self.level, line)
+
+    def flush(self):
+        pass
+
+def setup_serve_logging(path, echo=True):
+    """
+    設定無介面模式的日誌：JSON lines 寫入 serve.log（10 MB 輪替保留 5 份），
+    echo 為真時同時輸出到終端機，print 的內容一併導入日誌。
+    """
+    import logging.handlers
+    root = logging.getLogger()
+    file_handler = logging.handlers.RotatingFileHandler(path, maxBytes=10 * 1024 * 1024, backupCount=5, encoding='utf-8')
+    file_handler.setFormatter(JsonLogFormatter())
+    root.addHandler(file_handler)
+    if echo:
+        console_handler = logging.StreamHandler(sys.__stdout__)
+        console_handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(message)s'))
+        root.addHandler(console_handler)
+    root.setLevel(logging.INFO)
+    sys.stdout = LogStream(logging.INFO)
+    sys.stderr = LogStream(logging.ERROR)
+
+# 無介面模式的本機狀態端點（只綁定 127.0.0.1）
+SERVE_STATUS_PORT = int(os.environ.get('SERVE_STATUS_PORT', '8765'))
+
+def engine_status_snapshot():
+    """彙整目前引擎狀態，供 GET /status 回傳"""
+    snapshot = dict(ENGINE_STATUS)
+    snapshot['pid'] = os.getpid()
+    snapshot['uptime_seconds'] = time.perf_counter() - _PROCESS_START
+    snapshot['login_state'] = LOGIN_STATE
+    snapshot['deferred_customers'] = sorted(DEFERRED_CUSTOMERS)
+    snapshot['over_budget'] = dict(OVER_BUDGET_COUNTERS)
+    snapshot['llm'] = get_llm_governor().snapshot()
+    if DRAFT_SPECULATOR is not None:
+        snapshot['speculative'] = dict(DRAFT_SPECULATOR.counters)
+    if MEMORY_WATCHDOG_INSTANCE is not None and MEMORY_WATCHDOG_INSTANCE.samples:
+        snapshot['browser_memory'] = dict(MEMORY_WATCHDOG_INSTANCE.samples[-1])
+    return snapshot
+
+def start_status_server(port=None, snapshot=None):
+    """
+    在背景執行緒啟動 HTTP 狀態端點，GET /status 回傳 JSON。
+
+    :param snapshot: 產生回傳內容的函數，預設為 engine_status_snapshot
+
+    :return: ThreadingHTTPServer；連接埠被占用時回傳 None（不影響客服流程）
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    snapshot = snapshot or engine_status_snapshot
+
+    class StatusHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.rstrip('/') != '/status':
+                self.send_error(404)
+                return
+            body = json.dumps(snapshot(), ensure_ascii=False, default=str).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass  # 不將每次查詢寫入日誌
+
+    port = SERVE_STATUS_PORT if port is None else port
+    try:
+        server = ThreadingHTTPServer(('127.0.0.1', port), StatusHandler)
+    except OSError:
+        logging.exception(f'狀態端點無法綁定連接埠 {port}')
+        return None
+    Thread(target=server.serve_forever, name='status-server', daemon=True).start()
+    print(f"狀態端點: http://127.0.0.1:{server.server_address[1]}/status")
+    return server
+
+# 多店鋪協調器（python main.py coordinate）的資源預算
+# 同時執行的店鋪數上限，0 為 CPU 核心數的一半（每家店各有一個 Chrome 與一個 Python 程序）
+COORDINATOR_MAX_WORKERS = int(os.environ.get('COORDINATOR_MAX_WORKERS', '0'))
+# 所有店鋪合計的記憶體預算（MB），0 為實體記憶體的 70%（需安裝 psutil，否則不限制）
+COORDINATOR_MEMORY_MB = int(os.environ.get('COORDINATOR_MEMORY_MB', '0'))
+# 預估每家店（瀏覽器 + 程序）使用的記憶體（MB），用於計算可同時執行的店鋪數
+WORKER_MEMORY_MB = int(os.environ.get('WORKER_MEMORY_MB', '1500'))
+# 依序啟動各店鋪的間隔（秒），避免多個 Chrome 同時啟動搶占 CPU
+COORDINATOR_STAGGER_SEC = float(os.environ.get('COORDINATOR_STAGGER_SEC', '20'))
+
+def load_shop_configs(path):
+    """
+    讀取多店鋪設定檔 shops.json：
+    [{"name": "店名", "account": "帳號", "password_env": "存放密碼的環境變數"}, ...]
+    （也可直接寫 "password"，但不建議）
+
+    :return: 設定字典的列表
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        shops = json.load(f)
+    names = set()
+    for shop in shops:
+        if not shop.get('name') or not shop.get('account'):
+            raise ValueError(f"店鋪設定缺少 name 或 account: {shop}")
+        if shop['name'] in names:
+            raise ValueError(f"店鋪名稱重複: {shop['name']}")
+        names.add(shop['name'])
+        if shop.get('password_env'):
+            shop['password'] = os.environ.get(shop['password_env'], '')
+    return shops
+
+def coordinator_capacity(shop_count):
+    """依 CPU 與記憶體預算計算可同時執行的店鋪數，以及每家店的記憶體額度（MB）"""
+    max_workers = COORDINATOR_MAX_WORKERS or max(1, (os.cpu_count() or 2) // 2)
+    memory_budget = COORDINATOR_MEMORY_MB
+    if not memory_budget:
+        try:
+            import psutil
+            memory_budget = int(psutil.virtual_memory().total / 1024 / 1024 * 0.7)
+        except ImportError:
+            memory_budget = 0
+    if memory_budget:
+        max_workers = min(max_workers, max(1, memory_budget // WORKER_MEMORY_MB))
+    capacity = min(shop_count, max_workers)
+    share_mb = memory_budget // capacity if memory_budget and capacity else None
+    return capacity, share_mb
+
+class ShopWorker():
+    """協調器中的一家店：以獨立資料目錄（設定檔、Cookie、Chrome 個人資料夾、回覆紀錄）執行 python main.py serve"""
+    def __init__(self, config, data_dir, port, memory_mb=None):
+        self.name = config['name']
+        self.account = config['account']
+        self.password = config.get('password', '')
+        self.data_dir = data_dir
+        self.port = port
+        self.memory_mb = memory_mb
+        self.process = None
+        self.started_at = None
+        self.restarts = 0
+        self.quick_exits = 0
+        self.next_start = 0.0
+        self.replies_before = 0  # 之前各次執行（重啟前）的回覆數
+        self.last_status = None
+
+    @property
+    def alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def start(self):
+        os.makedirs(self.data_dir, exist_ok=True)
+        # 尚未設定的店鋪沿用主資料目錄的回覆設定
+        settings_path = os.path.join(self.data_dir, SETTINGS_FILE_NAME)
+        default_settings = os.path.join(FILE_PATH, SETTINGS_FILE_NAME)
+        if not os.path.exists(settings_path) and os.path.exists(default_settings):
+            import shutil
+            shutil.copyfile(default_settings, settings_path)
+        # SERVE_STDIN_CONTROL：由 stdin 接收停止指令（Windows 的 terminate 不會觸發 SIGTERM）
+        env = dict(os.environ, SHOPEE_FILE_PATH=self.data_dir, SHOPEE_ACCOUNT=self.account,
+                   SHOPEE_PASSWORD=self.password, SERVE_STATUS_PORT=str(self.port), SERVE_STDIN_CONTROL='1')
+        env.pop('REAL_CHROME_PROFILE', None)  # 每家店必須使用自己的個人資料夾
+        if self.memory_mb:
+            # 由每家店的記憶體監控在超過額度時回收瀏覽器
+            env['BROWSER_RSS_LIMIT_MB'] = str(min(BROWSER_RSS_LIMIT_MB, self.memory_mb))
+        # serve 的日誌已寫入各店的 serve.log，這裡只保留原生錯誤輸出
+        with open(os.path.join(self.data_dir, 'engine_stderr.log'), 'ab') as stderr_log:
+            self.process = subprocess.Popen(engine_command('serve'), env=env, stdin=subprocess.PIPE,
+                                            stdout=subprocess.DEVNULL, stderr=stderr_log,
+                                            **engine_popen_kwargs())
+        self.started_at = time.time()
+        # 上一次執行的最後狀態：正常停止時在停止前剛查詢過；崩潰時只能取最近一次輪詢（最多落後一個輪詢間隔）
+        if self.last_status:
+            self.replies_before += self.last_status.get('replies', 0)
+        self.last_status = None
+        print(f"[{self.name}] 已啟動（PID {self.process.pid}，狀態埠 {self.port}）")
+
+    def poll_status(self):
+        """向該店的 serve 狀態端點查詢，失敗時保留上一次的結果"""
+        try:
+            with urllib.request.urlopen(f'http://127.0.0.1:{self.port}/status', timeout=2) as response:
+                self.last_status = json.loads(response.read().decode('utf-8'))
+        except (OSError, ValueError):
+            pass
+        return self.last_status
+
+    def stop(self, timeout=20):
+        """
+        先查詢最新狀態保留最終回覆數，再經 stdin 送出停止指令讓 serve 關閉瀏覽器後結束；
+        逾時仍未結束時連同子程序（chromedriver、Chrome）整棵強制結束。
+        """
+        if not self.alive:
+            return
+        self.poll_status()
+        try:
+            self.process.stdin.write(b'stop\n')
+            self.process.stdin.close()
+        except OSError:
+            pass
+        try:
+            self.process.wait(timeout)
+        except subprocess.TimeoutExpired:
+            kill_process_tree(self.process)
+
+class ShopCoordinator():
+    """
+    多店鋪協調器：在 CPU 與記憶體預算內為每家店啟動一個獨立的 serve 程序，
+    定期查詢各店狀態並彙整總回覆量，程序結束時以指數退避重新啟動。
+    """
+    def __init__(self, shops, base_port=None):
+        self.capacity, share_mb = coordinator_capacity(len(shops))
+        base_port = (SERVE_STATUS_PORT if base_port is None else base_port) + 1
+        self.workers = [
+            ShopWorker(shop, os.path.join(FILE_PATH, 'shops', re.sub(r'[^\w-]', '_', shop['name'])), base_port + i, share_mb)
+            for i, shop in enumerate(shops[:self.capacity])
+        ]
+        self.skipped = [shop['name'] for shop in shops[self.capacity:]]
+        self.started_at = time.time()
+
+    def snapshot(self):
+        """各店與合計的狀態（累計回覆數、目前程序的每小時回覆數、輪數、登入狀態、重啟次數）"""
+        shops = []
+        for worker in self.workers:
+            status = worker.last_status or {}
+            uptime_hours = (status.get('uptime_seconds') or 0) / 3600
+            shops.append({
+                'name': worker.name,
+                'pid': worker.process.pid if worker.alive else None,
+                'alive': worker.alive,
+                'restarts': worker.restarts,
+                'login_state': status.get('login_state'),
+                'cycles': status.get('cycles', 0),
+                'replies': worker.replies_before + status.get('replies', 0),
+                'replies_per_hour': status.get('replies', 0) / uptime_hours if worker.alive and uptime_hours else 0.0,
+                'last_cycle_seconds': status.get('last_cycle_seconds'),
+                'llm_state': (status.get('llm') or {}).get('state'),
+            })
+        uptime_seconds = time.time() - self.started_at
+        replies = sum(shop['replies'] for shop in shops)
+        return {
+            'capacity': self.capacity,
+            'skipped': self.skipped,
+            'uptime_seconds': uptime_seconds,
+            'replies': replies,
+            'replies_per_hour': replies / (uptime_seconds / 3600) if uptime_seconds else 0.0,
+            'alive': sum(shop['alive'] for shop in shops),
+            'shops': shops,
+        }
+
+    def print_report(self):
+        snap = self.snapshot()
+        print(f"協調器：執行中 {snap['alive']}/{len(self.workers)} 家，合計回覆 {snap['replies']} 則，"
+              f"約 {snap['replies_per_hour']:.1f} 則/小時")
+        for shop in snap['shops']:
+            state = '執行中' if shop['alive'] else '已停止'
+            print(f"  [{shop['name']}] {state}，登入 {shop['login_state']}，{shop['cycles']} 輪，"
+                  f"回覆 {shop['replies']} 則（{shop['replies_per_hour']:.1f} 則/小時），重啟 {shop['restarts']} 次")
+
+    def run(self, poll_interval=10, report_interval=60):
+        if self.skipped:
+            print(f"超出資源預算（同時 {self.capacity} 家），未啟動: {', '.join(self.skipped)}")
+        for i, worker in enumerate(self.workers):
+            if i:
+                time.sleep(COORDINATOR_STAGGER_SEC)
+            worker.start()
+        last_report = time.monotonic()
+        try:
+            while True:
+                time.sleep(poll_interval)
+                for worker in self.workers:
+                    if worker.alive:
+                        worker.poll_status()
+                    elif not worker.next_start:
+                        # 剛發現程序結束：執行不到 10 分鐘就結束時加倍等待（10 秒起，最多 5 分鐘）
+                        if time.time() - worker.started_at < 600:
+                            worker.quick_exits += 1
+                        else:
+                            worker.quick_exits = 0
+                        delay = min(300, 10 * 2 ** max(0, worker.quick_exits - 1))
+                        worker.next_start = time.time() + delay
+                        print(f"[{worker.name}] 程序結束（代碼 {worker.process.returncode}），{delay} 秒後重新啟動")
+                    elif time.time() >= worker.next_start:
+                        worker.restarts += 1
+                        worker.next_start = 0.0
+                        worker.start()
+                if time.monotonic() - last_report >= report_interval:
+                    self.print_report()
+                    last_report = time.monotonic()
+        finally:
+            for worker in self.workers:
+                worker.stop()
+
+def cli_bench_input(args):
+    """python main.py bench-input：量測回覆輸入方式的送出前時間"""
+    drivermanager = WebDriverManager()
+    try:
+        benchmark_reply_input(drivermanager)
+    finally:
+        drivermanager.driver.quit()
+    return 0
+
+def parse_importtime(stderr_text):
+    """
+    解析 python -X importtime 的輸出。只取最外層（直接匯入）的模組並使用累計時間，
+    由它間接載入的相依套件（例如 requests 帶入的 urllib3）都算在它的頭上。
+
+    :return: 頂層套件 -> 毫秒 的字典
+    """
+    totals = collections.Counter()
+    for line in stderr_text.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        parts = line[len('import time:'):].split('|')
+        if len(parts) != 3 or not parts[1].strip().isdigit():
+            continue  # 表頭
+        name = parts[2].rstrip()
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth != 0:
+            continue
+        totals[name.strip().split('.')[0]] += int(parts[1]) / 1000
+    return dict(totals)
+
+def cli_import_report(args):
+    """python main.py import-report [筆數]：列出各套件的匯入耗時，區分啟動時載入與延後載入"""
+    limit = int(args[0]) if args else 15
+    lazy_packages = {module_name.split('.')[0] for _, module_name, _ in _HEAVY_IMPORTS}
+    if getattr(sys, 'frozen', False):
+        # 封裝後的執行檔無法使用 -X importtime，改為在程式內量測延後載入的套件
+        ensure_heavy_imports()
+        for module_name, seconds in sorted(IMPORT_TIMES.items(), key=lambda item: -item[1]):
+            print(f"{module_name:<50} {seconds * 1000:8.1f} ms")
+        return 0
+    modules = ['PyQt5.QtCore', 'PyQt5.QtWidgets'] + [module_name for _, module_name, _ in _HEAVY_IMPORTS]
+    # 未安裝的套件略過，不影響其他套件的量測
+    code = '\n'.join(f'try:\n    import {module_name}\nexcept ImportError:\n    pass'
+                     for module_name in dict.fromkeys(modules))
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], capture_output=True, text=True)
+    if result.returncode != 0:
+        print(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else '匯入失敗')
+        return 1
+    totals = parse_importtime(result.stderr)
+    grand_total = sum(totals.values()) or 1
+    print(f"{'套件':<24} {'耗時':>10} {'占比':>6}  載入時機")
+    for package, ms in sorted(totals.items(), key=lambda item: -item[1])[:limit]:
+        timing = '延後' if package in lazy_packages else '啟動'
+        print(f"{package:<24} {ms:8.1f} ms {ms / grand_total:6.1%}  {timing}")
+    lazy_total = sum(ms for package, ms in totals.items() if package in lazy_packages)
+    print(f"合計 {grand_total:.0f} ms，其中延後載入 {lazy_total:.0f} ms（不再阻擋視窗顯示）")
+    return 0
+
+def cli_compile_ui(args):
+    """python main.py compile-ui：將 .ui 編譯為 Python 模組，並比較兩種方式的介面建立時間"""
+    compile_ui()
+    rounds = int(args[0]) if args else 5
+    app = QApplication.instance() or QApplication([])
+    from PyQt5 import uic
+    ui_class = load_compiled_ui()
+    timings = {}
+    for label, build in (('loadUi', lambda window: uic.loadUi(UI_FILE, window)),
+                         ('預先編譯', lambda window: ui_class().setupUi(window))):
+        durations = []
+        for _ in range(rounds):
+            window = QMainWindow()
+            start = time.perf_counter()
+            build(window)
+            durations.append(time.perf_counter() - start)
+            window.deleteLater()
+        timings[label] = sum(durations) / len(durations)
+        print(f"{label}: 平均 {timings[label] * 1000:.1f} ms（{rounds} 次）")
+    app.processEvents()
+    return 0
+
+def cli_bench_browser(args):
+    """python main.py bench-browser [網址] [次數]：比較預設與精簡模式瀏覽器的載入時間與記憶體（請先關閉主程式）"""
+    url = args[0] if args else "https://seller.shopee.tw/new-webchat/conversations"
+    rounds = int(args[1]) if len(args) > 1 else 3
+    profile_dir = os.environ.get('REAL_CHROME_PROFILE') or os.path.join(FILE_PATH, 'chrome_profile')
+    benchmark_browser_profiles(profile_dir, url, rounds=rounds)
+    return 0
+
+def cli_bench_llm(args):
+    """python main.py bench-llm [次數]：以同一段範例對話比較各 LLM 後端的回覆耗時"""
+    rounds = int(args[0]) if args else 3
+    api_key = read_database('database.db', 'chatgpt_api_key')
+    assistant_id = read_database('database.db', 'chatgpt_assistant_id')
+    sample = [
+        {"role": "user", "content": "請問這個商品還有現貨嗎？"},
+        {"role": "assistant", "content": "您好，目前有現貨喔！"},
+        {"role": "user", "content": "那今天下單大概什麼時候會出貨？"},
+    ]
+    for name in LLM_BACKENDS:
+        for _ in range(rounds):
+            try:
+                ChatGPT_Robot(api_key, assistant_id, sample, backend=name)
+            except Exception:
+                print(f"LLM 後端 {name} 呼叫失敗")
+    print_llm_latency_report()
+    return 0
+
+def cli_search(args):
+    """python main.py search <關鍵字> [客戶名稱]：搜尋本機保存的過往對話"""
+    if not args:
+        print("用法: python main.py search <關鍵字> [客戶名稱]")
+        return 2
+    rows = get_transcript_store().search(args[0], customer=args[1] if len(args) > 1 else None)
+    for customer, role, time_text, content in rows:
+        print(f"[{customer}] {'客人' if role == 'user' else '賣家'} {time_text}: {content}")
+    print(f"共 {len(rows)} 筆")
+    return 0
+
+def cli_serve(args):
+    """python main.py serve：無介面模式，從 settings.json 讀取設定並持續執行客服排程"""
+    global ACCOUNT_NUMBER, ACCOUNT_PASSWORD
+    setup_serve_logging(os.path.join(FILE_PATH, 'serve.log'))
+    expected_serial = read_database('database.db', 'expected_serial')
+    if not verify_license(expected_serial):
+        print("硬體ID驗證失敗，不允許執行程式。")
+        return 1
+    try:
+        settings = load_settings_file()
+    except FileNotFoundError:
+        print(f"找不到 {os.path.join(FILE_PATH, SETTINGS_FILE_NAME)}，請先以介面模式設定一次或手動建立")
+        return 2
+    ACCOUNT_NUMBER = os.environ.get('SHOPEE_ACCOUNT', settings.get('shoppe_account', ''))
+    ACCOUNT_PASSWORD = settings['shoppe_password']
+    start_status_server()
+
+    def login_status(status):
+        print(f"登入狀態: {status}")
+
+    session_probe = start_session_probe()
+    drivermanager = WebDriverManager()
+
+    def shutdown(signum, frame):
+        # 協調器停止店鋪時先關閉瀏覽器再結束，避免留下孤立的 Chrome
+        try:
+            drivermanager.close_standby()
+            drivermanager.driver.quit()
+        except Exception:
+            pass
+        os._exit(0)
+    signal.signal(signal.SIGTERM, shutdown)
+    if os.environ.get('SERVE_STDIN_CONTROL') == '1':
+        # 由協調器啟動：收到 stop 或 stdin 關閉（協調器已結束）時同樣關閉瀏覽器後結束
+        def stdin_control():
+            for line in sys.stdin.buffer:
+                if line.strip() == b'stop':
+                    break
+            shutdown(None, None)
+        Thread(target=stdin_control, name='stdin-control', daemon=True).start()
+    install_profile_signal()
+    # 與介面相同的流程，只是在目前執行緒執行（排程器會一直阻塞到程序結束）
+    MainThread(drivermanager, login_status, FileSettingsSignals(), session_probe).run()
+    return 1
+
+def engine_command_loop(channel, drivermanager):
+    """引擎子程序接收介面訊息：settings 更新 UI_STATUS_DATA；stop 或介面結束時關閉瀏覽器並結束程序"""
+    global UI_STATUS_DATA
+    while True:
+        try:
+            kind, data = channel.recv()
+        except (EOFError, OSError, ValueError):
+            kind, data = 'stop', None
+        if kind == 'settings':
+            UI_STATUS_DATA = settings_from_json(data)
+        elif kind == 'status':
+            channel.send('status', engine_status_snapshot())
+        elif kind == 'profile':
+            get_cycle_profiler().request(data)
+        elif kind == 'stop':
+            print("引擎程序結束")
+            sys.stdout.drain()
+            try:
+                drivermanager.close_standby()
+                drivermanager.driver.quit()
+            except Exception:
+                pass
+            os._exit(0)
+
+def cli_worker(args):
+    """python main.py worker：由介面啟動的引擎子程序，經 stdin/stdout 與介面交換訊息"""
+    global ACCOUNT_NUMBER, ACCOUNT_PASSWORD
+    # 保留原本的 stdout 作為訊息通道，fd 1 改指向 stderr，避免其他套件直接寫入而破壞訊息格式
+    channel = EngineChannel(os.fdopen(0, 'rb'), os.fdopen(os.dup(1), 'wb'))
+    os.dup2(2, 1)
+    sys.stdout = sys.stderr = ChannelLogStream(channel)
+
+    # 子程序也可被直接執行，不能只依賴介面端的驗證
+    expected_serial = read_database('database.db', 'expected_serial')
+    if not verify_license(expected_serial):
+        print("硬體ID驗證失敗，不允許執行程式。")
+        return 1
+
+    kind, data = channel.recv()
+    if kind != 'start':
+        return 2
+    ACCOUNT_NUMBER = data['account']
+    ACCOUNT_PASSWORD = data['password']
+
+    def login_status(status):
+        channel.send('login_status', {'status': status, 'login_state': LOGIN_STATE})
+
+    install_profile_signal()
+    session_probe = start_session_probe()
+    drivermanager = WebDriverManager()
+    Thread(target=engine_command_loop, args=(channel, drivermanager), name='engine-commands', daemon=True).start()
+    MainThread(drivermanager, login_status, ChannelSettingsSignals(channel), session_probe).run()
+    return 1
+
+def cli_coordinate(args):
+    """python main.py coordinate [shops.json]：為每家店啟動獨立的 serve 程序並彙整狀態"""
+    path = args[0] if args else os.path.join(FILE_PATH, 'shops.json')
+    expected_serial = read_database('database.db', 'expected_serial')
+    if not verify_license(expected_serial):
+        print("硬體ID驗證失敗，不允許執行程式。")
+        return 1
+    try:
+        shops = load_shop_configs(path)
+    except FileNotFoundError:
+        print(f"找不到店鋪設定檔 {path}")
+        return 2
+    coordinator = ShopCoordinator(shops)
+    start_status_server(snapshot=coordinator.snapshot)
+    coordinator.run()
+    return 0
+
+# 命令列子指令：python main.py <指令> [參數...]
+CLI_COMMANDS = {
+    'search': cli_search,
+    'bench-input': cli_bench_input,
+    'bench-llm': cli_bench_llm,
+    'bench-browser': cli_bench_browser,
+    'import-report': cli_import_report,
+    'compile-ui': cli_compile_ui,
+    'serve': cli_serve,
+    'worker': cli_worker,
+    'coordinate': cli_coordinate,
+}
+
 if __name__ == "__main__":
     global FILE_PATH
     
@@ -1830,17 +6064,35 @@ if __name__ == "__main__":
     
     documents_path = os.path.join(os.path.expanduser('~'), 'Documents')
     folder_name = '蝦皮聊聊智能客服'
-    FILE_PATH = os.path.join(documents_path, folder_name)
+    # 多店鋪協調器為每家店指定獨立的資料目錄
+    FILE_PATH = os.environ.get('SHOPEE_FILE_PATH') or os.path.join(documents_path, folder_name)
     if not os.path.exists(FILE_PATH):
         os.makedirs(FILE_PATH)
     logging.basicConfig(filename=os.path.join(FILE_PATH, 'app.log'), level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    # 命令列子指令（量測工具等）
+    if len(sys.argv) > 1 and sys.argv[1] in CLI_COMMANDS:
+        if sys.argv[1] not in ('import-report', 'compile-ui', 'coordinate'):
+            ensure_heavy_imports()
+        sys.exit(CLI_COMMANDS[sys.argv[1]](sys.argv[2:]))
+
+    # SHOPEE_HEADLESS=1 未載入 PyQt5，只能搭配子指令使用
+    if HEADLESS:
+        print(f"無介面模式（SHOPEE_HEADLESS=1）無法開啟視窗，請指定子指令：{', '.join(CLI_COMMANDS)}")
+        sys.exit(2)
     
     expected_serial = read_database('database.db', 'expected_serial')
-    if verify_cpu_serial(expected_serial):
+    if verify_license(expected_serial):
         print("硬體ID驗證成功，開始執行程式。")
         app = QApplication([])
         mainWindow = MyMainWindow()
         mainWindow.show()
+        startup_seconds = time.perf_counter() - _PROCESS_START
+        logging.info(f'視窗顯示耗時 {startup_seconds:.2f} 秒')
+        print(f"視窗顯示耗時 {startup_seconds:.2f} 秒（介面建立 {mainWindow.ui_build_seconds * 1000:.0f} ms，{mainWindow.ui_source}）")
+        if not ENGINE_PROCESS:
+            start_import_warmup()
+            install_profile_signal()
         app.exec_()
     else:
         print("硬體ID驗證失敗，不允許執行程式。")
\ No newline at end of file
@@ -1,12 +1,29 @@
 # -*- mode: python ; coding: utf-8 -*-
+import os
 
 
 a = Analysis(
     ['main.py'],
     pathex=[],
     binaries=[],
-    datas=[],
-    hiddenimports=[],
+    # 介面檔；打包前先執行 python main.py compile-ui 產生 Shopee_Customer_Service_ui.py
+    datas=[(f, '.') for f in ('Shopee_Customer_Service.ui', 'Shopee_Customer_Service_ui.py') if os.path.exists(f)],
+    # main.py 以 importlib 延後載入的套件，PyInstaller 無法自動偵測
+    hiddenimports=[
+        'selenium.webdriver',
+        'selenium.webdriver.common.by',
+        'selenium.webdriver.common.keys',
+        'selenium.webdriver.chrome.service',
+        'selenium.webdriver.support.ui',
+        'selenium.webdriver.support.expected_conditions',
+        'selenium.common.exceptions',
+        'webdriver_manager.chrome',
+        'apscheduler.schedulers.blocking',
+        'undetected_chromedriver',
+        'openai',
+        'bs4',
+        'requests',
+    ],
     hookspath=[],
     hooksconfig={},
     runtime_hooks=[],